@@ -0,0 +1,86 @@
+"""
+適応的な再試行方針（utils/retry_policy.py）の効果の計測
+- 深いパスほど不合格になりやすいスタブサーバ（--depth-invalid-rate）に対して、毎回別の合成コーパスでdegapを繰り返し、
+  固定の生成回数（--no-adaptive-retry）と適応的な再試行方針で、合格した中間プログラム1つあたりのLLM呼び出し回数を比べる
+- 生成結果キャッシュ・ライブラリは使わない（再試行方針の記録・モデルの記録だけが回をまたいで残る）
+
+実行例: python bench/bench_retry.py --rounds 4 --files 12 --depth-invalid-rate 3=1.0 --depth-invalid-rate 2=0.5
+結果はJSONで標準出力に出す
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.corpus_gen import generate_corpus  # noqa: E402
+from bench.run_bench import MAIN, stub_stats  # noqa: E402
+from bench.stub_ollama import StubConfig, start_server  # noqa: E402
+
+
+def manifest_counts(workdir):
+    """result/manifest.jsonの状態ごとのジョブ数"""
+    try:
+        with open(os.path.join(workdir, "result", "manifest.json"), "r", encoding="utf-8") as f:
+            jobs = json.load(f).get("jobs", {})
+    except (OSError, ValueError):
+        return {}
+    counts = {}
+    for entry in jobs.values():
+        counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+    return counts
+
+
+def bench_mode(adaptive, args, depth_rates):
+    workdir = tempfile.mkdtemp(prefix="degap_retry_")
+    server, base_url = start_server(0, StubConfig(latency=args.latency, invalid_rate=args.invalid_rate, seed=args.seed,
+                                                  depth_invalid_rates=depth_rates))
+    env = dict(os.environ, OLLAMA_HOST=base_url)
+    degap_args = ["--degap", "--jobs", str(args.jobs), "--no-cache", "--no-library"]
+    if not adaptive:
+        degap_args.append("--no-adaptive-retry")
+    rounds = []
+    try:
+        for r in range(args.rounds):
+            sample_dir = os.path.join(workdir, "sample")
+            shutil.rmtree(sample_dir, ignore_errors=True)
+            generate_corpus(sample_dir, files=args.files, min_gap=1, max_gap=4, seed=args.seed + r)
+            before = stub_stats(base_url)
+            subprocess.run([sys.executable, MAIN] + degap_args, cwd=workdir, env=env,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            calls = stub_stats(base_url)["generate"] - before["generate"]
+            counts = manifest_counts(workdir)
+            solved = counts.get("ok", 0)
+            rounds.append({"round": r + 1, "llm_calls": calls, "solved": solved, "failed": counts.get("failed", 0),
+                           "calls_per_solved": calls / solved if solved else None})
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+    calls = sum(r["llm_calls"] for r in rounds)
+    solved = sum(r["solved"] for r in rounds)
+    return {"rounds": rounds, "llm_calls": calls, "solved": solved, "calls_per_solved": calls / solved if solved else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="適応的な再試行方針の効果の計測")
+    parser.add_argument("--rounds", type=int, default=4)
+    parser.add_argument("--files", type=int, default=12)
+    parser.add_argument("--jobs", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--invalid-rate", type=float, default=0.2)
+    parser.add_argument("--depth-invalid-rate", action="append", default=[], metavar="DEPTH=RATE",
+                        help="必須要素の深さごとの不合格の割合（省略時は 3=1.0 と 2=0.5）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    depth_rates = {int(d): float(r) for d, r in (spec.split("=", 1) for spec in args.depth_invalid_rate)} or {3: 1.0, 2: 0.5}
+    results = {"fixed": bench_mode(False, args, depth_rates), "adaptive": bench_mode(True, args, depth_rates)}
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+解析バックエンド（tokenize / scan）のスループット比較
+- 合成プログラム（ブロック文・内包表記・文字列・コメントなどを含む）をつなげた大きなファイルを作り、
+  各バックエンドで繰り返し解析したときの行/秒・MB/秒を測る
+
+実行例: python bench/bench_scanner.py --lines 20000 --files 5 --repeat 3
+結果はJSONで標準出力に出す
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.fuzz_scanner import random_program  # noqa: E402
+from utils import analysis_engine  # noqa: E402
+
+
+def large_file(rng, lines):
+    """合成プログラムを最上位でつなげて、約lines行のコードを作る"""
+    parts = []
+    count = 0
+    while count < lines:
+        code = random_program(rng)
+        if not code.endswith("\n"):
+            code += "\n"
+        parts.append(code)
+        count += code.count("\n")
+    return "".join(parts)
+
+
+def bench_backend(codes, backend, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for code in codes:
+            analysis_engine.analyze(code, backend=backend)
+    elapsed = time.perf_counter() - start
+    lines = repeat * sum(code.count("\n") for code in codes)
+    size = repeat * sum(len(code.encode("utf-8")) for code in codes)
+    return {"sec": elapsed, "lines_per_sec": lines / elapsed, "mb_per_sec": size / elapsed / 1e6}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="解析バックエンドのスループット比較")
+    parser.add_argument("--lines", type=int, default=20000, help="1ファイルの行数")
+    parser.add_argument("--files", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    codes = [large_file(rng, args.lines) for _ in range(args.files)]
+    results = {backend: bench_backend(codes, backend, args.repeat) for backend in analysis_engine.BACKENDS}
+    results["speedup"] = results["tokenize"]["sec"] / results["scan"]["sec"]
+    results["lines"] = sum(code.count("\n") for code in codes)
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+起動時間・解析スループットのベンチマーク
+- CLI起動: python main.py --detect-gaps / <file> --paths の実行時間と、requestsが読み込まれるか
+- 解析スループット: sample/*.py を繰り返し解析したときのファイル/秒
+  （旧実装 = 解析ごとにmain.pyをexec_moduleする方式との比較）
+
+実行例: python bench/bench_startup.py --repeat 20
+結果はJSONで標準出力に出す
+"""
+import argparse
+import importlib.util
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils import parser_tokenize  # noqa: E402
+
+
+def legacy_get_control_elements():
+    """旧実装: 解析のたびにmain.pyをexec_moduleして語彙を取得する"""
+    spec = importlib.util.find_spec('main')
+    main_mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(main_mod)
+    return set(main_mod.CONTROL_ELEMENTS)
+
+
+def bench_cli(args, repeat):
+    """CLIをサブプロセスで起動し、平均実行時間を測る"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "main.py"] + args, cwd=ROOT,
+                       stdout=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return {"args": args, "mean_sec": sum(times) / len(times), "min_sec": min(times)}
+
+
+def loads_http_stack(args):
+    """指定のCLI処理を行ったあとにrequestsが読み込まれているか"""
+    code = (
+        "import sys; sys.argv = ['main.py'] + %r; import main, io, contextlib\n"
+        "with contextlib.redirect_stdout(io.StringIO()): main.main()\n"
+        "print('requests' in sys.modules)" % (args,)
+    )
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT,
+                         capture_output=True, text=True, check=True)
+    return out.stdout.strip() == "True"
+
+
+def bench_parse(codes, repeat, legacy=False):
+    """全サンプルをrepeat回解析し、ファイル/秒を返す"""
+    original = parser_tokenize.get_control_elements
+    if legacy:
+        parser_tokenize.get_control_elements = legacy_get_control_elements
+    try:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for code in codes:
+                tree = parser_tokenize.parse_control_structure_tree(code)
+                parser_tokenize.tree_to_paths(tree)
+        elapsed = time.perf_counter() - start
+    finally:
+        parser_tokenize.get_control_elements = original
+    n = repeat * len(codes)
+    return {"files": n, "sec": elapsed, "files_per_sec": n / elapsed if elapsed else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="起動時間・解析スループットのベンチマーク")
+    parser.add_argument("--repeat", type=int, default=10, help="CLI起動・解析の繰り返し回数")
+    repeat = parser.parse_args().repeat
+    os.chdir(ROOT)
+    codes = []
+    for path in sorted(glob.glob("sample/*.py")):
+        with open(path, 'r', encoding='utf-8') as f:
+            codes.append(f.read())
+    results = {
+        "cli": [
+            bench_cli(["--detect-gaps"], repeat),
+            bench_cli(["sample/10.py", "--paths"], repeat),
+        ],
+        "loads_requests": {
+            "--detect-gaps": loads_http_stack(["--detect-gaps"]),
+            "--paths": loads_http_stack(["sample/10.py", "--paths"]),
+        },
+        "parse": {
+            "registry": bench_parse(codes, repeat),
+            "legacy_exec_module": bench_parse(codes, max(1, repeat // 10), legacy=True),
+        },
+    }
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
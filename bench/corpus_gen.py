@@ -0,0 +1,136 @@
+"""
+ベンチマーク用の合成コーパス生成
+- 制御構文（if/elif/else/for/break/continue）のランダムなツリーからPythonプログラムを生成する
+- ファイルごとの新規要素数（ギャップ）を指定の範囲に収めたコーパスを作る
+
+実行例: python bench/corpus_gen.py out_dir --files 500 --max-gap 3 --seed 1
+"""
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils import analysis_engine  # noqa: E402
+
+
+def random_tree(rng, max_depth=3, max_children=3, in_loop=False):
+    """文法（elif/elseはif/elifの後、break/continueはfor内、子を持てない）を満たすランダムなツリー"""
+    nodes = []
+    for _ in range(rng.randint(1, max_children)):
+        kinds = ['if', 'for']
+        if in_loop:
+            kinds += ['break', 'continue']
+        kind = rng.choice(kinds)
+        if kind in ('break', 'continue'):
+            nodes.append({'type': kind, 'children': []})
+            break  # break/continue以降のノードは到達しないので置かない
+        children = random_tree(rng, max_depth - 1, max_children, in_loop or kind == 'for') if max_depth > 1 and rng.random() < 0.6 else []
+        nodes.append({'type': kind, 'children': children})
+        if kind == 'if':
+            for tail in ('elif', 'else'):
+                if rng.random() < 0.35:
+                    children = random_tree(rng, max_depth - 1, max_children, in_loop) if max_depth > 1 and rng.random() < 0.4 else []
+                    nodes.append({'type': tail, 'children': children})
+    return nodes
+
+
+def path_to_tree(path):
+    """パス（例: for/elif/break）を含む最小のツリー（elif/elseの前にはifを補う）"""
+    tree = []
+    level = tree
+    for part in path.split('/'):
+        if part in ('elif', 'else'):
+            level.append({'type': 'if', 'children': []})
+        node = {'type': part, 'children': []}
+        level.append(node)
+        level = node['children']
+    return tree
+
+
+def tree_to_code(tree, indent=0, counter=None):
+    """ツリーをPythonコードにする（ブロックが空ならprintを置く）"""
+    counter = counter if counter is not None else [0]
+    pad = "    " * indent
+    lines = []
+    for node in tree:
+        counter[0] += 1
+        n = counter[0]
+        kind = node['type']
+        if kind in ('break', 'continue'):
+            lines.append(f"{pad}{kind}")
+            continue
+        if kind == 'if':
+            lines.append(f"{pad}if x > {n}:")
+        elif kind == 'elif':
+            lines.append(f"{pad}elif x < {n}:")
+        elif kind == 'else':
+            lines.append(f"{pad}else:")
+        elif kind == 'for':
+            lines.append(f"{pad}for x in range({n % 5 + 2}):")
+        if node['children']:
+            lines.append(tree_to_code(node['children'], indent + 1, counter))
+        else:
+            lines.append(f"{pad}    print({n})")
+    return "\n".join(lines)
+
+
+def program_for_tree(tree):
+    return "x = 3\n" + tree_to_code(tree) + "\n"
+
+
+def program_for_paths(paths):
+    """パスのリストをすべて含むプログラム（スタブサーバの応答用）"""
+    tree = []
+    for path in paths:
+        tree.extend(path_to_tree(path))
+    return program_for_tree(tree)
+
+
+def generate_corpus(out_dir, files=100, min_gap=0, max_gap=3, seed=0, max_depth=3, tries=200):
+    """
+    out_dirに files 個のプログラム（0001.py〜）を書き出す
+    各ファイルのギャップ（それまでのファイルにない新規パス数）がmin_gap〜max_gapになるように生成する
+    （指定範囲のツリーがtries回で見つからなければ最後の候補を使う）
+    Returns: ファイルごとのギャップのリスト
+    """
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    learned = set()
+    gaps = []
+    for i in range(files):
+        target = rng.randint(min_gap, max_gap)
+        best = None
+        for _ in range(tries):
+            code = program_for_tree(random_tree(rng, max_depth))
+            paths = set(analysis_engine.analyze(code)['paths'])
+            gap = len(paths - learned)
+            if best is None or abs(gap - target) < abs(best[1] - target):
+                best = (code, gap, paths)
+            if gap == target:
+                break
+        code, gap, paths = best
+        with open(os.path.join(out_dir, f"{i+1:04d}.py"), "w", encoding="utf-8") as f:
+            f.write(code)
+        learned |= paths
+        gaps.append(gap)
+    return gaps
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="合成コーパスを生成する")
+    parser.add_argument("out_dir")
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--min-gap", type=int, default=0)
+    parser.add_argument("--max-gap", type=int, default=3)
+    parser.add_argument("--max-depth", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    gaps = generate_corpus(args.out_dir, args.files, args.min_gap, args.max_gap, args.seed, args.max_depth)
+    print(f"{len(gaps)} files, gaps >= 2: {sum(1 for g in gaps if g >= 2)}, generations needed: {sum(max(0, g - 1) for g in gaps)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+高速スキャナ（utils/control_scanner.py）とtokenize版（analysis_engine.analyze_tokens）の差分ファジング
+- 制御構文のブロックに加えて、内包表記・条件式・キーワードを含む文字列やコメント・複数行の括弧・行継続・
+  ; で区切った文・1行の複合文・タブのインデントなどを含むランダムなプログラムを生成する
+- 期待値は、tokenize版のトークン列から文の先頭以外の制御キーワードを別の名前に置き換えて解析した結果
+  （ブロック文だけのプログラムではtokenize版の結果そのもの）
+- 行単位で途中まで切ったコード（partial=True）も比較する
+- 不一致があればそのプログラムを表示して終了コード1で終わる
+
+実行例: python bench/fuzz_scanner.py --iterations 2000 --seed 1
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import tokenize
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.corpus_gen import random_tree, tree_to_code  # noqa: E402
+from utils import analysis_engine, control_elements, control_scanner  # noqa: E402
+
+# 文の先頭以外の場所に置く式・文（キーワードを含む文字列・内包表記・条件式など）
+EXPRESSIONS = [
+    "x = [i for i in range(3) if i else 0]",
+    "y = a if b else c",
+    "z = {k: v for k, v in d.items()}",
+    "s = 'if x: for y in z: break'",
+    's = "else: # not a comment"',
+    "s = r'\\d+' + 'continue'",
+    "t = f'{a if b else c}'",
+    "f = lambda v: v if v else None",
+    "n: int = 1 if ok else 2",
+    "w = (1 if a\n     else 2)",
+    "call(a,\n     [j for j in k],\n     b)",
+    "total = 1 + \\\n    2",
+    "doc = '''\nif a:\n    for b in c:\n'''",
+    'doc = """else:\n  # if\n"""',
+    "p = x[1:2] ; q = {'a': 1}",
+    "print('#', end='')",
+    "v = not x and (y or z)",
+    "elif_count = for_each = 0",
+]
+
+
+def random_block(rng, indent, unit, depth, in_loop):
+    """ランダムなブロック（行のリスト）"""
+    pad = unit * indent
+    lines = []
+    for _ in range(rng.randint(1, 4)):
+        r = rng.random()
+        if depth > 0 and r < 0.45:
+            kind = rng.choice(["if", "for", "while", "def", "class", "try", "with", "async"])
+            if kind == "if":
+                cond = rng.choice(["a", "b > 1", "(c and\n" + pad + "        d)"])
+                lines.append(f"{pad}if {cond}:  # if")
+                lines += random_block(rng, indent + 1, unit, depth - 1, in_loop)
+                for tail in ("elif x", "else"):
+                    if rng.random() < 0.4:
+                        lines.append(f"{pad}{tail}:")
+                        lines += random_block(rng, indent + 1, unit, depth - 1, in_loop)
+            elif kind == "for":
+                lines.append(f"{pad}for i in {rng.choice(['range(3)', '[a for a in b]', 'x if y else z'])}:")
+                lines += random_block(rng, indent + 1, unit, depth - 1, True)
+                if rng.random() < 0.2:
+                    lines.append(f"{pad}else:")
+                    lines += random_block(rng, indent + 1, unit, depth - 1, in_loop)
+            elif kind == "while":
+                lines.append(f"{pad}while cond:")
+                lines += random_block(rng, indent + 1, unit, depth - 1, True)
+            elif kind == "def":
+                lines.append(f"{pad}def f(a: int = 1 if x else 2,\n{pad}      b=None) -> int:")
+                lines += random_block(rng, indent + 1, unit, depth - 1, False)
+            elif kind == "class":
+                lines.append(f"{pad}class C(Base):")
+                lines += random_block(rng, indent + 1, unit, depth - 1, False)
+            elif kind == "try":
+                lines.append(f"{pad}try:")
+                lines += random_block(rng, indent + 1, unit, depth - 1, in_loop)
+                lines.append(f"{pad}except ValueError:")
+                lines += random_block(rng, indent + 1, unit, depth - 1, in_loop)
+                if rng.random() < 0.5:
+                    lines.append(f"{pad}else:")
+                    lines += random_block(rng, indent + 1, unit, depth - 1, in_loop)
+            else:
+                lines.append(f"{pad}async for item in source:")
+                lines += random_block(rng, indent + 1, unit, depth - 1, True)
+        elif r < 0.55:
+            # 1行の複合文
+            body = rng.choice(["break", "continue", "pass"] if in_loop else ["pass", "x = 1"])
+            lines.append(f"{pad}{rng.choice(['if a', 'for i in b', 'else', 'while c'])}: {body}")
+        elif r < 0.62 and in_loop:
+            lines.append(f"{pad}{rng.choice(['break', 'continue'])}")
+        elif r < 0.67:
+            lines.append(rng.choice(["", "# comment: if x", f"{pad}# else"]))
+            lines.append(f"{pad}pass")
+        else:
+            text = rng.choice(EXPRESSIONS)
+            lines.append(pad + text.replace("\n", "\n" + pad) if "'''" not in text and '"""' not in text else pad + text)
+    return lines
+
+
+def random_program(rng):
+    unit = rng.choice(["    ", "  ", "\t"])
+    lines = random_block(rng, 0, unit, rng.randint(1, 4), False)
+    code = "\n".join(lines)
+    return code + rng.choice(["\n", "", "\n\n", "\n# end"])
+
+
+def statement_tokens(tokens):
+    """文の先頭（論理行の先頭・; の直後・括弧の外の : の直後）以外の制御キーワードを別の名前に置き換える"""
+    keywords = control_elements.get_control_elements()
+    depth = 0
+    leading = True
+    for token in tokens:
+        if token.type == tokenize.NAME and token.string in keywords and not leading:
+            token = token._replace(string="_" + token.string)
+        yield token
+        if token.type in (tokenize.NL, tokenize.COMMENT, tokenize.ENCODING):
+            continue
+        if token.type in (tokenize.NEWLINE, tokenize.INDENT, tokenize.DEDENT):
+            leading = True
+        elif token.type == tokenize.OP and token.string in "([{":
+            depth += 1
+            leading = False
+        elif token.type == tokenize.OP and token.string in ")]}":
+            depth = max(0, depth - 1)
+            leading = False
+        elif token.type == tokenize.OP and token.string in (";", ":") and depth == 0:
+            leading = True
+        elif not (token.type == tokenize.NAME and token.string == "async" and leading):
+            leading = False
+
+
+def expected(code, partial=False):
+    tokens = tokenize.tokenize(io.BytesIO(code.encode("utf-8")).readline)
+    return analysis_engine.analyze_tokens(statement_tokens(tokens), partial=partial)
+
+
+def outcome(func, *args, **kwargs):
+    """結果、または送出した例外の型を返す"""
+    try:
+        return func(*args, **kwargs)
+    except analysis_engine.PARTIAL_ERRORS as e:
+        return type(e).__name__
+
+
+def check(code, partial=False):
+    want = outcome(expected, code, partial=partial)
+    got = outcome(control_scanner.scan, code, partial=partial)
+    # 両方が例外を送出した場合は一致とみなす（どちらの例外を先に検出するかは実装によって異なる）
+    if isinstance(want, str) and isinstance(got, str):
+        return True
+    return want == got
+
+
+def main():
+    parser = argparse.ArgumentParser(description="高速スキャナとtokenize版の差分ファジング")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    cases = 0
+    for i in range(args.iterations):
+        code = random_program(rng)
+        lines = code.split("\n")
+        cut = "\n".join(lines[:rng.randint(0, len(lines))]) + "\n"
+        for text, partial in ((code, False), (code, True), (cut, True)):
+            cases += 1
+            if not check(text, partial):
+                print(f"不一致（{i}件目, partial={partial}）:\n{text}")
+                print("期待:", outcome(expected, text, partial=partial))
+                print("結果:", outcome(control_scanner.scan, text, partial=partial))
+                sys.exit(1)
+        # ブロック文だけのプログラムはtokenize版の結果とそのまま一致する
+        block_code = tree_to_code(random_tree(rng, max_depth=4))
+        cases += 1
+        if control_scanner.scan(block_code) != analysis_engine.analyze(block_code, backend="tokenize"):
+            print(f"不一致（{i}件目, ブロック文のみ）:\n{block_code}")
+            sys.exit(1)
+    print(f"OK: {cases}ケース（プログラム {args.iterations}件）で一致")
+
+
+if __name__ == "__main__":
+    main()
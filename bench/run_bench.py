@@ -0,0 +1,158 @@
+"""
+エンドツーエンドのベンチマーク
+- 解析スループット: 合成コーパスを解析したときのファイル/秒
+- ギャップ検出: python main.py --detect-gaps の実行時間（並列数・インデックスなし/ありで比較）
+- degap: スタブサーバ（bench/stub_ollama.py）に対する python main.py --degap の実行時間とLLM呼び出し回数
+  （キャッシュ・ライブラリなしの初回と、それらが効く2回目）
+
+実行例: python bench/run_bench.py --files 500 --degap-files 30 --latency 0.05 --output bench.json --history bench_history.jsonl
+結果はJSONで標準出力（--outputでファイル）に出し、--historyを指定すると1行のJSONとして追記する
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.corpus_gen import generate_corpus  # noqa: E402
+from bench.stub_ollama import StubConfig, start_server  # noqa: E402
+from utils import analysis_engine  # noqa: E402
+
+MAIN = os.path.join(ROOT, "main.py")
+
+
+def run_main(args, cwd, env=None):
+    """作業ディレクトリcwdでmain.pyを実行し、実行時間（秒）を返す"""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, MAIN] + args, cwd=cwd, env=env,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start
+
+
+def bench_parse(corpus_dir, repeat):
+    """コーパス全体をrepeat回解析し、ファイル/秒を返す"""
+    codes = []
+    for path in sorted(glob.glob(os.path.join(corpus_dir, "*.py"))):
+        with open(path, "r", encoding="utf-8") as f:
+            codes.append(f.read())
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for code in codes:
+            analysis_engine.analyze(code)
+    elapsed = time.perf_counter() - start
+    n = repeat * len(codes)
+    return {"files": n, "sec": elapsed, "files_per_sec": n / elapsed if elapsed else None}
+
+
+def bench_detect_gaps(workdir, jobs_list):
+    """並列数ごとに、インデックスなし（cold）とあり（warm）の--detect-gapsの実行時間を測る"""
+    results = []
+    for jobs in jobs_list:
+        shutil.rmtree(os.path.join(workdir, ".degap_cache"), ignore_errors=True)
+        args = ["--detect-gaps", "corpus", "--jobs", str(jobs)]
+        cold = run_main(args, workdir)
+        warm = run_main(args, workdir)
+        results.append({"jobs": jobs, "cold_sec": cold, "warm_sec": warm})
+    return results
+
+
+def stub_stats(base_url):
+    with urllib.request.urlopen(f"{base_url}/stats") as response:
+        return json.load(response)
+
+
+def bench_degap(workdir, files, seed, jobs, config):
+    """合成コーパスをsample/に置き、スタブサーバに対してdegapを2回実行する"""
+    sample_dir = os.path.join(workdir, "sample")
+    shutil.rmtree(sample_dir, ignore_errors=True)
+    gaps = generate_corpus(sample_dir, files=files, min_gap=1, max_gap=4, seed=seed)
+    server, base_url = start_server(0, config)
+    env = dict(os.environ, OLLAMA_HOST=base_url)
+    args = ["--degap", "--jobs", str(jobs)]
+    runs = []
+    try:
+        for label in ("cold", "warm"):
+            before = stub_stats(base_url)
+            elapsed = run_main(args, workdir, env=env)
+            after = stub_stats(base_url)
+            runs.append({
+                "run": label,
+                "sec": elapsed,
+                "llm_calls": after["generate"] - before["generate"],
+                "stats": {k: after[k] - before[k] for k in after},
+                "generated_files": len(glob.glob(os.path.join(workdir, "result", "*.py"))),
+            })
+    finally:
+        server.shutdown()
+    return {
+        "files": files,
+        "jobs": jobs,
+        "required_generations": sum(max(0, g - 1) for g in gaps),
+        "runs": runs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="エンドツーエンドのベンチマーク")
+    parser.add_argument("--files", type=int, default=300, help="解析・ギャップ検出用コーパスのファイル数")
+    parser.add_argument("--repeat", type=int, default=3, help="解析スループットの繰り返し回数")
+    parser.add_argument("--jobs", default="1,4", help="ギャップ検出の並列数（,区切り）")
+    parser.add_argument("--degap-files", type=int, default=20, help="degap用コーパスのファイル数（0ならdegapを測らない）")
+    parser.add_argument("--degap-jobs", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.05, help="スタブサーバの応答遅延（秒）")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--invalid-rate", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="結果のJSONの出力先")
+    parser.add_argument("--history", help="結果を1行のJSONとして追記するファイル（JSONL）")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="degap_bench_")
+    try:
+        corpus_dir = os.path.join(workdir, "corpus")
+        gaps = generate_corpus(corpus_dir, files=args.files, seed=args.seed)
+        results = {
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "commit": git_commit(),
+            "params": vars(args),
+            "corpus": {"files": len(gaps), "required_generations": sum(max(0, g - 1) for g in gaps)},
+            "parse": bench_parse(corpus_dir, args.repeat),
+            "detect_gaps": bench_detect_gaps(workdir, [int(j) for j in args.jobs.split(",")]),
+        }
+        if args.degap_files > 0:
+            config = StubConfig(latency=args.latency, failure_rate=args.failure_rate,
+                                invalid_rate=args.invalid_rate, seed=args.seed)
+            results["degap"] = bench_degap(workdir, args.degap_files, args.seed, args.degap_jobs, config)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    if args.history:
+        with open(args.history, "a", encoding="utf-8") as f:
+            f.write(json.dumps(results, ensure_ascii=False) + "\n")
+    print(text)
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+if __name__ == "__main__":
+    main()
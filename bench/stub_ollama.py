@@ -0,0 +1,295 @@
+"""
+ベンチマーク・動作確認用のOllama互換スタブサーバ
+- /api/generate・/api/chat（stream: true/false）に応答する。プロンプトの「Required elements」から、その要素を含むコードを返す
+- 応答の遅延・失敗率（HTTP 500）・不合格コード（必須要素を含まないコード）の割合を設定できる
+- /stats で受け付けたリクエスト数などをJSONで返す（LLM呼び出し回数の計測用）
+- /api/ps・/api/tags で読み込み済みのモデル（リクエストで使われたモデル・preloaded）を返す。
+  読み込まれていないモデルの最初のリクエストにはload_latencyの遅延を加える（複数ホストへの分散の確認用）
+- prompt_eval_countは直近のプロンプトと先頭が一致しない部分の語数（サーバ側のプロンプトキャッシュを模したもの）
+
+実行例: python bench/stub_ollama.py --port 11434 --latency 0.5 --invalid-rate 0.3
+"""
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.corpus_gen import program_for_paths  # noqa: E402
+
+REQUIRED_PATTERN = re.compile(r"Required elements: (.*)")
+
+
+class StubConfig:
+    def __init__(self, latency=0.2, token_latency=0.0, failure_rate=0.0, invalid_rate=0.0,
+                 think_tokens=20, trailing_tokens=20, seed=None, model_invalid_rates=None, crash_rate=0.0,
+                 depth_invalid_rates=None, structured=True, load_latency=0.0, preloaded=None):
+        """
+        Args:
+            latency (float): 応答全体の基本遅延（秒）
+            token_latency (float): ストリーミング時の1チャンクあたりの遅延（秒）
+            failure_rate (float): HTTP 500を返す割合
+            invalid_rate (float): 必須要素を含まないコード（不合格になるコード）を返す割合
+            think_tokens (int): <think>...</think>に入れる語数
+            trailing_tokens (int): コードブロックの後に付ける説明文の語数
+            seed (int): 乱数のseed
+            model_invalid_rates (dict): モデル名 → invalid_rate（モデルごとに不合格の割合を変える場合）
+            crash_rate (float): 制御構文は条件を満たすが実行時に例外になるコードを返す割合
+            depth_invalid_rates (dict): 必須要素の深さ → invalid_rate（モデルごとの割合と大きい方を使う。深いパスほど難しい場合）
+            structured (bool): think・formatの指定に対応する（Falseなら指定されたリクエストに400を返す。古いサーバ・非対応モデルの模擬）
+            load_latency (float): 読み込まれていないモデルの最初のリクエストに加える遅延（秒）
+            preloaded (list): 起動時に読み込み済みとするモデル
+        """
+        self.latency = latency
+        self.token_latency = token_latency
+        self.failure_rate = failure_rate
+        self.invalid_rate = invalid_rate
+        self.think_tokens = think_tokens
+        self.trailing_tokens = trailing_tokens
+        self.model_invalid_rates = dict(model_invalid_rates or {})
+        self.crash_rate = crash_rate
+        self.depth_invalid_rates = {int(d): r for d, r in (depth_invalid_rates or {}).items()}
+        self.structured = structured
+        self.load_latency = load_latency
+        self.loaded = set(preloaded or [])
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "generate": 0, "chat": 0, "failures": 0, "invalid": 0, "crash": 0, "aborted": 0,
+                      "prompt_eval_tokens": 0, "structured": 0, "rejected_structured": 0, "model_loads": 0}
+        # モデルごとの直近のプロンプト（先頭が一致する部分は評価済みとして扱う）
+        self.prompt_cache = {}
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def load(self, model):
+        """モデルを読み込み済みにし、読み込みにかかる遅延（秒）を返す"""
+        with self.lock:
+            if model in self.loaded:
+                return 0.0
+            self.loaded.add(model)
+            self.stats["model_loads"] += 1
+            return self.load_latency
+
+    def prompt_eval(self, model, tokens, slots=4):
+        """
+        サーバ側のプロンプトキャッシュを模して、評価が必要なトークン数を返す
+        直近slots件のプロンプトと先頭から一致する部分は評価しない（語単位で数える）
+        """
+        with self.lock:
+            recent = self.prompt_cache.setdefault(model, [])
+            cached = 0
+            for previous in recent:
+                n = 0
+                for a, b in zip(previous, tokens):
+                    if a != b:
+                        break
+                    n += 1
+                cached = max(cached, n)
+            recent.insert(0, tokens)
+            del recent[slots:]
+            count = len(tokens) - cached
+            self.stats["prompt_eval_tokens"] += count
+            return count
+
+    def roll(self, rate):
+        with self.lock:
+            return self.rng.random() < rate
+
+
+def build_response_text(prompt, config, model=None, think=True, structured=False):
+    """
+    プロンプトの必須要素からAIの応答テキスト（<think>・コードブロック・説明文）を作る
+    think: Falseなら<think>を付けない / structured: Trueなら{"code": ...}のJSONだけを返す
+    """
+    match = REQUIRED_PATTERN.search(prompt)
+    required = [e.strip() for e in match.group(1).split(",") if e.strip()] if match else []
+    invalid_rate = config.model_invalid_rates.get(model, config.invalid_rate)
+    depth = max((p.count("/") + 1 for p in required), default=0)
+    invalid_rate = max(invalid_rate, config.depth_invalid_rates.get(depth, 0.0))
+    if required and not config.roll(invalid_rate):
+        code = program_for_paths(required)
+        if config.roll(config.crash_rate):
+            config.count("crash")
+            code += "print(x // 0)\n"
+    else:
+        config.count("invalid")
+        code = "x = 3\nprint(x)\n"
+    if structured:
+        return json.dumps({"code": code})
+    trailing = " ".join(["done"] * config.trailing_tokens)
+    if not think:
+        return f"```python\n{code}```\n{trailing}"
+    think_text = " ".join(["hmm"] * config.think_tokens)
+    return f"<think>{think_text}</think>\n```python\n{code}```\n{trailing}"
+
+
+def split_chunks(text, size=8):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            with self.config.lock:
+                self._send_json(dict(self.config.stats))
+        elif self.path in ("/api/ps", "/api/tags"):
+            with self.config.lock:
+                self._send_json({"models": [{"name": m, "model": m} for m in sorted(self.config.loaded)]})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        config = self.config
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        config.count("requests")
+        if self.path == "/api/generate":
+            prompt = body.get("prompt", "")
+        elif self.path == "/api/chat":
+            config.count("chat")
+            prompt = "\n".join(f"{m.get('role')}: {m.get('content', '')}" for m in body.get("messages", []))
+        else:
+            self._send_json({"error": "not found"}, status=404)
+            return
+        config.count("generate")
+        structured = body.get("format") is not None
+        if (structured or "think" in body) and not config.structured:
+            config.count("rejected_structured")
+            self._send_json({"error": f"\"{body.get('model')}\" does not support thinking"}, status=400)
+            return
+        if structured:
+            config.count("structured")
+        if config.roll(config.failure_rate):
+            config.count("failures")
+            time.sleep(config.latency)
+            self._send_json({"error": "stub failure"}, status=500)
+            return
+        time.sleep(config.load(body.get("model")))
+        text = build_response_text(prompt, config, body.get("model"), think=body.get("think", True), structured=structured)
+        prompt_eval_count = config.prompt_eval(body.get("model"), prompt.split())
+        start = time.perf_counter()
+        if not body.get("stream", True):
+            time.sleep(config.latency + config.token_latency * len(split_chunks(text)))
+            self._send_json(self._final(body, text, start, prompt_eval_count))
+            return
+        self._stream(body, text, start, prompt_eval_count)
+
+    def _message(self, body, text, done):
+        """エンドポイントに合わせた応答（/api/generateはresponse、/api/chatはmessage）"""
+        if self.path == "/api/chat":
+            return {"model": body.get("model"), "message": {"role": "assistant", "content": text}, "done": done}
+        return {"model": body.get("model"), "response": text, "done": done}
+
+    def _final(self, body, text, start, prompt_eval_count, response=None):
+        """完了時のメッセージ（Ollamaと同じ時間計測フィールドを含む）"""
+        total_ns = int((time.perf_counter() - start) * 1e9)
+        eval_count = len(split_chunks(text))
+        return {
+            **self._message(body, text if response is None else response, True),
+            "total_duration": total_ns,
+            "load_duration": 0,
+            "prompt_eval_count": prompt_eval_count,
+            "prompt_eval_duration": 0,
+            "eval_count": eval_count,
+            "eval_duration": total_ns,
+        }
+
+    def _stream(self, body, text, start, prompt_eval_count):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        time.sleep(self.config.latency)
+        try:
+            for chunk in split_chunks(text):
+                if self.config.token_latency:
+                    time.sleep(self.config.token_latency)
+                self._write_chunk(self._message(body, chunk, False))
+            self._write_chunk(self._final(body, text, start, prompt_eval_count, response=""))
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # クライアントが受信を打ち切った（コードブロックが閉じた・禁止要素を検出した）
+            self.config.count("aborted")
+            self.close_connection = True
+
+    def _write_chunk(self, data):
+        payload = (json.dumps(data) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n" % len(payload) + payload + b"\r\n")
+        self.wfile.flush()
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 受信を打ち切ったクライアントの切断は正常な動作なので表示しない
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+
+def start_server(port=0, config=None):
+    """スタブサーバを別スレッドで起動する（port=0なら空いているポート）。Returns: (server, base_url)"""
+    handler = type("Handler", (StubHandler,), {"config": config or StubConfig()})
+    server = StubServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Ollama互換スタブサーバ")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--invalid-rate", type=float, default=0.0)
+    parser.add_argument("--crash-rate", type=float, default=0.0)
+    parser.add_argument("--model-invalid-rate", action="append", default=[], metavar="MODEL=RATE",
+                        help="モデルごとの不合格の割合（複数指定可）")
+    parser.add_argument("--depth-invalid-rate", action="append", default=[], metavar="DEPTH=RATE",
+                        help="必須要素の深さごとの不合格の割合（複数指定可）")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--no-structured", action="store_true", help="think・formatの指定に400を返す")
+    parser.add_argument("--load-latency", type=float, default=0.0, help="読み込まれていないモデルの最初のリクエストの遅延（秒）")
+    parser.add_argument("--preload", action="append", default=[], metavar="MODEL", help="起動時に読み込み済みとするモデル（複数指定可）")
+    args = parser.parse_args()
+    model_rates = {m: float(r) for m, r in (spec.rsplit("=", 1) for spec in args.model_invalid_rate)}
+    depth_rates = {int(d): float(r) for d, r in (spec.split("=", 1) for spec in args.depth_invalid_rate)}
+    config = StubConfig(args.latency, args.token_latency, args.failure_rate, args.invalid_rate, seed=args.seed,
+                        model_invalid_rates=model_rates, crash_rate=args.crash_rate, depth_invalid_rates=depth_rates,
+                        structured=not args.no_structured, load_latency=args.load_latency, preloaded=args.preload)
+    server, base_url = start_server(args.port, config)
+    print(f"stub ollama listening on {base_url}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,10 @@
-# 制御要素の優先順位リスト（あとから編集しやすい）
-CONTROL_PRIORITY = [
-    'if', 'elif', 'else', 'for', 'break', 'continue'
-    # 必要に応じて他の要素も追加
-]
-
-# パス（例: 'if/else'）に優先順位を適用するための関数
-def path_priority_key(path):
-    parts = path.split('/')
-    # 各パートの優先順位をタプルで返す
-    def part_priority(p):
-        try:
-            return CONTROL_PRIORITY.index(p)
-        except ValueError:
-            return len(CONTROL_PRIORITY)
-    return tuple(part_priority(p) for p in parts)
-
-
+import os
 import sys
-from utils import parser_tokenize
-from utils import gap_detector
-from utils import ai_generator
-from utils import ai_api
 import glob
-
-CONTROL_ELEMENTS = [
-    'if', 'elif', 'else', 'for', 'break', 'continue'
-    # 必要に応じて他の要素も追加
-]
+from utils import parser_tokenize
+# 制御要素の定義はutils/control_elements.pyで一元管理する（CONTROL_ELEMENTS・CONTROL_PRIORITYはmainからも参照できるようにしておく）
+from utils.control_elements import CONTROL_ELEMENTS, CONTROL_PRIORITY, path_priority_key  # noqa: F401
+# ai_generator / ai_api（requests）は生成系の処理でのみ遅延importする
 
 def analyze_program_file(filepath):
     """指定したPythonファイルをparser_tokenize.pyで分析し、制御構文情報を返す"""
@@ -34,39 +12,99 @@ def analyze_program_file(filepath):
         code = f.read()
     return parser_tokenize.parse_control_structures(code)
 
-def analyze_program_file_paths(filepath):
-    """指定したPythonファイルをparser_tokenize.pyで分析し、パス形式で制御構文を返す"""
+def analyze_program_file_paths(filepath, index=None):
+    """
+    指定したPythonファイルをparser_tokenize.pyで分析し、パス形式で制御構文を返す
+    index: AnalysisIndex（指定すれば変更のないファイルは再解析しない）
+    """
+    if index is not None:
+        return index.get(filepath)['paths']
     with open(filepath, 'r', encoding='utf-8') as f:
         code = f.read()
-    tree = parser_tokenize.parse_control_structure_tree(code)
-    return parser_tokenize.tree_to_paths(tree)
+    return parser_tokenize.parse_control_paths(code)
 
 
 
-def detect_gaps_cli():
-    """ギャップ検出CLI処理"""
-    filepaths = sorted(glob.glob("sample/*.py"))
-    learned = set()
-    for idx, path in enumerate(filepaths):
-        with open(path, 'r', encoding='utf-8') as f:
-            code = f.read()
-        tree = parser_tokenize.parse_control_structure_tree(code)
-        elements = set(parser_tokenize.tree_to_paths(tree))
-        new_elements = elements - learned
+def print_skipped_files(errors):
+    """読み込み・解析できずに飛ばしたファイルを表示する"""
+    if errors:
+        print(f"===== 読み込み・解析できずに飛ばしたファイル: {len(errors)} 件 =====")
+        for path, error in errors:
+            print(f"[SKIP] {path}: {error}")
 
-        print(f"{idx+1}: {path} 新規学習要素数: {len(new_elements)} 新規要素: {list(new_elements)}")
-        learned |= elements
+
+def detect_gaps_cli(args=None, server=None):
+    """
+    ギャップ検出CLI処理
+    例: --detect-gaps [ディレクトリ/globパターン ...] [--jobs N] [--locate]
+    --locate: 新規要素がそのファイルで最初に現れる行と、コーパス全体でのパスごとの出現数・最初に現れる場所を表示する
+    server: degapサービスのURL（指定すれば解析はサービスで行う。--locateはローカルで解析する）
+    """
+    from utils.analysis_index import AnalysisIndex
+    from utils import corpus
+    args = args or []
+    jobs = parse_int_option(args, "--jobs")
+    specs = [a for i, a in enumerate(args) if not a.startswith("--") and (i == 0 or args[i-1] != "--jobs")]
+    if server is not None and "--locate" not in args:
+        from utils.degap_service import ServiceClient, ServiceError
+        service = ServiceClient(server)
+        errors = []
+        try:
+            for info in service.detect(corpus.resolve_corpus(specs or None), jobs=jobs, errors=errors):
+                print(f"{info['index']}: {info['path']} 新規学習要素数: {info['gap']} 新規要素: {info['new_elements']}")
+            print_skipped_files(errors)
+        except ServiceError as e:
+            print(f"[SERVICE] {e}")
+            sys.exit(1)
+        finally:
+            service.close()
+        return
+    # 解析結果はインデックスから取り出し、新規・変更されたファイルだけを（N並列で）再解析する
+    index = AnalysisIndex()
+    errors = []
+    if "--locate" in args:
+        from utils.path_trie import PathTrie
+        corpus_trie = PathTrie()
+        for info in corpus.locate_gaps(specs or None, jobs=jobs, index=index, corpus_trie=corpus_trie, errors=errors):
+            locations = ", ".join(f"{p}（{line}行目）" for p, line in info['locations'])
+            print(f"{info['index']}: {info['path']} 新規学習要素数: {info['gap']} 新規要素: {locations}")
+        print("===== パスごとの出現数・最初に現れる場所 =====")
+        for path, node in sorted(corpus_trie.items(), key=lambda item: path_priority_key(item[0])):
+            source, line = next(iter(node.sources.items()))
+            print(f"{path}: {node.count}回（{len(node.sources)}ファイル） 最初: {source}:{line}")
+    else:
+        # ギャップはファイル順に届いた分から、パスIDのビット集合の累積OR・popcountで求める
+        for info in corpus.detect_gaps_bitset(specs or None, jobs=jobs, index=index, errors=errors):
+            print(f"{info['index']}: {info['path']} 新規学習要素数: {info['gap']} 新規要素: {list(info['new_elements'])}")
+    print_skipped_files(errors)
+    index.save()
 
 
-def generate_code_cli(args):
-    """AIコード生成CLI処理"""
+def generate_code_cli(args, server=None):
+    """
+    AIコード生成CLI処理
+    server: degapサービスのURL（指定すればサービスに生成を依頼する。同じ条件の生成は他の利用者と共有される）
+    """
+    from utils import ai_generator
+    from utils import ai_api
     # 例: --generate-code for/if --allow else,elif --forbid break,continue
     if len(args) < 1:
-        print("Usage: python main.py --generate-code <learning_elements(,区切り)> [--allow <allowed_elements(,区切り)>] [--forbid <forbidden_elements(,区切り)>]")
+        print("Usage: python main.py --generate-code <learning_elements(,区切り)> [--allow <allowed_elements(,区切り)>] [--forbid <forbidden_elements(,区切り)>] [--speculative K] [--cache] [--stream] [--validate-stream] [--models M1,M2,...] [--escalate-after N] [--chat] [--runtime-check] [--max-retry N] [--no-adaptive-retry] [--fast]")
         sys.exit(1)
     learning_elements = [e.strip() for e in args[0].split(",") if e.strip()]
     allowed_elements = []
     forbidden_elements = None  # Noneで未指定を区別
+    speculative = 1
+    use_cache = False
+    stream = False
+    validate_stream = False
+    models = None
+    escalate_after = None
+    chat = False
+    runtime_check = False
+    max_retry = 3
+    adaptive_retry = True
+    fast = False
     idx = 1
     while idx < len(args):
         if args[idx] == "--allow" and idx+1 < len(args):
@@ -75,6 +113,39 @@ def generate_code_cli(args):
         elif args[idx] == "--forbid" and idx+1 < len(args):
             forbidden_elements = [e.strip() for e in args[idx+1].split(",") if e.strip()]
             idx += 2
+        elif args[idx] == "--speculative" and idx+1 < len(args):
+            speculative = max(1, int(args[idx+1]))
+            idx += 2
+        elif args[idx] == "--cache":
+            use_cache = True
+            idx += 1
+        elif args[idx] == "--stream":
+            stream = True
+            idx += 1
+        elif args[idx] == "--validate-stream":
+            validate_stream = True
+            idx += 1
+        elif args[idx] == "--chat":
+            chat = True
+            idx += 1
+        elif args[idx] == "--runtime-check":
+            runtime_check = True
+            idx += 1
+        elif args[idx] == "--no-adaptive-retry":
+            adaptive_retry = False
+            idx += 1
+        elif args[idx] == "--fast":
+            fast = True
+            idx += 1
+        elif args[idx] == "--max-retry" and idx+1 < len(args):
+            max_retry = max(1, int(args[idx+1]))
+            idx += 2
+        elif args[idx] == "--models" and idx+1 < len(args):
+            models = args[idx+1]
+            idx += 2
+        elif args[idx] == "--escalate-after" and idx+1 < len(args):
+            escalate_after = int(args[idx+1])
+            idx += 2
         else:
             idx += 1
     # forbidden_elements未指定時はデフォルトでCONTROL_ELEMENTSから必須・許可要素を除いたもの
@@ -84,180 +155,594 @@ def generate_code_cli(args):
     print(f"[DEBUG] learning_elements: {learning_elements}")
     print(f"[DEBUG] allowed_elements: {allowed_elements}")
     print(f"[DEBUG] forbidden_elements: {forbidden_elements}")
+    if server is not None:
+        from utils.degap_service import ServiceClient, ServiceError
+        from utils.model_cascade import parse_models
+        service = ServiceClient(server)
+        try:
+            service.generate(learning_elements, allowed_elements, forbidden_elements, models=parse_models(models, ["qwen3:14b"]),
+                             escalate_after=escalate_after, max_retry=max_retry, speculative=speculative,
+                             validate_stream=validate_stream, chat=chat, runtime_check=runtime_check, adaptive_retry=adaptive_retry)
+        except ServiceError as e:
+            print(f"[SERVICE] {e}")
+            sys.exit(1)
+        finally:
+            service.close()
+        return
     # AIクライアント取得（Ollama前提）
-    client = ai_api.get_ai_client("ollama", model="qwen3:14b")
-    def ai_func(prompt):
-        return client.generate(prompt)
-    max_retry = 3
-    prompt_reason = ""
-    for attempt in range(1, max_retry+1):
-        code = ai_generator.generate_code_with_ai(learning_elements, allowed_elements, forbidden_elements, ai_func=ai_func, extra_prompt=prompt_reason)
-        print(f"=====[Generated code attempt {attempt}]=====")
-        print(code)
-        print("==========================")
-        ok, info = ai_generator.check_code_elements(code, learning_elements, allowed_elements)
-        forbidden_used = info.get('forbidden', []) if info else []
-        missing = info.get('missing', []) if info else []
-        if ok and not forbidden_used:
-            print("Code meets the requirements.")
-            break
-        else:
-            print("Code does not meet the requirements:")
-            print(f"Missing elements: {missing}")
-            print(f"Forbidden elements: {forbidden_used}")
-            print(f"All paths in code: {info['all_paths'] if info else ''}")
-            # 理由をプロンプトに追記
-            reasons = []
-            if forbidden_used:
-                reasons.append(f"The following elements must NOT be used: {', '.join(forbidden_used)}.")
-            if missing:
-                reasons.append(f"The following elements MUST be used: {', '.join(missing)}.")
-            if reasons:
-                prompt_reason = "\n[Note for AI] Previous output was rejected for the following reasons: " + " ".join(reasons) + " Please strictly follow the requirements."
-            else:
-                prompt_reason = ""
+    client = ai_api.get_ai_client("ollama", model="qwen3:14b", pool_maxsize=speculative, stream=stream,
+                                  stop_when=ai_generator.has_complete_code_block, fast=fast)
+    # 高速モードでは生成トークン数・時間を集計し、通常の生成と比べた削減量を表示する
+    telemetry = None
+    if fast:
+        from utils.telemetry import Telemetry
+        telemetry = Telemetry()
+    cache = None
+    if use_cache:
+        from utils.generation_cache import GenerationCache
+        cache = GenerationCache()
+    sandbox = None
+    if runtime_check:
+        from utils.sandbox import SandboxPool
+        sandbox = SandboxPool(size=speculative)
+    retry_policy = None
+    if adaptive_retry:
+        # 過去の合否の記録から生成回数の上限（max_retry以下）・温度の順を決める
+        from utils.retry_policy import RetryPolicy
+        retry_policy = RetryPolicy()
+    if models is not None:
+        # 速いモデルから順に試し、不合格が続いたら次のモデルに切り替える
+        from utils.model_cascade import ModelCascade, DEFAULT_ESCALATE_AFTER, parse_models
+        cascade = ModelCascade(parse_models(models, [client.model]), escalate_after=escalate_after or DEFAULT_ESCALATE_AFTER)
+        cascade.generate(client, learning_elements, allowed_elements, forbidden_elements, max_retry=max_retry, cache=cache, speculative=speculative, validate_stream=validate_stream, chat=chat, sandbox=sandbox, retry_policy=retry_policy, telemetry=telemetry)
+        cascade.save()
     else:
-        print("Failed to generate code that meets the requirements after multiple attempts.")
+        ai_func = client.chat if chat else client.generate
+        ai_generator.generate_valid_code(learning_elements, allowed_elements, forbidden_elements, ai_func=ai_func, max_retry=max_retry, speculative=speculative, cache=cache, model=client.model, validate_stream=validate_stream, chat=chat, sandbox=sandbox, retry_policy=retry_policy, telemetry=telemetry)
+    if telemetry is not None:
+        from utils.telemetry import format_mode_savings, load_mode_history, save_mode_history
+        modes = telemetry.summary()["modes"]
+        for line in format_mode_savings(modes, load_mode_history()):
+            print(line)
+        save_mode_history(modes)
+    if retry_policy is not None:
+        retry_policy.save()
+    if sandbox is not None:
+        sandbox.close()
+    if cache is not None:
+        print(f"[CACHE] {cache.stats()}")
+
+def run_degap_job(job, client, result_dir="result", speculative=1, cache=None, validate_stream=False, library=None, log=print, telemetry=None, cascade=None, chat=False, manifest=None, sandbox=None, service=None,
+                  max_retry=8, retry_policy=None):
+    """
+    degapのジョブ1件（中間プログラム1つ）を生成・判定し、result_dirに保存する
+    client: AIクライアント（全ジョブで共有し、接続を使い回す）
+    speculative: 1回の波で同時に生成する候補数（最初に合格した候補を採用）
+    cache: GenerationCache（Noneならキャッシュを使わない）
+    validate_stream: 受信中に逐次判定し、禁止要素が現れた候補はその時点で打ち切る
+    library: ProgramLibrary（条件を満たすプログラムがあればAIを呼ばずに使い、合格した生成結果を登録する）
+    telemetry: Telemetry（ジョブ・候補ごとの処理時間と結果を記録する）
+    cascade: ModelCascade（速いモデルから順に試す。Noneならclientのモデルのみ）
+    chat: 会話形式で生成する（再試行では不合格のコードと短い指摘だけを送る）
+    manifest: DegapManifest（ジョブの入力job['inputs']・結果・出力を記録する）
+    sandbox: SandboxPool（構造の判定に合格したコードを実行し、例外・時間切れなら不合格にする）
+    service: ServiceClient（指定すれば生成はサービスに依頼する。sandboxを指定していればサービス側でも実行検査する）
+    max_retry: 生成回数の上限
+    retry_policy: RetryPolicy（過去の合否の記録から生成回数の上限（max_retry以下）・温度の順を決める）
+    """
+    import os
+    import time
+    from utils import ai_generator
+    from utils.file_utils import atomic_write_text
+    elem = job['learning_element']
+    learning_elements = job['learning_elements']
+    allowed_elements = job['allowed_elements']
+    forbidden_elements = job['forbidden_elements']
+    log(f"[DEGAP] 新規学習要素: {elem} のみを追加した中間プログラムを生成 (allowed_elements={allowed_elements})")
+    # 生成結果判定用
+    code_result = {'ok': False, 'missing': [], 'forbidden': [], 'path': None}
+    save_path = os.path.join(result_dir, f"{job['base']}_prev{job['prev_index']}.py")
+    entry = None
+    start = time.perf_counter()
+    if telemetry is not None:
+        telemetry = telemetry.bind(job=job['job_index'], learning_element=elem)
+    if library is not None:
+        entry = library.find(learning_elements, allowed_elements, exclude_sources=(job['insert_before'],))
+    if entry is not None and sandbox is not None:
+        runtime_ok, _ = ai_generator.validate_runtime(entry['code'], sandbox, log=log)
+        if not runtime_ok:
+            log(f"[LIBRARY] {entry['source']} は実行時にエラーになるため使いません。")
+            entry = None
+    if entry is not None:
+        log(f"[LIBRARY] 条件を満たすプログラム（{entry['source']}）を再利用します。")
+        log(entry['code'])
+        code = entry['code']
+        ok, info = ai_generator.validate_generated_code(code, learning_elements, allowed_elements, log=log)
+        attempts, source, model = 0, "library", None
+    else:
+        if service is not None:
+            from utils.degap_service import ServiceError
+            try:
+                code, ok, info, attempts, model = service.generate(
+                    learning_elements, allowed_elements, forbidden_elements, models=cascade.models if cascade is not None else [client.model],
+                    escalate_after=cascade.escalate_after if cascade is not None else None, max_retry=max_retry, speculative=speculative,
+                    validate_stream=validate_stream, chat=chat, runtime_check=sandbox is not None,
+                    adaptive_retry=retry_policy is not None, log=log)
+            except ServiceError as e:
+                log(f"[SERVICE] {e}")
+                code, ok, info, attempts, model = None, False, {}, 0, None
+            if ok and sandbox is not None and not info.get('runtime'):
+                # サービスで実行検査されていない結果（実行検査に対応していないサービスなど）は手元で実行して確認する
+                ok, runtime = ai_generator.validate_runtime(code, sandbox, log=log)
+                info = dict(info, runtime=runtime)
+        elif cascade is not None:
+            code, ok, info, attempts, model = cascade.generate(client, learning_elements, allowed_elements, forbidden_elements, max_retry=max_retry, speculative=speculative, log=log, cache=cache, validate_stream=validate_stream, telemetry=telemetry, chat=chat, sandbox=sandbox, retry_policy=retry_policy)
+        else:
+            model = client.model
+            ai_func = client.chat if chat else client.generate
+            code, ok, info, attempts = ai_generator.generate_valid_code(learning_elements, allowed_elements, forbidden_elements, ai_func=ai_func, max_retry=max_retry, speculative=speculative, log=log, cache=cache, model=model, validate_stream=validate_stream, telemetry=telemetry, chat=chat, sandbox=sandbox, retry_policy=retry_policy)
+        # attemptsが0ならジョブ単位のキャッシュ（以前に合格したコード）を使った
+        source = "ai" if attempts else "cache" if ok else "error"
+        if ok and library is not None:
+            library.add(code, source=save_path, paths=info.get('all_paths'))
+    code_result['ok'] = ok
+    code_result['missing'] = info.get('missing', []) if info else []
+    code_result['forbidden'] = info.get('forbidden', []) if info else []
+    code_result['path'] = info['all_paths'] if info and 'all_paths' in info else None
+    output = code if code else "# generation failed\n"
+    atomic_write_text(save_path, output)
+    log(f"[DEGAP] 生成コードを {save_path} に保存しました。")
+    if manifest is not None:
+        manifest.record(job, job['inputs'], "ok" if ok else "failed", code=output, paths=code_result['path'], source=source, model=model,
+                        sample_hash=job.get('sample_hash'))
+    if telemetry is not None:
+        telemetry.record("job", insert_before=job['insert_before'], ok=ok, attempts=attempts, source=source,
+                         model=model, sec=time.perf_counter() - start, path=save_path)
+    return code_result
 
-def degap():
-    """サンプル間のギャップを1つずつになるようにAIでプログラムを生成・挿入する"""
-    import copy
+def degap(jobs=1, speculative=1, cache_dir=None, stream=False, validate_stream=False, filepaths=None, use_library=True, trace_path=None,
+          models=None, escalate_after=None, chat=False, resume=False, runtime_check=False, watch=False, interval=1.0,
+          server=None, max_retry=8, adaptive_retry=True, fast=False):
+    """
+    サンプル間のギャップを1つずつになるようにAIでプログラムを生成・挿入する
+    filepaths: 学習順のサンプルファイル（Noneならsample/*.pyのパス順）
+    use_library: 判定済みプログラムのライブラリを使う（サンプル・以前の結果・合格した生成結果を再利用する）
+    jobs: 中間プログラムを並列に生成するワーカー数
+    speculative: ジョブごとに同時に生成する候補数
+    cache_dir: 生成結果キャッシュの保存先（Noneならキャッシュを使わない）
+    stream: ストリーミングで受信し、コードブロックが閉じた時点で受信を打ち切る
+    validate_stream: 受信中に逐次判定し、禁止要素が現れた候補はその時点で打ち切る
+    trace_path: ジョブ・候補ごとの記録（JSONL）の出力先（Noneなら要約の表示のみ）
+    models: 使うモデル名のリスト（速い順。Noneならmodel_cascade.DEFAULT_DEGAP_MODELS）
+    escalate_after: 1つのモデルで許す不合格回数（これを超えたら次のモデルに切り替える）
+    chat: 会話形式（/api/chat）で生成する。共通の指示はsystemメッセージで送り、再試行では不合格のコードと短い指摘だけを追加する
+    resume: result/を初期化せず、マニフェストに完了と記録されていて入力が変わっていないジョブは生成し直さない
+    runtime_check: 構造の判定に合格したコードを常駐ワーカーのサンドボックスで実行し、例外・時間切れなら再生成する
+    watch: 1回目の実行後もサンプルをinterval秒ごとに確認し、変更があれば入力が変わったジョブだけを生成し直す（resumeを含む）
+    server: degapサービスのURL（指定すれば生成はサービスに依頼する。キャッシュはサービス側のものを使う）
+    max_retry: ジョブごとの生成回数の上限
+    adaptive_retry: 過去の合否の記録（.degap_cache/retry_stats.json）から生成回数の上限・温度の順を決め、見込みのない条件は早めに打ち切る
+    fast: 思考を無効にし、{"code": ...}のJSONスキーマで出力させる（対応していないモデルでは通常の生成に戻す）。
+          実行後に通常の生成と比べた1リクエストあたりのトークン数・時間の削減量を表示する
+    """
     import os
-    # resultディレクトリの初期化
-    import shutil
+    import threading
+    import time
+    from utils import degap_jobs
+    from utils.telemetry import Telemetry
+    from utils.model_cascade import ModelCascade, DEFAULT_ESCALATE_AFTER
+    from utils import ai_generator
+    from utils import ai_api
+    from utils import degap_manifest
+    from utils import analysis_engine
     result_dir = "result"
+    resume = resume or watch
+    telemetry = Telemetry(trace_path)
+    sandbox = None
+    if runtime_check:
+        from utils.sandbox import SandboxPool
+        # 同時に判定しうる候補数だけワーカーを起動しておく
+        sandbox = SandboxPool(size=jobs * speculative)
+
+    def validate_output(code, learning_elements, allowed_elements):
+        """保存済みの出力が要素条件を満たすか（--runtime-check付きなら実行検査も行う）"""
+        if not ai_generator.validate_generated_code(code, learning_elements, allowed_elements, log=lambda msg: None)[0]:
+            return False
+        return sandbox is None or ai_generator.validate_runtime(code, sandbox, log=lambda msg: None)[0]
+
+    library = None
+    if use_library:
+        from utils.program_library import ProgramLibrary
+        library = ProgramLibrary()
+        # 初期化で消える以前の結果のうち、マニフェストに合格と記録されていて判定し直しても合格するものをライブラリに残す
+        for path, code, entry in degap_manifest.DegapManifest(result_dir).passed_outputs():
+            if validate_output(code, entry['inputs']['learning_elements'], entry['inputs']['allowed_elements']):
+                library.add(code, path, paths=entry['paths'] or None)
+    # resultディレクトリの初期化（再開時は残し、計画にない出力だけ後で削除する）
     if os.path.exists(result_dir):
-        for f in glob.glob(os.path.join(result_dir, "*")):
-            os.remove(f)
+        if not resume:
+            for f in glob.glob(os.path.join(result_dir, "*")):
+                os.remove(f)
     else:
         os.makedirs(result_dir)
 
-    filepaths = sorted(glob.glob("sample/*.py"))
-    learned = set()
-    prev_elements = set()
-    gap_results = []  # 各サンプルのギャップ情報
-    inserted_programs = []  # 生成したプログラムの情報
-    for idx, path in enumerate(filepaths):
-        with open(path, 'r', encoding='utf-8') as f:
-            code = f.read()
-        tree = parser_tokenize.parse_control_structure_tree(code)
-        elements = set(parser_tokenize.tree_to_paths(tree))
-        new_elements = elements - learned
-        gap_results.append({
-            'index': idx+1,
-            'path': path,
-            'gap': len(new_elements),
-            'new_elements': list(new_elements)
-        })
-        # ギャップ（新規要素数）が2以上なら、1つずつになるようにAIで生成
-        if len(new_elements) >= 2:
-            print(f"[DEGAP] {path} でギャップ {len(new_elements)} を検出。間に {len(new_elements)-1} 個の中間プログラムを生成します。")
-            current_learned = copy.deepcopy(learned)
-            prioritized_elements = sorted(new_elements, key=path_priority_key)
-            for i, elem in enumerate(prioritized_elements):
-                # 最後の新規要素は生成しない
-                if i == len(prioritized_elements) - 1:
-                    continue
-                learning_elements = [elem]
-                allowed_elements = list(current_learned)
-                print(f"[DEGAP] 新規学習要素: {elem} のみを追加した中間プログラムを生成 (allowed_elements={allowed_elements})")
-                args = [elem]
-                if allowed_elements:
-                    args += ["--allow", ",".join(allowed_elements)]
-                # 生成前の情報を記録（挿入位置を「このpathの前」とする）
-                # 生成結果判定用
-                code_result = {'ok': False, 'missing': [], 'forbidden': [], 'path': None}
-                inserted_programs.append({
-                    'insert_before': path,
-                    'learning_element': elem,
-                    'allowed_elements': allowed_elements.copy(),
-                    'result': code_result
-                })
-                client = ai_api.get_ai_client("ollama", model="qwen3:32b")
-                def ai_func(prompt):
-                    return client.generate(prompt)
-                forbidden_elements = [e for e in CONTROL_ELEMENTS if e not in learning_elements and e not in allowed_elements]
-                max_retry = 8
-                prompt_reason = ""
-                code = None
-                for attempt in range(1, max_retry+1):
-                    code = ai_generator.generate_code_with_ai(learning_elements, allowed_elements, forbidden_elements, ai_func=ai_func, extra_prompt=prompt_reason)
-                    print(f"=====[Generated code attempt {attempt}]=====")
-                    print(code)
-                    print("==========================")
-                    # AI生成コードが空や構文的に不正な場合はcheck_code_elementsを呼ばずにエラー回避
-                    if not code or not code.strip():
-                        print("AI生成コードが空です。check_code_elementsをスキップします。")
-                        ok, info = False, {}
-                    else:
-                        try:
-                            ok, info = ai_generator.check_code_elements(code, learning_elements, allowed_elements)
-                        except Exception as e:
-                            print(f"check_code_elementsで例外発生: {e}\nコード内容: {code}")
-                            ok, info = False, {}
-                    forbidden_used = info.get('forbidden', []) if info else []
-                    missing = info.get('missing', []) if info else []
-                    code_result['ok'] = ok and not forbidden_used
-                    code_result['missing'] = missing
-                    code_result['forbidden'] = forbidden_used
-                    code_result['path'] = info['all_paths'] if info and 'all_paths' in info else None
-                    if ok and not forbidden_used:
-                        print("Code meets the requirements.")
-                        break
-                    else:
-                        print("Code does not meet the requirements:")
-                        print(f"Missing elements: {missing}")
-                        print(f"Forbidden elements: {forbidden_used}")
-                        print(f"All paths in code: {info['all_paths'] if info else ''}")
-                        reasons = []
-                        if forbidden_used:
-                            reasons.append(f"The following elements must NOT be used: {', '.join(forbidden_used)}.")
-                        if missing:
-                            reasons.append(f"The following elements MUST be used: {', '.join(missing)}.")
-                        if reasons:
-                            prompt_reason = "\n[Note for AI] Previous output was rejected for the following reasons: " + " ".join(reasons) + " Please strictly follow the requirements."
-                        else:
-                            prompt_reason = ""
-                else:
-                    print("Failed to generate code that meets the requirements after multiple attempts.")
-                base = os.path.splitext(os.path.basename(path))[0]
-                save_path = os.path.join(result_dir, f"{base}_prev{i+1}.py")
-                with open(save_path, "w", encoding="utf-8") as wf:
-                    wf.write(code if code else "# generation failed\n")
-                print(f"[DEGAP] 生成コードを {save_path} に保存しました。")
-                current_learned.add(elem)
-        learned |= elements
-
-    # まとめ出力
-    print("\n===== ギャップ検出結果まとめ =====")
-    for info in gap_results:
-        print(f"{info['index']}: {info['path']} ギャップ: {info['gap']} 新規要素: {info['new_elements']}")
-    print("\n===== 生成された中間プログラムの挿入・詳細 =====")
-    if inserted_programs:
-        for i, prog in enumerate(inserted_programs, 1):
-            result_str = "Code meets the requirements." if prog['result']['ok'] else "Code does not meet the requirements."
-            print(f"{i}: {prog['insert_before']} の前に挿入 | 新規学習要素: {prog['learning_element']} | allowed_elements: {prog['allowed_elements']} | 判定: {result_str}")
-    else:
-        print("中間プログラムの生成・挿入はありませんでした。")
+    # filepathsを指定しなければ、監視中に追加・削除されたサンプルも反映する
+    list_samples = (lambda: sorted(glob.glob("sample/*.py"))) if filepaths is None else (lambda: list(filepaths))
+    from utils.analysis_index import AnalysisIndex
+    index = AnalysisIndex()
+    # 学習済み集合・パス集合が変わっていないサンプルの計画は使い回す
+    planner = degap_jobs.IncrementalPlanner(analyze=telemetry.timed("parse", index.paths))
+
+    cache = None
+    if cache_dir is not None and server is None:
+        from utils.generation_cache import GenerationCache
+        cache = GenerationCache(cache_dir)
+
+    # 速いモデルから順に試し、不合格が続いたら次のモデルに切り替える（深さごとの記録から開始するモデルを選ぶ）
+    cascade = ModelCascade(models, escalate_after=escalate_after or DEFAULT_ESCALATE_AFTER)
+    print(f"[CASCADE] モデル: {' → '.join(cascade.models)} (切り替えまでの不合格回数: {cascade.escalate_after})")
+    retry_policy = None
+    if adaptive_retry:
+        from utils.retry_policy import RetryPolicy
+        retry_policy = RetryPolicy()
+
+    # 各ジョブの入力（要素条件・モデル）をマニフェストに記録する
+    manifest = degap_manifest.DegapManifest(result_dir)
+    # 全ジョブで1つのクライアント（keep-alive接続プール）を共有する
+    client = ai_api.get_ai_client("ollama", model=cascade.models[-1], pool_maxsize=jobs * speculative, stream=stream,
+                                  stop_when=ai_generator.has_complete_code_block, fast=fast)
+    service = None
+    if server is not None:
+        # 生成はサービスに依頼する（他の利用者と同じ条件の生成は1回のLLM呼び出しにまとめられる）
+        from utils.degap_service import ServiceClient
+        service = ServiceClient(server)
+        print(f"[SERVICE] 生成を {server} に依頼します。")
+    print_lock = threading.Lock()
+
+    def run_pass(samples, changed=None, validate_outputs=True):
+        """
+        ジョブを計画し、生成が必要なジョブだけを実行して結果をまとめて表示する
+        changed: 前回から変更されたサンプル（Noneならすべて）
+        validate_outputs: 再利用する出力を判定し直す（監視中の2回目以降は、記録どおりのハッシュであれば判定を省く）
+        """
+        # 生成前にすべてのジョブ（挿入位置・学習要素・allowed_elements）を計画する
+        gap_results, planned = planner.plan(samples)
+        index.save()
+        if library is not None:
+            for path in samples if changed is None else [p for p in changed if p in samples]:
+                library.add_file(path, paths=index.paths(path))
+        for info in gap_results:
+            if info['gap'] >= 2:
+                print(f"[DEGAP] {info['path']} でギャップ {info['gap']} を検出。間に {info['gap']-1} 個の中間プログラムを生成します。")
+        print(f"[DEGAP] 計画したジョブ数: {len(planned)} (並列数: {jobs})")
+        sample_hashes = {path: degap_manifest.file_sha256(path) for path in {job['insert_before'] for job in planned}}
+        for job in planned:
+            job['inputs'] = degap_manifest.job_inputs(job, cascade.models, runtime_check=runtime_check)
+            job['sample_hash'] = sample_hashes[job['insert_before']]
+        completed = {}
+        if resume:
+            # 完了済みで入力が変わっておらず、出力が残っていて条件を満たすジョブは生成し直さない
+            # （--runtime-check付きなら、出力を実行検査し直したうえで再利用する）
+            for job in planned:
+                validate = None
+                if validate_outputs:
+                    validate = lambda code, job=job: validate_output(code, job['learning_elements'], job['allowed_elements'])
+                entry = manifest.satisfied(job, job['inputs'], validate=validate)
+                if entry is not None:
+                    completed[job['job_index']] = entry
+            # 計画にない出力（以前の計画の中間プログラム）は削除する
+            outputs = {degap_manifest.output_name(job) for job in planned} | {degap_manifest.MANIFEST_NAME}
+            for f in glob.glob(os.path.join(result_dir, "*")):
+                if os.path.basename(f) not in outputs:
+                    os.remove(f)
+            print(f"[RESUME] 完了済みのジョブ {len(completed)} 件を再利用し、{len(planned) - len(completed)} 件を生成します。")
+        manifest.plan([(job, job['inputs']) for job in planned])
+
+        def worker(job):
+            entry = completed.get(job['job_index'])
+            if entry is not None:
+                telemetry.record("job", job=job['job_index'], learning_element=job['learning_element'], insert_before=job['insert_before'],
+                                 ok=True, attempts=0, source="resume", model=entry.get('model'), sec=0.0, path=entry['output'])
+                return {'ok': True, 'missing': [], 'forbidden': [], 'path': entry['paths']}
+            if jobs <= 1:
+                return run_degap_job(job, client, result_dir=result_dir, speculative=speculative, cache=cache, validate_stream=validate_stream, library=library, telemetry=telemetry, cascade=cascade, chat=chat, manifest=manifest, sandbox=sandbox, service=service, max_retry=max_retry, retry_policy=retry_policy)
+            # 並列実行時はジョブごとにログをまとめて出力する
+            lines = []
+            try:
+                return run_degap_job(job, client, result_dir=result_dir, speculative=speculative, cache=cache, validate_stream=validate_stream, library=library, log=lambda msg: lines.append(str(msg)), telemetry=telemetry, cascade=cascade, chat=chat, manifest=manifest, sandbox=sandbox, service=service, max_retry=max_retry, retry_policy=retry_policy)
+            finally:
+                with print_lock:
+                    print(f"----- [job {job['job_index']+1}/{len(planned)}] {job['insert_before']} / {job['learning_element']} -----")
+                    print("\n".join(lines))
+        results = degap_jobs.run_jobs(planned, worker, max_workers=jobs)
+        inserted_programs = [{
+            'insert_before': job['insert_before'],
+            'learning_element': job['learning_element'],
+            'allowed_elements': job['allowed_elements'].copy(),
+            'result': code_result
+        } for job, code_result in zip(planned, results)]
+
+        # まとめ出力
+        print("\n===== ギャップ検出結果まとめ =====")
+        for info in gap_results:
+            print(f"{info['index']}: {info['path']} ギャップ: {info['gap']} 新規要素: {info['new_elements']}")
+        print("\n===== 生成された中間プログラムの挿入・詳細 =====")
+        if inserted_programs:
+            for i, prog in enumerate(inserted_programs, 1):
+                result_str = "Code meets the requirements." if prog['result']['ok'] else "Code does not meet the requirements."
+                print(f"{i}: {prog['insert_before']} の前に挿入 | 新規学習要素: {prog['learning_element']} | allowed_elements: {prog['allowed_elements']} | 判定: {result_str}")
+        else:
+            print("中間プログラムの生成・挿入はありませんでした。")
+        if cache is not None:
+            cache.evict()
+            print(f"[CACHE] {cache.stats()}")
+        if library is not None:
+            library.save()
+            print(f"[LIBRARY] {library.stats()}")
+        cascade.save()
+        print(f"[CASCADE] 深さ・モデルごとの合格率: {cascade.stats()}")
+        if retry_policy is not None and service is None:
+            retry_policy.save()
+            print(f"[RETRY] 学習要素・深さ・モデル・allowed件数ごとの合格率: {retry_policy.stats()}")
+        return len(planned) - len(completed)
+
+    try:
+        samples = list_samples()
+        before = degap_jobs.snapshot(samples)
+        run_pass(samples)
+        if watch:
+            print(f"\n[WATCH] サンプルの変更を{interval}秒ごとに確認します（Ctrl-Cで終了）。")
+            try:
+                while True:
+                    time.sleep(interval)
+                    samples = list_samples()
+                    after = degap_jobs.snapshot(samples)
+                    changed = degap_jobs.changed_files(before, after)
+                    if not changed:
+                        continue
+                    before = after
+                    start = time.perf_counter()
+                    print(f"\n[WATCH] 変更を検出: {', '.join(changed)}")
+                    planner.invalidate(changed)
+                    try:
+                        generated = run_pass(samples, changed=changed, validate_outputs=False)
+                    except analysis_engine.PARTIAL_ERRORS + (OSError, UnicodeDecodeError) as e:
+                        # 編集途中で解析できないサンプルは、次に保存されるまで待つ
+                        print(f"[WATCH] 解析できないサンプルがあるため待機します: {type(e).__name__}: {e}")
+                        continue
+                    print(f"[WATCH] 計画し直したサンプル: {len(planner.replanned)} 件 / 生成したジョブ: {generated} 件 "
+                          f"({time.perf_counter() - start:.2f}s)")
+            except KeyboardInterrupt:
+                print("\n[WATCH] 監視を終了します。")
+    finally:
+        if client.fast_unsupported:
+            print(f"[FAST] 思考の無効化・JSONスキーマでの出力に対応していないため、通常の生成に戻したモデル: {sorted(client.fast_unsupported)}")
+        if hasattr(client, "stats"):
+            # 複数ホストに分散した場合のホストごとの状態
+            for url, host in client.stats().items():
+                print(f"[HOSTS] {url}: {host['requests']}件 (失敗 {host['failures']}件) "
+                      f"{'正常' if host['healthy'] else '停止中'} 読み込み済み: {host['loaded']}")
+        client.close()
+        if service is not None:
+            service.close()
+        if sandbox is not None:
+            sandbox.close()
+    if sandbox is not None:
+        print(f"[RUNTIME] {sandbox.stats()}")
+    from utils.telemetry import load_mode_history, save_mode_history
+    print("\n===== 計測結果 =====")
+    print(telemetry.format_summary(history=load_mode_history()))
+    summary = telemetry.summary()
+    telemetry.record("summary", **summary)
+    save_mode_history(summary["modes"])
+    telemetry.close()
+    if trace_path:
+        print(f"[TRACE] ジョブ・候補ごとの記録を {trace_path} に保存しました。")
+
+
+def optimize_order_cli(args, server=None):
+    """
+    サンプルの並び順を最適化するCLI処理
+    例: --optimize-order [ディレクトリ/globパターン ...] [--pin <ファイル>:<位置(1始まり)> ...] [--beam W] [--degap ...]
+    --degapを付けると、最適化した順でdegapを実行する（以降の引数はdegapのオプション）
+    server: degapサービスのURL（--degapの生成をサービスに依頼する）
+    """
+    import os
+    from utils.analysis_index import AnalysisIndex
+    from utils import corpus
+    from utils import order_optimizer
+    degap_args = None
+    if "--degap" in args:
+        degap_args = args[args.index("--degap")+1:]
+        args = args[:args.index("--degap")]
+    beam_width = parse_int_option(args, "--beam", 64)
+    pin_specs = [args[i+1] for i, a in enumerate(args) if a == "--pin" and i+1 < len(args)]
+    specs = [a for i, a in enumerate(args) if not a.startswith("--") and (i == 0 or args[i-1] not in ("--pin", "--beam"))]
+    index = AnalysisIndex()
+    errors = []
+    analyzed = list(corpus.iter_path_sets(corpus.resolve_corpus(specs or None), index=index, errors=errors))
+    index.save()
+    print_skipped_files(errors)
+    # 飛ばしたファイルは並び替えの対象にしない
+    filepaths = [path for path, _ in analyzed]
+    path_sets = [paths for _, paths in analyzed]
+    pins = {}
+    for spec in pin_specs:
+        name, _, position = spec.rpartition(":")
+        matches = [i for i, p in enumerate(filepaths) if os.path.normpath(p) == os.path.normpath(name)]
+        if not matches:
+            print(f"--pinのファイルが見つかりません: {name}")
+            sys.exit(1)
+        if not position.isdigit() or not 1 <= int(position) <= len(filepaths):
+            print(f"--pinの位置は1〜{len(filepaths)}の整数で指定してください: {spec}")
+            sys.exit(1)
+        if int(position)-1 in pins:
+            print(f"--pinの位置が重複しています: {spec}")
+            sys.exit(1)
+        if matches[0] in pins.values():
+            print(f"--pinで同じファイルを2回指定しています: {spec}")
+            sys.exit(1)
+        pins[int(position)-1] = matches[0]
+    if degap_args is not None:
+        # 中間プログラムはresult/{ファイル名}_prev{i}.pyに保存するので、ファイル名が同じサンプルは上書きし合う
+        bases = {}
+        for path in filepaths:
+            bases.setdefault(os.path.splitext(os.path.basename(path))[0], []).append(path)
+        duplicates = [paths for paths in bases.values() if len(paths) > 1]
+        if duplicates:
+            print("--degapでは同じファイル名のサンプルを扱えません（中間プログラムの出力先が重なります）:")
+            for paths in duplicates:
+                print("  " + ", ".join(paths))
+            sys.exit(1)
+    result = order_optimizer.optimize_order(path_sets, pins=pins, beam_width=beam_width)
+    print(f"===== 並び順の最適化（{result['method']}） =====")
+    print(f"必要な中間プログラム数: 元の順 {result['original_generations']} → 最適化後 {result['generations']}")
+    for position, (i, gap) in enumerate(zip(result['order'], result['gaps']), 1):
+        print(f"{position}: {filepaths[i]} ギャップ: {gap} (元の位置: {i+1})")
+    if degap_args is not None:
+        from utils.generation_cache import DEFAULT_CACHE_DIR
+        from utils.model_cascade import DEFAULT_DEGAP_MODELS, DEFAULT_ESCALATE_AFTER, parse_models
+        cache_dir = None if "--no-cache" in degap_args else parse_str_option(degap_args, "--cache-dir", DEFAULT_CACHE_DIR)
+        degap(jobs=parse_int_option(degap_args, "--jobs"),
+              speculative=parse_int_option(degap_args, "--speculative"),
+              cache_dir=cache_dir,
+              stream="--stream" in degap_args,
+              validate_stream="--validate-stream" in degap_args,
+              use_library="--no-library" not in degap_args,
+              trace_path=parse_str_option(degap_args, "--trace", None),
+              models=parse_models(parse_str_option(degap_args, "--models"), DEFAULT_DEGAP_MODELS),
+              escalate_after=parse_int_option(degap_args, "--escalate-after", DEFAULT_ESCALATE_AFTER),
+              chat="--chat" in degap_args,
+              resume="--resume" in degap_args,
+              runtime_check="--runtime-check" in degap_args,
+              watch="--watch" in degap_args,
+              interval=float(parse_str_option(degap_args, "--interval", 1.0)),
+              server=server,
+              max_retry=parse_int_option(degap_args, "--max-retry", 8),
+              adaptive_retry="--no-adaptive-retry" not in degap_args,
+              fast="--fast" in degap_args,
+              filepaths=[filepaths[i] for i in result['order']])
+
+
+def serve_cli(args):
+    """
+    degapサービスの起動CLI処理
+    例: --serve [--host HOST] [--port 8765] [--workers N] [--queue-size N] [--stream] [--runtime-check] [--no-cache] [--cache-dir DIR] [--fast]
+    """
+    from utils import degap_service
+    from utils.generation_cache import DEFAULT_CACHE_DIR
+    degap_service.serve(host=parse_str_option(args, "--host", degap_service.DEFAULT_HOST),
+                        port=int(parse_str_option(args, "--port", degap_service.DEFAULT_PORT)),
+                        workers=parse_int_option(args, "--workers", degap_service.DEFAULT_WORKERS),
+                        queue_size=parse_int_option(args, "--queue-size", degap_service.DEFAULT_QUEUE_SIZE),
+                        cache_dir=None if "--no-cache" in args else parse_str_option(args, "--cache-dir", DEFAULT_CACHE_DIR),
+                        stream="--stream" in args,
+                        runtime_check="--runtime-check" in args,
+                        fast="--fast" in args)
+
+
+def parse_int_option(args, name, default=1):
+    """引数リストから name N（例: --jobs 4）を取り出す"""
+    if name in args:
+        idx = args.index(name)
+        if idx+1 < len(args):
+            return max(1, int(args[idx+1]))
+    return default
+
+
+def parse_str_option(args, name, default=None):
+    """引数リストから name VALUE（例: --cache-dir DIR）を取り出す"""
+    if name in args:
+        idx = args.index(name)
+        if idx+1 < len(args):
+            return args[idx+1]
+    return default
 
 
 def main():
 
+    # --parser tokenize|scan: 解析バックエンドの選択（全コマンド共通。省略時はtokenize）
+    if "--parser" in sys.argv:
+        from utils import analysis_engine
+        idx = sys.argv.index("--parser")
+        try:
+            analysis_engine.set_backend(parse_str_option(sys.argv, "--parser", ""))
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+        del sys.argv[idx:idx+2]
+
+    # --server URL: degapサービスのクライアントとして動く（全コマンド共通。省略時は環境変数DEGAP_SERVER）
+    server = os.environ.get("DEGAP_SERVER") or None
+    if "--server" in sys.argv:
+        idx = sys.argv.index("--server")
+        server = parse_str_option(sys.argv, "--server", server)
+        del sys.argv[idx:idx+2]
+
+    # --hosts URL,URL,...: 複数のOllamaホストに負荷を分散する（全コマンド共通。省略時は環境変数OLLAMA_HOSTS）
+    if "--hosts" in sys.argv:
+        idx = sys.argv.index("--hosts")
+        os.environ["OLLAMA_HOSTS"] = parse_str_option(sys.argv, "--hosts", "")
+        del sys.argv[idx:idx+2]
+
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+        serve_cli(sys.argv[2:])
+        return
+
     if len(sys.argv) > 1 and sys.argv[1] == "--detect-gaps":
-        detect_gaps_cli()
+        detect_gaps_cli(sys.argv[2:], server=server)
         return
 
     if len(sys.argv) > 1 and sys.argv[1] == "--generate-code":
-        generate_code_cli(sys.argv[2:])
+        generate_code_cli(sys.argv[2:], server=server)
+        return
+
+    if len(sys.argv) > 1 and sys.argv[1] == "--optimize-order":
+        optimize_order_cli(sys.argv[2:], server=server)
         return
 
     if len(sys.argv) > 1 and sys.argv[1] == "--degap":
-        degap()
+        from utils.generation_cache import DEFAULT_CACHE_DIR
+        from utils.model_cascade import DEFAULT_DEGAP_MODELS, DEFAULT_ESCALATE_AFTER, parse_models
+        args = sys.argv[2:]
+        cache_dir = None if "--no-cache" in args else parse_str_option(args, "--cache-dir", DEFAULT_CACHE_DIR)
+        degap(jobs=parse_int_option(args, "--jobs"),
+              speculative=parse_int_option(args, "--speculative"),
+              cache_dir=cache_dir,
+              stream="--stream" in args,
+              validate_stream="--validate-stream" in args,
+              use_library="--no-library" not in args,
+              trace_path=parse_str_option(args, "--trace", None),
+              models=parse_models(parse_str_option(args, "--models"), DEFAULT_DEGAP_MODELS),
+              escalate_after=parse_int_option(args, "--escalate-after", DEFAULT_ESCALATE_AFTER),
+              chat="--chat" in args,
+              resume="--resume" in args,
+              runtime_check="--runtime-check" in args,
+              watch="--watch" in args,
+              interval=float(parse_str_option(args, "--interval", 1.0)),
+              server=server,
+              max_retry=parse_int_option(args, "--max-retry", 8),
+              adaptive_retry="--no-adaptive-retry" not in args,
+              fast="--fast" in args)
         return
 
     filepath = sys.argv[1]
-    if len(sys.argv) > 2 and sys.argv[2] == "--paths":
-        result = analyze_program_file_paths(filepath)
+    if len(sys.argv) > 2 and sys.argv[2] == "--paths" and server is not None:
+        from utils.degap_service import ServiceClient, ServiceError
+        service = ServiceClient(server)
+        try:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                print("\n".join(service.analyze(f.read())['paths']))
+        except ServiceError as e:
+            print(f"[SERVICE] {e}")
+            sys.exit(1)
+        finally:
+            service.close()
+    elif len(sys.argv) > 2 and sys.argv[2] == "--paths":
+        from utils.analysis_index import AnalysisIndex
+        index = AnalysisIndex()
+        result = analyze_program_file_paths(filepath, index=index)
+        index.save()
         print("\n".join(result))
     else:
         result = analyze_program_file(filepath)
@@ -2,7 +2,19 @@
 AI API実行モジュール（Ollama用・拡張性あり）
 今後ChatGPT, Gemini, Claude等にも対応しやすい設計
 """
+import json
+import os
+import threading
+from urllib.parse import urlsplit
 import requests
+import requests.adapters
+
+from utils.telemetry import model_metrics
+
+
+class GenerationCancelled(Exception):
+    """cancel_eventにより生成が中断されたことを表す例外"""
+
 
 class BaseAIClient:
     def generate(self, prompt, **kwargs):
@@ -16,36 +28,202 @@ class BaseAIClient:
         """
         raise NotImplementedError("generate() must be implemented by subclasses")
 
+    def chat(self, messages, **kwargs):
+        """
+        会話（messagesのリスト）の続きを生成し、生成されたメッセージの本文を返す
+        Args:
+            messages (list): [{"role": "system"|"user"|"assistant", "content": str}, ...]
+            **kwargs: モデルごとの追加パラメータ
+        Returns:
+            str: 生成されたテキスト
+        """
+        raise NotImplementedError("chat() must be implemented by subclasses")
+
+DEFAULT_OLLAMA_URL = "http://localhost:11434"
+DEFAULT_OLLAMA_PORT = 11434
+
+
+def ollama_url(host):
+    """
+    ホストの指定をURLにする（Ollamaと同じ解釈）
+    - スキームがなければhttp://を補い、ポートがなければ11434を補う（例: 0.0.0.0 → http://0.0.0.0:11434）
+    - スキームを明示した場合はそのまま（http://host はポート80）
+    """
+    host = host.strip().rstrip("/")
+    if "://" in host:
+        return host
+    hostname, slash, path = host.partition("/")
+    if not urlsplit(f"//{hostname}").port:
+        hostname = f"{hostname}:{DEFAULT_OLLAMA_PORT}"
+    return f"http://{hostname}{slash}{path}"
+
+
+def default_ollama_url():
+    """環境変数OLLAMA_HOSTがあればそのURL（ollama_url参照）、なければlocalhost:11434"""
+    host = os.environ.get("OLLAMA_HOST", "").strip()
+    if not host:
+        return DEFAULT_OLLAMA_URL
+    return ollama_url(host)
+
+
+# 高速モードで出力させるJSONのスキーマ（{"code": "..."}）
+CODE_SCHEMA = {
+    "type": "object",
+    "properties": {"code": {"type": "string"}},
+    "required": ["code"],
+}
+# 高速モードでAPIに渡すパラメータ（思考を無効にし、スキーマに沿ったJSONで出力させる）
+FAST_PARAMS = {"think": False, "format": CODE_SCHEMA}
+
+
 class OllamaClient(BaseAIClient):
-    def __init__(self, base_url="http://localhost:11434", model="llama3"):
+    def __init__(self, base_url=None, model="llama3", connect_timeout=10, read_timeout=600,
+                 pool_maxsize=10, stream=False, stop_when=None, fast=False):
         """
         Args:
-            base_url (str): Ollama APIのベースURL
+            base_url (str): Ollama APIのベースURL（Noneなら環境変数OLLAMA_HOST、なければlocalhost:11434）
             model (str): 使用するモデル名
+            connect_timeout (float): 接続タイムアウト（秒）
+            read_timeout (float): 受信タイムアウト（秒、チャンク間の待ち時間）。Noneなら無制限
+            pool_maxsize (int): 保持するkeep-alive接続数の上限（並列数に合わせる）
+            stream (bool): Trueならストリーミング（NDJSON）で受信する
+            stop_when (callable): ストリーミング時、受信済みテキストを受け取りTrueを返したら受信を打ち切る
+                                  （例: ai_generator.has_complete_code_block）
+            fast (bool): Trueなら思考を無効にし（think: false）、{"code": ...}のJSONスキーマ（format）で出力させる
+                         サーバ・モデルが対応していない（400）場合は、そのモデルでは通常の生成に戻す
         """
-        self.base_url = base_url
+        self.base_url = base_url or default_ollama_url()
         self.model = model
+        self.timeout = (connect_timeout, read_timeout)
+        self.stream = stream
+        self.stop_when = stop_when
+        self.fast = fast
+        self.fast_unsupported = set()  # 高速モードに対応していなかったモデル
+        self._lock = threading.Lock()
+        # 同じホストへの接続をkeep-aliveで使い回す
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
 
-    def generate(self, prompt, **kwargs):
+    def close(self):
+        """保持している接続を閉じる"""
+        self.session.close()
+
+    def generate(self, prompt, cancel_event=None, stream=None, stop_when=None, metrics=None, **kwargs):
         """
         Ollama APIでテキスト生成を行う
         Args:
             prompt (str): 生成用プロンプト
+            cancel_event (threading.Event): セットされたら受信を打ち切りGenerationCancelledを送出する
+            stream (bool): ストリーミングで受信するか（Noneならクライアントの設定に従う）
+            stop_when (callable): 受信を打ち切る条件（Noneならクライアントの設定に従う）
+            metrics (dict): 指定すると応答の時間計測フィールド（total_duration, eval_countなど）を書き込む
+                            （ストリーミングを途中で打ち切った場合は受信したチャンク数のみ）
             **kwargs: APIに渡す追加パラメータ
         Returns:
             str: 生成されたテキスト
         """
-        url = f"{self.base_url}/api/generate"
-        payload = {
-            "model": self.model,
-            "prompt": prompt,
-            "stream": False
-        }
+        payload = {"model": self.model, "prompt": prompt}
+        payload.update(kwargs)
+        self._apply_fast(payload)
+        return self._request("/api/generate", payload, _generate_text, cancel_event, stream, stop_when, metrics)
+
+    def chat(self, messages, cancel_event=None, stream=None, stop_when=None, metrics=None, **kwargs):
+        """
+        Ollama API（/api/chat）で会話の続きを生成する
+        同じ会話（system・過去のやり取り）を先頭に付けて送ると、サーバ側で計算済みの先頭部分が再利用され、
+        再試行では追加したメッセージの分だけプロンプト評価が行われる
+        Args:
+            messages (list): [{"role": "system"|"user"|"assistant", "content": str}, ...]
+            その他: generateと同じ
+        Returns:
+            str: 生成されたメッセージの本文
+        """
+        payload = {"model": self.model, "messages": messages}
         payload.update(kwargs)
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
-        data = response.json()
-        return data.get("response", "")
+        self._apply_fast(payload)
+        return self._request("/api/chat", payload, _chat_text, cancel_event, stream, stop_when, metrics)
+
+    def _apply_fast(self, payload):
+        """高速モードのパラメータを加える（明示的に指定されたもの・対応していないモデルは除く）"""
+        if not self.fast:
+            return
+        with self._lock:
+            if payload["model"] in self.fast_unsupported:
+                return
+        for key, value in FAST_PARAMS.items():
+            payload.setdefault(key, value)
+
+    def _request(self, endpoint, payload, text_of, cancel_event=None, stream=None, stop_when=None, metrics=None):
+        """APIにリクエストを送り、応答（ストリーミングならチャンクを連結したもの）のテキストを返す"""
+        structured = "format" in payload
+        if metrics is not None:
+            metrics.update(model=payload["model"], structured=structured)
+        try:
+            return self._send(endpoint, payload, text_of, cancel_event, stream, stop_when, metrics)
+        except requests.HTTPError as e:
+            if not (self.fast and structured and e.response is not None and e.response.status_code == 400):
+                raise
+        # 思考の無効化・構造化出力に対応していないモデル（サーバ）では、以降は通常の生成にする
+        with self._lock:
+            self.fast_unsupported.add(payload["model"])
+        payload = {k: v for k, v in payload.items() if k not in FAST_PARAMS}
+        if metrics is not None:
+            metrics.update(structured=False)
+        return self._send(endpoint, payload, text_of, cancel_event, stream, stop_when, metrics)
+
+    def _send(self, endpoint, payload, text_of, cancel_event=None, stream=None, stop_when=None, metrics=None):
+        url = f"{self.base_url}{endpoint}"
+        stream = self.stream if stream is None else stream
+        stop_when = self.stop_when if stop_when is None else stop_when
+        # 中断可能にするため、cancel_eventがある場合は常にストリーミングで受信する
+        streaming = stream or cancel_event is not None
+        payload["stream"] = streaming
+        if not streaming:
+            response = self.session.post(url, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
+            if metrics is not None:
+                metrics.update(model_metrics(data))
+            return text_of(data)
+        return self._generate_stream(url, payload, text_of, cancel_event, stop_when, metrics)
+
+    def _generate_stream(self, url, payload, text_of, cancel_event=None, stop_when=None, metrics=None):
+        """NDJSONのチャンクを順に受信し、中断・打ち切り条件をチャンクごとに確認する"""
+        if cancel_event is not None and cancel_event.is_set():
+            raise GenerationCancelled()
+        text = ""
+        chunks = 0
+        with self.session.post(url, json=payload, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if cancel_event is not None and cancel_event.is_set():
+                    raise GenerationCancelled()
+                if not line:
+                    continue
+                data = json.loads(line)
+                text += text_of(data)
+                chunks += 1
+                if metrics is not None:
+                    metrics["chunks"] = chunks
+                if data.get("done"):
+                    if metrics is not None:
+                        metrics.update(model_metrics(data))
+                    break
+                # 必要な部分（例: コードブロック）が揃ったら残りは受信しない（接続を閉じて生成を止める）
+                # stop_whenが例外を送出した場合も接続を閉じて生成を止める
+                if stop_when is not None and stop_when(text):
+                    break
+        return text
+
+
+def _generate_text(data):
+    return data.get("response", "")
+
+
+def _chat_text(data):
+    return (data.get("message") or {}).get("content", "")
 
 # 今後の拡張例:
 # class ChatGPTClient(BaseAIClient): ...
@@ -57,11 +235,20 @@ def get_ai_client(name="ollama", **kwargs):
     指定名のAIクライアントインスタンスを返す
     Args:
         name (str): "ollama"などクライアント名
+                    "ollama"で環境変数OLLAMA_HOSTS（カンマ区切り）に2つ以上のホストがあれば、
+                    それらに負荷を分散するクライアント（utils/ollama_pool.py）を返す
         **kwargs: クライアントの初期化引数
     Returns:
         BaseAIClient: AIクライアントインスタンス
     """
-    if name == "ollama":
+    if name in ("ollama", "ollama-pool"):
+        from utils.ollama_pool import OllamaPoolClient, parse_hosts
+        hosts = parse_hosts(kwargs.pop("hosts", None) or os.environ.get("OLLAMA_HOSTS"))
+        if len(hosts) > 1 or (hosts and name == "ollama-pool"):
+            kwargs.pop("base_url", None)
+            return OllamaPoolClient(hosts, **kwargs)
+        if hosts:
+            kwargs.setdefault("base_url", hosts[0])
         return OllamaClient(**kwargs)
     # elif name == "chatgpt":
     #     return ChatGPTClient(**kwargs)
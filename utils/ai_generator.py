@@ -1,3 +1,5 @@
+import re
+from functools import partial
 from utils import parser_tokenize
 def check_code_elements(code, required_elements, allowed_elements):
     """
@@ -6,15 +8,18 @@ def check_code_elements(code, required_elements, allowed_elements):
     - allowed_elements: 含めてもよいパス（リスト）
     Returns: (bool, dict) 合致していればTrue, 不一致内容をdictで返す
     """
-    code_paths = set(parser_tokenize.tree_to_paths(parser_tokenize.parse_control_structure_tree(code)))
+    trie = parser_tokenize.parse_control_path_trie(code)
+    code_paths = set(trie.paths())
     required_set = set(required_elements)
     allowed_set = set(allowed_elements)
     # 必須要素がすべて含まれているか
-    missing = required_set - code_paths
+    missing = list(required_set - code_paths)
     # 許可されていない要素が含まれていないか
-    forbidden = code_paths - required_set - allowed_set
+    forbidden = list(code_paths - required_set - allowed_set)
     ok = (not missing) and (not forbidden)
-    return ok, {"missing": list(missing), "forbidden": list(forbidden), "all_paths": list(code_paths)}
+    # 禁止要素が現れる行（再解析せずにトライから求める）
+    locations = {p: trie.lines(p) for p in forbidden}
+    return ok, {"missing": missing, "forbidden": forbidden, "all_paths": list(code_paths), "locations": locations}
 """
 AIによる中間プログラム生成モジュール
 - 必須: 学習要素（必ず含める）
@@ -37,40 +42,506 @@ Please strictly follow these requirements:
 - Do NOT use any forbidden elements under any circumstances.
 - Generate only one simple and easy-to-understand example code.
 - Output code only. Do not include any explanation or comments.
-Element notes:
+{ELEMENT_NOTES}"""
+    if extra_prompt:
+        prompt += f"\n{extra_prompt}\n"
+    return prompt
+
+
+ELEMENT_NOTES = """Element notes:
 - 'if' means an if statement. if, elif, and else are distinct; allowing 'if' does not mean 'elif' or 'else' are allowed.
 - '/' denotes nesting. For example, 'for/if' means an if statement inside a for loop. 'for/for/if' means an if statement inside two nested for loops.
 - Do not assume that allowing 'for' and 'if' means 'for/if' is allowed. Only use the specified elements and nesting.
 """
-    if extra_prompt:
-        prompt += f"\n{extra_prompt}\n"
-    return prompt
+
+
+def build_chat_messages(learning_elements, allowed_elements, forbidden_elements=None, language="python"):
+    """
+    チャット形式（/api/chat）用の会話の最初のメッセージを生成
+    - system: 要素によらない指示（すべてのジョブ・再試行で共通なので、サーバ側で計算済みの先頭部分が再利用される）
+    - user: 学習要素・使用可能要素・禁止要素
+    """
+    forbidden_elements = forbidden_elements or []
+    system = f"""You are an AI for generating beginner-friendly {language} programming problems.
+Please strictly follow the requirements given by the user:
+- Allowed elements do not have to be used. Prioritize simplicity.
+- Do NOT use any forbidden elements under any circumstances.
+- Generate only one simple and easy-to-understand example code.
+- Output code only. Do not include any explanation or comments.
+{ELEMENT_NOTES}"""
+    user = f"""- Required elements: {', '.join(learning_elements)}
+- Allowed elements: {', '.join(allowed_elements)}
+- Forbidden elements: {', '.join(forbidden_elements) if forbidden_elements else 'None'}"""
+    return [{"role": "system", "content": system}, {"role": "user", "content": user}]
+
+
+def build_chat_feedback(code, missing, forbidden_used, runtime_error=None):
+    """
+    不合格だったコードと短い指摘を会話に追加するメッセージ（assistant・user）を返す
+    再試行ではこの2つだけが新たにプロンプト評価される
+    """
+    reasons = []
+    if forbidden_used:
+        reasons.append(f"Do NOT use: {', '.join(forbidden_used)}.")
+    if missing:
+        reasons.append(f"MUST use: {', '.join(missing)}.")
+    if runtime_error:
+        reasons.append(f"It failed at runtime: {runtime_error}.")
+    return [
+        {"role": "assistant", "content": f"```python\n{code or ''}\n```"},
+        {"role": "user", "content": "Rejected. " + " ".join(reasons) + " Output the corrected code only."},
+    ]
+
+# <think> ... </think> と ```python ... ``` or ``` ... ```
+THINK_PATTERN = re.compile(r'<think>[\s\S]*?</think>', flags=re.IGNORECASE)
+CODE_BLOCK_PATTERN = re.compile(r"```(?:python)?\s*([\s\S]+?)```")
+
+# 高速モード（JSONスキーマで出力させた場合）の応答の先頭: {"code": "
+STRUCTURED_PREFIX_PATTERN = re.compile(r'\s*\{\s*"code"\s*:\s*"')
+
+
+def parse_structured_code(response):
+    """
+    高速モードの応答（{"code": "..."}）からコードを取り出す（JSONでなければNone）
+    コードがさらにコードブロックで囲まれている場合は中身を返す
+    """
+    import json
+    if not response.lstrip().startswith("{"):
+        return None
+    try:
+        data = json.loads(response)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get("code"), str):
+        return None
+    code_blocks = CODE_BLOCK_PATTERN.findall(data["code"])
+    return code_blocks[0].strip() if code_blocks else data["code"].strip()
+
+
+def partial_structured_code(response):
+    """
+    受信途中の高速モードの応答から、codeの文字列のうち受信済みの部分を返す
+    Returns: (code, complete)  高速モードの応答でなければ (None, False)
+    """
+    import json
+    match = STRUCTURED_PREFIX_PATTERN.match(response)
+    if match is None:
+        return None, False
+    escaped = False
+    end = None
+    body = response[match.end():]
+    for i, ch in enumerate(body):
+        if escaped:
+            escaped = False
+        elif ch == "\\":
+            escaped = True
+        elif ch == '"':
+            end = i
+            break
+    text = body if end is None else body[:end]
+    # 受信途中なら、末尾で切れたエスケープ（\ や \uXXXX の途中）を除いて復元する
+    for cut in range(6 if end is None else 1):
+        try:
+            return json.loads(f'"{text[:len(text) - cut]}"'), end is not None
+        except ValueError:
+            continue
+    return None, False
+
 
 def extract_code_from_ai_response(response):
     """
     AIの出力からコード部分のみを抽出する
+    - 高速モードの応答（{"code": "..."}）ならcodeの値を返す（<think>・コードブロックの除去は不要）
     - コードブロック（```python ... ```や``` ... ```）があればその中身を返す
     - なければ全体を返す
     """
-    import re
+    code = parse_structured_code(response)
+    if code is not None:
+        return code
     # <think> ... </think> を除去
-    response = re.sub(r'<think>[\s\S]*?</think>', '', response, flags=re.IGNORECASE)
-    # ```python ... ``` or ``` ... ```
-    code_blocks = re.findall(r"```(?:python)?\s*([\s\S]+?)```", response)
+    response = THINK_PATTERN.sub('', response)
+    code_blocks = CODE_BLOCK_PATTERN.findall(response)
     if code_blocks:
         return code_blocks[0].strip()
     return response.strip()
+
+def has_complete_code_block(response):
+    """
+    受信途中のAI出力から、extract_code_from_ai_responseが完結したコードブロックを取り出せるか判定
+    （ストリーミング受信の打ち切り条件に使う。閉じていない<think>内のブロックは対象外）
+    高速モードの応答（{"code": ...}）はJSONの終わりで生成も終わるので打ち切らない（完了時の時間計測を受け取る）
+    """
+    if STRUCTURED_PREFIX_PATTERN.match(response):
+        return False
+    lower = response.lower()
+    if lower.count('<think>') > lower.count('</think>'):
+        return False
+    return CODE_BLOCK_PATTERN.search(THINK_PATTERN.sub('', response)) is not None
 # 例: 実際のAI API呼び出し部分はダミー関数で用意
 
-def generate_code_with_ai(learning_elements, allowed_elements, forbidden_elements=None, language="python", ai_func=None, extra_prompt=None):
+def _call_ai(ai_func, prompt, telemetry=None, **ai_kwargs):
+    """ai_funcを呼ぶ（telemetryがあればリクエスト時間とAIの時間計測フィールドを記録する）"""
+    if telemetry is None:
+        return ai_func(prompt, **ai_kwargs)
+    metrics = {}
+    try:
+        with telemetry.span("request"):
+            response = ai_func(prompt, metrics=metrics, **ai_kwargs)
+    except Exception:
+        telemetry.add_model_metrics(metrics)
+        raise
+    telemetry.add_model_metrics(metrics, response)
+    return response
+
+
+def generate_candidate(learning_elements, allowed_elements, forbidden_elements=None, language="python", ai_func=None, extra_prompt=None, cache=None, model=None, telemetry=None, messages=None, **ai_kwargs):
+    """
+    候補を1つ生成する（cacheがあれば、再利用できる生成結果を先に探す）
+    cache: GenerationCache（Noneならキャッシュしない）
+    model: キャッシュキーに使うモデル名
+    telemetry: Telemetry（処理段階の時間・AIの時間計測フィールドを記録する。ai_funcがmetrics引数に対応している必要がある）
+    messages: チャット形式で生成する場合の会話（ai_funcはプロンプトの代わりにmessagesを受け取る関数。例: OllamaClient.chat）
+    Returns: (code, cache_key, cached)  cache_keyはcacheがなければNone
+    """
+    import json
+    from contextlib import nullcontext
+    span = telemetry.span if telemetry is not None else (lambda stage: nullcontext())
+    with span("prompt_build"):
+        if messages is not None:
+            # キャッシュキーには会話全体を使う
+            prompt = json.dumps(messages, ensure_ascii=False)
+        else:
+            prompt = build_prompt(learning_elements, allowed_elements, forbidden_elements, language, extra_prompt=extra_prompt)
+    if ai_func is None:
+        # ダミー: 実際はAPI呼び出し等
+        return f"# AI生成コード（ダミー）\n# prompt:\n{prompt}", None, False
+    key = None
+    if cache is not None:
+        # 受信方法の指定など生成結果に影響しない引数はキーに含めない
+        options = {k: v for k, v in ai_kwargs.items() if k not in ("cancel_event", "stream", "stop_when", "metrics")}
+        key = cache.make_key(model, prompt, options)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry["code"], key, True
+    response = _call_ai(ai_func, messages if messages is not None else prompt, telemetry, **ai_kwargs)
+    _raise_if_cancelled(ai_kwargs.get("cancel_event"))
+    with span("extract"):
+        code = extract_code_from_ai_response(response)
+    if cache is not None:
+        cache.put(key, model, prompt, options, response, code)
+    return code, key, False
+
+
+def _raise_if_cancelled(cancel_event):
+    """cancel_eventがセットされていればGenerationCancelledを送出する（受信し終えた候補も、他の候補の合格後は判定・記録しない）"""
+    if cancel_event is not None and cancel_event.is_set():
+        from utils.ai_api import GenerationCancelled
+        raise GenerationCancelled()
+
+
+def generate_code_with_ai(learning_elements, allowed_elements, forbidden_elements=None, language="python", ai_func=None, extra_prompt=None, cache=None, model=None, **ai_kwargs):
     """
     AIモデルを使って中間プログラムを生成
     ai_func: 実際のAI呼び出し関数 (プロンプトを引数にとる関数)
     extra_prompt: 追加でプロンプト末尾に追記する文
+    cache, model: 生成結果のキャッシュとキーに使うモデル名（generate_candidate参照）
+    **ai_kwargs: ai_funcにそのまま渡す追加パラメータ（options, cancel_eventなど）
     """
-    prompt = build_prompt(learning_elements, allowed_elements, forbidden_elements, language, extra_prompt=extra_prompt)
-    if ai_func is None:
-        # ダミー: 実際はAPI呼び出し等
-        return f"# AI生成コード（ダミー）\n# prompt:\n{prompt}"
-    response = ai_func(prompt)
-    return extract_code_from_ai_response(response)
+    code, _, _ = generate_candidate(learning_elements, allowed_elements, forbidden_elements, language,
+                                    ai_func=ai_func, extra_prompt=extra_prompt, cache=cache, model=model, **ai_kwargs)
+    return code
+
+
+def validate_generated_code(code, learning_elements, allowed_elements, log=print):
+    """
+    生成コードを判定する（空コード・解析時の例外もFalseとして扱う）
+    Returns: (bool, dict) check_code_elementsと同じ形式（判定不能時はdictが空）
+    """
+    # AI生成コードが空や構文的に不正な場合はcheck_code_elementsを呼ばずにエラー回避
+    if not code or not code.strip():
+        log("AI生成コードが空です。check_code_elementsをスキップします。")
+        return False, {}
+    try:
+        return check_code_elements(code, learning_elements, allowed_elements)
+    except Exception as e:
+        log(f"check_code_elementsで例外発生: {e}\nコード内容: {code}")
+        return False, {}
+
+
+def build_reject_reason(missing, forbidden_used, runtime_error=None):
+    """不合格理由をプロンプト追記用の文に変換する（理由がなければ空文字）"""
+    reasons = []
+    if forbidden_used:
+        reasons.append(f"The following elements must NOT be used: {', '.join(forbidden_used)}.")
+    if missing:
+        reasons.append(f"The following elements MUST be used: {', '.join(missing)}.")
+    if runtime_error:
+        reasons.append(f"The code must run without errors and finish quickly (it failed with: {runtime_error}).")
+    if reasons:
+        return "\n[Note for AI] Previous output was rejected for the following reasons: " + " ".join(reasons) + " Please strictly follow the requirements."
+    return ""
+
+
+# 投機的生成で候補ごとに変える温度（候補数がこれより多い場合は循環させる）
+SPECULATIVE_TEMPERATURES = [0.2, 0.5, 0.8, 1.0, 0.35, 0.65, 0.9]
+
+
+def speculative_options(k, wave=0):
+    """候補k個分の生成オプション（seed・temperatureをずらす）を返す"""
+    return [
+        {"options": {"seed": wave * k + i + 1,
+                     "temperature": SPECULATIVE_TEMPERATURES[i % len(SPECULATIVE_TEMPERATURES)]}}
+        for i in range(k)
+    ]
+
+
+def validate_runtime(code, sandbox, log=print):
+    """
+    サンドボックスでコードを実行し、例外・時間切れなしに終了するか判定する
+    Returns: (bool, dict) dictはSandboxPool.runの結果
+    """
+    result = sandbox.run(code)
+    if not result["ok"]:
+        log(f"[RUNTIME] 実行時にエラーになりました: {result['error']}")
+    return result["ok"], result
+
+
+def _reject_reasons(info):
+    """判定結果（info）から不合格理由 (missing, forbidden, runtime_error) を取り出す"""
+    if not info:
+        return [], [], None
+    return info.get('missing', []), info.get('forbidden', []), (info.get('runtime') or {}).get('error')
+
+
+def _log_result(log, ok, info):
+    missing = info.get('missing', []) if info else []
+    forbidden_used = info.get('forbidden', []) if info else []
+    if ok:
+        log("Code meets the requirements.")
+    else:
+        log("Code does not meet the requirements:")
+        log(f"Missing elements: {missing}")
+        log(f"Forbidden elements: {forbidden_used}")
+        locations = info.get('locations') if info else None
+        if locations:
+            log(f"Forbidden element lines: {locations}")
+        log(f"All paths in code: {info['all_paths'] if info else ''}")
+        if info and info.get('runtime'):
+            log(f"Runtime error: {info['runtime']['error']}")
+
+
+def _record_attempt(telemetry, ok, info, **fields):
+    if telemetry is not None:
+        telemetry.record("attempt", ok=ok, missing=info.get('missing', []) if info else [],
+                         forbidden=info.get('forbidden', []) if info else [],
+                         runtime_error=_reject_reasons(info)[2],
+                         stages=dict(telemetry.stages), model_metrics=telemetry.model_metrics, **fields)
+
+
+def _attempt(attempt, learning_elements, allowed_elements, forbidden_elements, ai_func, extra_prompt, log, cache=None, model=None, validate_stream=False, telemetry=None, sandbox=None, **ai_kwargs):
+    """
+    候補を1つ生成して判定する
+    validate_stream: Trueならストリーミング受信中に逐次判定し、禁止要素が現れた時点で生成を打ち切る
+    telemetry: Telemetry（候補ごとの処理段階の時間・判定結果を記録する）
+    sandbox: SandboxPool（構造の判定に合格したコードを実行し、例外・時間切れなら不合格にする）
+    Returns: (code, cache_key, ok, info)
+    """
+    from contextlib import nullcontext
+    from utils.stream_validator import IncrementalPathValidator, ForbiddenElementInStream
+    if telemetry is not None:
+        telemetry = telemetry.bind(attempt=attempt)
+    if validate_stream:
+        validator = IncrementalPathValidator(learning_elements, allowed_elements)
+        ai_kwargs.update(stream=True, stop_when=validator)
+    try:
+        code, key, cached = generate_candidate(learning_elements, allowed_elements, forbidden_elements, ai_func=ai_func,
+                                               extra_prompt=extra_prompt, cache=cache, model=model, telemetry=telemetry, **ai_kwargs)
+    except ForbiddenElementInStream as e:
+        log(f"=====[Generated code attempt {attempt}] (aborted)=====")
+        log(e.partial_code.rstrip())
+        log("==========================")
+        log(f"[STREAM] 禁止要素 {e.forbidden} を検出したため生成を中断しました。")
+        info = e.to_info()
+        _log_result(log, False, info)
+        _record_attempt(telemetry, False, info, cached=False, aborted=True)
+        return e.partial_code, None, False, info
+    _raise_if_cancelled(ai_kwargs.get("cancel_event"))
+    log(f"=====[Generated code attempt {attempt}]{' (cached)' if cached else ''}=====")
+    log(code)
+    log("==========================")
+    with telemetry.span("check") if telemetry is not None else nullcontext():
+        ok, info = validate_generated_code(code, learning_elements, allowed_elements, log=log)
+    if ok and sandbox is not None:
+        with telemetry.span("runtime") if telemetry is not None else nullcontext():
+            ok, runtime = validate_runtime(code, sandbox, log=log)
+        info = dict(info, runtime=runtime)
+    if cache is not None and key is not None:
+        cache.record_validation(key, ok, info)
+    _log_result(log, ok, info)
+    _record_attempt(telemetry, ok, info, cached=cached)
+    return code, key, ok, info
+
+
+def _run_wave(learning_elements, allowed_elements, forbidden_elements, ai_func, extra_prompt, option_list, attempt_base, log, cache=None, model=None, validate_stream=False, telemetry=None, messages=None, sandbox=None, on_result=None):
+    """
+    候補を同時に生成し、届いた順に判定する。最初の合格候補で残りをキャンセルする
+    messages: チャット形式の場合の会話（全候補で同じ会話の続きを生成する）
+    on_result: 判定した候補ごとに (生成オプション, 合否) で呼ぶ関数
+    Returns: (合格した(code, info, cache_key) または None, 最後に判定した(code, info), 不合格候補の[(missing, forbidden, runtime_error)])
+    """
+    import threading
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    from utils.ai_api import GenerationCancelled
+    cancel_event = threading.Event()
+    executor = ThreadPoolExecutor(max_workers=len(option_list))
+    futures = {
+        executor.submit(_attempt, attempt_base + i, learning_elements, allowed_elements, forbidden_elements,
+                        ai_func, extra_prompt, log, cache=cache, model=model, validate_stream=validate_stream,
+                        telemetry=telemetry, messages=messages, sandbox=sandbox, cancel_event=cancel_event, **options): attempt_base + i
+        for i, options in enumerate(option_list)
+    }
+    winner = None
+    last = (None, {})
+    rejected = []
+    try:
+        for future in as_completed(futures):
+            attempt = futures[future]
+            try:
+                code, key, ok, info = future.result()
+            except GenerationCancelled:
+                continue
+            except Exception as e:
+                log(f"[candidate {attempt}] 生成で例外発生: {e}")
+                continue
+            last = (code, info)
+            if on_result is not None:
+                on_result(option_list[attempt - attempt_base], ok)
+            if ok:
+                winner = (code, info, key)
+                break
+            rejected.append(_reject_reasons(info))
+    finally:
+        # 合格が出たら実行中のリクエストを中断し、未開始の候補は破棄する
+        # 実行中の候補はcancel_eventを見て抜けるのを待つ（戻った後にログ・キャッシュへ書き込まないように）
+        cancel_event.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+    return winner, last, rejected
+
+
+def job_cache_key(cache, model, learning_elements, allowed_elements, forbidden_elements):
+    """ジョブ（モデル・要素条件）単位のキャッシュキー"""
+    return cache.make_key(model, build_prompt(learning_elements, allowed_elements, forbidden_elements), {"job": True})
+
+
+def lookup_job_cache(cache, model, learning_elements, allowed_elements, forbidden_elements, log=print, sandbox=None):
+    """
+    同じモデル・要素条件で以前に合格したコードをキャッシュから探す（再判定して合格したものだけ返す）
+    sandbox: SandboxPool（指定すれば実行検査も行う）
+    Returns: (code, info) または None
+    """
+    entry = cache.get_job(job_cache_key(cache, model, learning_elements, allowed_elements, forbidden_elements))
+    if entry is None:
+        return None
+    ok, info = validate_generated_code(entry["code"], learning_elements, allowed_elements, log=log)
+    if ok and sandbox is not None:
+        ok, runtime = validate_runtime(entry["code"], sandbox, log=log)
+        info = dict(info, runtime=runtime)
+    if not ok:
+        return None
+    log("[CACHE] 以前に合格したコードを再利用します。")
+    log(entry["code"])
+    return entry["code"], info
+
+
+def generate_valid_code(learning_elements, allowed_elements, forbidden_elements, ai_func, max_retry=3, speculative=1, log=print, cache=None, model=None, validate_stream=False, telemetry=None, chat=False, sandbox=None, retry_policy=None):
+    """
+    条件を満たすコードが得られるまで生成・判定を繰り返す
+    ai_func: プロンプトと追加パラメータ（**kwargs）を受け取りAIの出力を返す関数
+    max_retry: 生成回数（候補数）の上限
+    speculative: 1回の波で同時に生成する候補数。2以上ならseed/temperatureを変えて並列に生成し、
+                 最初に合格した候補を採用して残りをキャンセルする。不合格理由は次の波のプロンプトに反映する
+    cache: GenerationCache。同じモデル・要素条件で以前に合格したコードがあればAIを呼ばずに返す
+    model: キャッシュキーに使うモデル名
+    validate_stream: ストリーミング受信中に逐次判定し、禁止要素が現れた候補はその時点で打ち切る
+                     （ai_funcがstream・stop_when引数に対応している必要がある。例: OllamaClient.generate）
+    telemetry: Telemetry（候補ごとの処理段階の時間・AIの時間計測フィールドを記録する。ai_funcがmetrics引数に対応している必要がある）
+    chat: Trueなら会話形式で生成する（ai_funcはmessagesを受け取る関数。例: OllamaClient.chat）
+          共通の指示はsystemメッセージで送り、再試行では不合格のコードと短い指摘だけを会話に追加する
+    sandbox: SandboxPool（構造の判定に合格したコードを実行し、例外・時間切れなら不合格として再生成する）
+    retry_policy: RetryPolicy（過去の合否の記録から生成回数の上限（max_retry以下）・温度の順を決め、結果を記録する）
+    Returns: (code, ok, info, attempts)  attemptsは実際に判定した候補数（キャッシュの合格品を使った場合は0）
+    """
+    job_key = None
+    if cache is not None:
+        job_key = job_cache_key(cache, model, learning_elements, allowed_elements, forbidden_elements)
+        hit = lookup_job_cache(cache, model, learning_elements, allowed_elements, forbidden_elements, log=log, sandbox=sandbox)
+        if hit is not None:
+            code, info = hit
+            return code, True, info, 0
+    plan = None
+    if retry_policy is not None:
+        plan = retry_policy.plan(learning_elements, allowed_elements, model, max_retry)
+        if plan["hopeless"]:
+            log(f"[RETRY] {learning_elements}（{model}, allowed {len(allowed_elements)}件）は{plan['reason']}のため、{plan['budget']}回だけ試します。")
+        elif plan["budget"] < max_retry:
+            log(f"[RETRY] {plan['reason']}のため、生成は最大{plan['budget']}回にします。")
+        if telemetry is not None:
+            telemetry.record("retry_plan", learning_elements=learning_elements, max_retry=max_retry, budget=plan["budget"],
+                             hopeless=plan["hopeless"], rate=plan["rate"], evidence=plan["evidence"])
+        max_retry = plan["budget"]
+
+    def finish(code, ok, info, attempts):
+        if plan is not None:
+            retry_policy.record_job(plan, ok, attempts)
+            if not ok and plan["hopeless"]:
+                log(f"[RETRY] {learning_elements}（{model}）は合格しませんでした（{plan['reason']}）。"
+                    "要素条件・モデルを見直すか、記録（.degap_cache/retry_stats.json）を削除してやり直してください。")
+        return code, ok, info, attempts
+
+    prompt_reason = ""
+    messages = build_chat_messages(learning_elements, allowed_elements, forbidden_elements) if chat else None
+    code, info = None, {}
+    attempts = 0
+    wave = 0
+    while attempts < max_retry:
+        if speculative <= 1:
+            options = retry_policy.options(plan, attempts)[0] if plan is not None else {}
+            attempts += 1
+            code, key, ok, info = _attempt(attempts, learning_elements, allowed_elements, forbidden_elements, ai_func,
+                                           prompt_reason, log, cache=cache, model=model, validate_stream=validate_stream, telemetry=telemetry,
+                                           messages=messages, sandbox=sandbox, **options)
+            if plan is not None:
+                retry_policy.record_attempt(plan, options, ok)
+            if ok:
+                if cache is not None and key is not None:
+                    cache.record_job(job_key, key)
+                return finish(code, True, info, attempts)
+            missing, forbidden_used, runtime_error = _reject_reasons(info)
+            if chat:
+                messages = messages + build_chat_feedback(code, missing, forbidden_used, runtime_error)
+            else:
+                prompt_reason = build_reject_reason(missing, forbidden_used, runtime_error)
+            continue
+        k = min(speculative, max_retry - attempts)
+        winner, (code, info), rejected = _run_wave(
+            learning_elements, allowed_elements, forbidden_elements, ai_func, prompt_reason,
+            retry_policy.options(plan, attempts, k) if plan is not None else speculative_options(k, wave),
+            attempts + 1, log, cache=cache, model=model, validate_stream=validate_stream, telemetry=telemetry,
+            messages=messages, sandbox=sandbox, on_result=partial(retry_policy.record_attempt, plan) if plan is not None else None)
+        attempts += k
+        wave += 1
+        if winner:
+            code, info, key = winner
+            if cache is not None and key is not None:
+                cache.record_job(job_key, key)
+            return finish(code, True, info, attempts)
+        # 不合格候補すべての理由をまとめて次の波に渡す
+        missing = sorted({m for ms, _, _ in rejected for m in ms})
+        forbidden_used = sorted({f for _, fs, _ in rejected for f in fs})
+        runtime_error = next((e for _, _, e in rejected if e), None)
+        if chat:
+            messages = messages + build_chat_feedback(code, missing, forbidden_used, runtime_error)
+        else:
+            prompt_reason = build_reject_reason(missing, forbidden_used, runtime_error)
+    log("Failed to generate code that meets the requirements after multiple attempts.")
+    return finish(code, False, info, attempts)
@@ -0,0 +1,151 @@
+"""
+制御構造の統合解析エンジン
+ソースを1度だけtokenizeし、1回の走査で以下をまとめて求める
+- ネスト構造のツリー（parse_control_structure_treeと同じ形のノード）
+- パスのリスト（tree_to_pathsと同じ順序）
+- ノードごとのネスト深さ・行範囲（line〜end_line）
+- パスのトライ（utils/path_trie.py。パスごとの出現回数・出現行）
+parser_tokenize / parser / parser_ast の各関数はこの結果のビューとして実装する
+バックエンドは2種類（set_backendで切り替える）
+- "tokenize": tokenizeの全トークンを走査する（内包表記・条件式のif/for/elseも数える）
+- "scan": utils/control_scanner.pyの高速スキャナ（文の先頭の制御キーワードだけを数える）
+"""
+import io
+import tokenize
+
+from utils import control_elements
+from utils import control_scanner
+from utils.path_trie import PathTrie
+
+# 解析が途中で打ち切られうる例外（末尾が閉じていないコードなど）
+PARTIAL_ERRORS = (tokenize.TokenError, IndentationError, SyntaxError, IndexError)
+
+BACKENDS = ("tokenize", "scan")
+DEFAULT_BACKEND = "tokenize"
+_backend = DEFAULT_BACKEND
+
+
+def get_backend():
+    """現在の解析バックエンド名"""
+    return _backend
+
+
+def set_backend(name):
+    """解析バックエンドを切り替える（"tokenize" / "scan"）"""
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f"unknown parser backend: {name}（{', '.join(BACKENDS)}のいずれか）")
+    _backend = name
+
+
+def analyze_tokens(tokens, partial=False):
+    """
+    トークン列を1回走査して解析結果を返す
+    partial: Trueなら途中で解析できなくなった時点までの結果を返す（例外を送出しない）
+    Returns: {'tree': [...], 'paths': [...], 'nodes': [...], 'trie': PathTrie}
+      ノード: {'type', 'children', 'depth', 'path', 'line', 'end_line'}
+    """
+    root = []  # 最上位のノードリスト
+    nodes = []  # 出現順（= ツリーの前順）のノード
+    paths = []
+    trie = PathTrie()
+    # (現在のノードリスト, インデントレベル, そのブロックを持つノード, そのノードのトライのノード)
+    stack = [(root, -1, None, trie.root)]
+    control_keywords = control_elements.get_control_elements()
+    pending = None  # 文の終わり（NEWLINE）を待っているノード
+    last_row = 0
+    at_line_start = True  # 論理行の先頭トークンを待っているか
+    line_node = None  # 現在の論理行が制御構文で始まっていればそのノード
+    block_owner = None  # 直前の論理行が制御構文で始まっていればそのノード（次のブロックの持ち主）
+    line_trie = block_trie = None  # line_node・block_ownerのトライのノード
+    try:
+        for token in tokens:
+            if token.type == tokenize.INDENT:
+                # 新しいブロックに入る
+                if block_owner is not None:
+                    # 制御構文のブロック: そのノードの子になる
+                    stack.append((block_owner['children'], token.start[1], block_owner, block_trie))
+                else:
+                    # def・class・whileなど制御要素以外のブロック: 外側と同じ階層として扱う
+                    stack.append((stack[-1][0], token.start[1], stack[-1][2], stack[-1][3]))
+                block_owner = None
+            elif token.type == tokenize.DEDENT:
+                # ブロックを抜ける（ブロックを持つノードの範囲が確定する）
+                if len(stack) > 1:
+                    owner = stack.pop()[2]
+                    if owner is not None:
+                        owner['end_line'] = last_row
+            elif token.type == tokenize.NEWLINE:
+                last_row = token.start[0]
+                if pending is not None:
+                    pending['end_line'] = last_row
+                    pending = None
+                block_owner, block_trie = line_node, line_trie
+                line_node = None
+                at_line_start = True
+            elif token.type in (tokenize.NL, tokenize.COMMENT, tokenize.ENCODING):
+                continue
+            elif token.type == tokenize.NAME and token.string in control_keywords:
+                parent = stack[-1][2]
+                path = token.string if parent is None else f"{parent['path']}/{token.string}"
+                node = {
+                    'type': token.string,
+                    'children': [],
+                    'depth': len(stack) - 1,
+                    'path': path,
+                    'line': token.start[0],
+                    'end_line': token.start[0],
+                }
+                stack[-1][0].append(node)
+                nodes.append(node)
+                paths.append(path)
+                trie_node = stack[-1][3].child(token.string)
+                trie_node.count += 1
+                trie_node.lines.append(token.start[0])
+                pending = node
+                if at_line_start:
+                    line_node, line_trie = node, trie_node
+                at_line_start = False
+            else:
+                at_line_start = False
+    except PARTIAL_ERRORS:
+        if not partial:
+            raise
+    return {'tree': root, 'paths': paths, 'nodes': nodes, 'trie': trie}
+
+
+def analyze(code, partial=False, backend=None):
+    """
+    コード文字列を解析する（analyze_tokens参照）
+    backend: 解析バックエンド（Noneならset_backendで選んだもの）
+    """
+    if (backend or _backend) == "scan":
+        return control_scanner.scan(code, partial=partial)
+    tokens = tokenize.tokenize(io.BytesIO(code.encode('utf-8')).readline)
+    return analyze_tokens(tokens, partial=partial)
+
+
+def analyze_file(path, partial=False):
+    """ファイルを読み込んで解析する"""
+    with open(path, 'r', encoding='utf-8') as f:
+        code = f.read()
+    return analyze(code, partial=partial)
+
+
+def analyze_many(paths, index=None):
+    """
+    複数ファイルを解析し、パスの順に結果のリストを返す
+    index: AnalysisIndex（指定すれば変更のないファイルは再解析しない。結果はtree・pathsのみ）
+    """
+    if index is not None:
+        return [index.get(path) for path in paths]
+    return [analyze_file(path) for path in paths]
+
+
+def iter_nodes(tree):
+    """ツリーのノードを前順にたどる（インデックスから復元したツリー用）"""
+    stack = list(reversed(tree))
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(reversed(node['children']))
@@ -0,0 +1,143 @@
+"""
+ファイルごとの解析結果（制御構造ツリー・パス）を保存するディスク上のインデックス
+- 内容のハッシュ（sha256）をキーに解析結果を保持し、新規・変更されたファイルだけを再解析する
+- mtime・サイズが前回と同じならハッシュ計算も省略する
+- detect_gaps_cli・degap・gap_detector・--pathsで共有する
+"""
+import hashlib
+import json
+import os
+import threading
+
+from utils import analysis_engine
+from utils.control_elements import CONTROL_ELEMENTS
+from utils.file_utils import atomic_write_json
+
+DEFAULT_INDEX_PATH = os.path.join(".degap_cache", "analysis_index.json")
+
+# 解析結果の形式やパーサの挙動を変えたら上げる（古いインデックスは破棄される）
+INDEX_VERSION = 3
+
+
+def analyze_code(code):
+    """コードを解析し、インデックスに保存する形式（tree, paths）で返す"""
+    result = analysis_engine.analyze(code)
+    return {"tree": result["tree"], "paths": result["paths"]}
+
+
+def analyze_file(path):
+    """
+    ファイルを読み込んで解析する（プロセスプールのワーカーからも呼ぶ）
+    Returns: (内容のsha256, 解析結果, mtime(ns), サイズ)
+    """
+    st = os.stat(path)
+    with open(path, "rb") as f:
+        data = f.read()
+    return hashlib.sha256(data).hexdigest(), analyze_code(data.decode("utf-8")), st.st_mtime_ns, st.st_size
+
+
+class AnalysisIndex:
+    def __init__(self, index_path=DEFAULT_INDEX_PATH):
+        """
+        Args:
+            index_path (str): インデックスの保存先（JSON）。Noneならメモリ上のみ
+        """
+        self.index_path = index_path
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.parsed = 0
+        self.reused = 0
+        self._entries = self._load()
+
+    def _signature(self):
+        # 制御要素の語彙・解析バックエンドが変わったら解析結果も変わるので、署名に含める
+        return {"version": INDEX_VERSION, "control_elements": sorted(CONTROL_ELEMENTS),
+                "parser": analysis_engine.get_backend()}
+
+    def _load(self):
+        if self.index_path is None:
+            return {}
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get("signature") != self._signature():
+            return {}
+        return data.get("files", {})
+
+    def save(self):
+        """変更があればインデックスを書き出す"""
+        with self._lock:
+            if self.index_path is None or not self._dirty:
+                return
+            os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+            atomic_write_json(self.index_path, {"signature": self._signature(), "files": self._entries})
+            self._dirty = False
+
+    def lookup(self, path):
+        """
+        前回から変更のないファイルなら保存済みの解析結果を返す（変更・未登録ならNone）
+        mtime・サイズが同じなら読み込み自体を省略し、違えば内容のハッシュで確認する
+        """
+        key = os.path.abspath(path)
+        st = os.stat(path)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry["mtime"] != st.st_mtime_ns or entry["size"] != st.st_size:
+            with open(path, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            if entry["hash"] != digest:
+                return None
+            with self._lock:
+                entry["mtime"], entry["size"] = st.st_mtime_ns, st.st_size
+                self._dirty = True
+        with self._lock:
+            self.reused += 1
+        return entry["result"]
+
+    def store(self, path, digest, result, mtime=None, size=None):
+        """解析結果を登録する（mtime・サイズを省略した場合は現在のファイルから取得）"""
+        if mtime is None or size is None:
+            st = os.stat(path)
+            mtime, size = st.st_mtime_ns, st.st_size
+        with self._lock:
+            self._entries[os.path.abspath(path)] = {"mtime": mtime, "size": size, "hash": digest, "result": result}
+            self.parsed += 1
+            self._dirty = True
+
+    def get(self, path):
+        """
+        ファイルの解析結果 {'tree': ..., 'paths': [...]} を返す
+        前回から変更がなければ保存済みの結果を使い、変更されていれば再解析する
+        """
+        result = self.lookup(path)
+        if result is not None:
+            return result
+        digest, result, mtime, size = analyze_file(path)
+        self.store(path, digest, result, mtime, size)
+        return result
+
+    def paths(self, path):
+        """ファイルの制御構文パスの集合を返す"""
+        return set(self.get(path)["paths"])
+
+    def trie(self, path):
+        """ファイルのパスのトライ（出現回数・出現行付き）を返す（保存済みのツリーから作るので再解析しない）"""
+        from utils.path_trie import PathTrie
+        return PathTrie.from_tree(self.get(path)["tree"])
+
+    def prune(self, existing_paths):
+        """existing_pathsに含まれないファイルのエントリを削除する"""
+        keep = {os.path.abspath(p) for p in existing_paths}
+        with self._lock:
+            for key in [k for k in self._entries if k not in keep]:
+                del self._entries[key]
+                self._dirty = True
+
+    def stats(self):
+        """再解析・再利用したファイル数を返す"""
+        with self._lock:
+            return {"parsed": self.parsed, "reused": self.reused, "entries": len(self._entries)}
@@ -0,0 +1,35 @@
+"""
+制御要素の語彙レジストリ
+main.py・各パーサ・AI生成処理で共有する制御要素の定義を1か所にまとめる
+（モジュール読み込み時に1度だけ構築し、以降はキャッシュを返す）
+"""
+
+# 解析対象の制御要素（あとから編集しやすい）
+CONTROL_ELEMENTS = [
+    'if', 'elif', 'else', 'for', 'break', 'continue'
+    # 必要に応じて他の要素も追加
+]
+
+# 制御要素の優先順位リスト（あとから編集しやすい）
+CONTROL_PRIORITY = [
+    'if', 'elif', 'else', 'for', 'break', 'continue'
+    # 必要に応じて他の要素も追加
+]
+
+_control_keywords = frozenset(CONTROL_ELEMENTS)
+_priority_index = {p: i for i, p in enumerate(CONTROL_PRIORITY)}
+
+
+def get_control_elements():
+    """制御要素の集合（frozenset）を返す"""
+    return _control_keywords
+
+
+def part_priority(part):
+    """制御要素1つの優先順位（未登録なら最後尾）"""
+    return _priority_index.get(part, len(CONTROL_PRIORITY))
+
+
+def path_priority_key(path):
+    """パス（例: 'if/else'）に優先順位を適用するためのキー"""
+    return tuple(part_priority(p) for p in path.split('/'))
@@ -0,0 +1,198 @@
+"""
+制御構文の高速スキャナ（統合解析エンジンのtokenize以外のバックエンド）
+- tokenizeで全トークンを作らず、正規表現で文字列・コメント・括弧・区切り（; と括弧の外の :）だけを拾い、
+  論理行の先頭のインデントと、文の先頭の単語だけを調べる
+- 文の先頭（論理行の先頭・; の直後・括弧の外の : の直後）にある制御キーワードだけを記録する
+  （内包表記・条件式の for / if / else は数えない）
+- 文の先頭のキーワードについては、analysis_engine.analyze_tokensと同じツリー・パス・ノード（行範囲を含む）を返す
+"""
+import re
+import tokenize
+
+from utils import control_elements
+from utils.path_trie import PathTrie
+
+# 文字列・コメント・括弧・区切りなど、論理行とネストの判定に必要なものだけを拾う
+_TOKEN_PATTERN = re.compile(r"""
+    (?P<nl>\n)
+  | (?P<comment>\#[^\n]*)
+  | (?P<str>'''(?:[^'\\]|\\.|'(?!''))*'''
+          | \"\"\"(?:[^"\\]|\\.|"(?!""))*\"\"\"
+          | '(?:[^'\\\n]|\\.)*'
+          | "(?:[^"\\\n]|\\.)*")
+  | (?P<open>[(\[{])
+  | (?P<close>[)\]}])
+  | (?P<sep>;|:(?!=))
+  | (?P<cont>\\\r?\n)
+  | (?P<bad>'''|\"\"\"|['"])
+""", re.VERBOSE | re.DOTALL)
+# 行頭のインデント（空行・コメントだけの行はインデントを変えない）
+_LINE_START_PATTERN = re.compile(r"([ \t\f]*)(\#[^\n]*)?(\r?\n)?")
+_keyword_patterns = {}
+
+
+def _keyword_pattern(keywords):
+    """文の先頭の制御キーワード（async for の for も文の先頭として扱う）に一致するパターン（語彙ごとにキャッシュ）"""
+    pattern = _keyword_patterns.get(keywords)
+    if pattern is None:
+        words = "|".join(re.escape(k) for k in sorted(keywords, key=len, reverse=True))
+        pattern = _keyword_patterns[keywords] = re.compile(rf"[ \t\f]*(async[ \t\f]+)?({words})\b")
+    return pattern
+
+
+def _indent_width(indent):
+    """インデントの桁数（tokenizeと同じくタブは8桁ごと、改ページで0に戻す）"""
+    if "\t" not in indent and "\f" not in indent:
+        return len(indent)
+    column = 0
+    for ch in indent:
+        if ch == " ":
+            column += 1
+        elif ch == "\t":
+            column = (column // 8 + 1) * 8
+        else:
+            column = 0
+    return column
+
+
+def scan(code, partial=False):
+    """
+    コード文字列を走査して解析結果を返す（analysis_engine.analyze_tokensと同じ形式）
+    partial: Trueなら途中で解析できなくなった時点までの結果を返す（例外を送出しない）
+    Returns: {'tree': [...], 'paths': [...], 'nodes': [...], 'trie': PathTrie}
+    """
+    root = []
+    nodes = []
+    paths = []
+    trie = PathTrie()
+    stack = [(root, -1, None, trie.root)]
+    indents = [0]
+    match_keyword = _keyword_pattern(control_elements.get_control_elements()).match
+    pending = None
+    last_row = 0
+    line_node = None
+    block_owner = None
+    line_trie = block_trie = None
+    row = 1
+    depth = 0  # 括弧のネスト
+    in_line = False  # 論理行の途中か（NEWLINEを待っているか）
+    length = len(code)
+
+    def statement(pos, line_start):
+        # 文の先頭の単語が制御キーワードならノードを作る
+        nonlocal pending, line_node, line_trie
+        m = match_keyword(code, pos)
+        if m is None:
+            return
+        keyword = m.group(2)
+        parent = stack[-1][2]
+        node = {
+            'type': keyword,
+            'children': [],
+            'depth': len(stack) - 1,
+            'path': keyword if parent is None else f"{parent['path']}/{keyword}",
+            'line': row,
+            'end_line': row,
+        }
+        stack[-1][0].append(node)
+        nodes.append(node)
+        paths.append(node['path'])
+        trie_node = stack[-1][3].child(keyword)
+        trie_node.count += 1
+        trie_node.lines.append(row)
+        pending = node
+        if line_start and m.group(1) is None:
+            line_node, line_trie = node, trie_node
+
+    def newline():
+        # 論理行の終わり（tokenizeのNEWLINE）
+        nonlocal pending, last_row, block_owner, block_trie, line_node, in_line
+        last_row = row
+        if pending is not None:
+            pending['end_line'] = last_row
+            pending = None
+        block_owner, block_trie = line_node, line_trie
+        line_node = None
+        in_line = False
+
+    def line_start(pos):
+        # 物理行の先頭で、論理行が始まるならインデントを処理して文の先頭を調べる
+        # Returns: 次に走査する位置
+        nonlocal block_owner, in_line, row
+        while pos < length:
+            m = _LINE_START_PATTERN.match(code, pos)
+            if m.group(3) is not None:
+                # 空行・コメントだけの行
+                pos = m.end()
+                row += 1
+                continue
+            if m.end() == length:
+                # 改行のない最後の行が空白・コメントだけ
+                return length
+            column = _indent_width(m.group(1))
+            if column > indents[-1]:
+                indents.append(column)
+                if block_owner is not None:
+                    stack.append((block_owner['children'], column, block_owner, block_trie))
+                else:
+                    stack.append((stack[-1][0], column, stack[-1][2], stack[-1][3]))
+                block_owner = None
+            elif column < indents[-1]:
+                while column < indents[-1]:
+                    indents.pop()
+                    if len(stack) > 1:
+                        owner = stack.pop()[2]
+                        if owner is not None:
+                            owner['end_line'] = last_row
+                if column != indents[-1]:
+                    raise IndentationError("unindent does not match any outer indentation level",
+                                           ("<scan>", row, column, code[pos:code.find("\n", pos)]))
+            in_line = True
+            statement(m.end(), True)
+            return m.end()
+        return pos
+
+    kind = None
+    try:
+        pos = line_start(0)
+        while pos < length:
+            m = _TOKEN_PATTERN.search(code, pos)
+            if m is None:
+                break
+            kind = m.lastgroup
+            pos = m.end()
+            if kind == "nl":
+                if depth == 0:
+                    if in_line:
+                        newline()
+                    row += 1
+                    pos = line_start(pos)
+                else:
+                    row += 1
+            elif kind == "str":
+                row += m.group().count("\n")
+            elif kind == "open":
+                depth += 1
+            elif kind == "close":
+                depth = max(0, depth - 1)
+            elif kind == "sep":
+                if depth == 0:
+                    statement(pos, False)
+            elif kind == "cont":
+                row += 1
+            elif kind == "bad":
+                raise tokenize.TokenError("EOF in multi-line string" if len(m.group()) == 3 else "unterminated string literal",
+                                          (row, 0))
+        if depth > 0 or (kind == "cont" and not code[pos:].strip()):
+            raise tokenize.TokenError("EOF in multi-line statement", (row, 0))
+        if in_line:
+            newline()
+        # ファイルの終わりで残りのブロックをすべて抜ける
+        while len(stack) > 1:
+            owner = stack.pop()[2]
+            if owner is not None:
+                owner['end_line'] = last_row
+    except (tokenize.TokenError, IndentationError):
+        if not partial:
+            raise
+    return {'tree': root, 'paths': paths, 'nodes': nodes, 'trie': trie}
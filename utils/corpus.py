@@ -0,0 +1,182 @@
+"""
+コーパス（学習順に並んだプログラム群）の一括解析モジュール
+- ディレクトリ・globパターン・ファイルを受け取り、解析対象のファイル列に展開する
+- 各ファイルの解析（パス集合の計算）はファイルごとに独立しているので、プロセスプールでまとめて処理する
+- 結果はファイル順にストリーミングで受け取り、順序が必要なギャップの畳み込み（learned |= elements）だけを逐次行う
+- 読み込み・解析できないファイル（文字コード・未完の構文など）は、ワーカー内で捕まえて飛ばす（errorsに記録する）
+"""
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from utils import analysis_engine
+from utils.analysis_index import analyze_file
+from utils.control_elements import path_priority_key
+from utils.path_trie import PathTrie
+
+DEFAULT_CORPUS = ["sample/*.py"]
+
+
+def resolve_corpus(specs=None):
+    """
+    ディレクトリ・globパターン・ファイルのリストを解析対象のファイル列に展開する
+    - ディレクトリ: 配下の*.pyを再帰的に（パス順）
+    - globパターン: 一致したファイル（パス順）
+    指定順に連結し、重複は最初の位置だけ残す
+    """
+    filepaths = []
+    for spec in specs or DEFAULT_CORPUS:
+        if os.path.isdir(spec):
+            matches = sorted(glob.glob(os.path.join(spec, "**", "*.py"), recursive=True))
+        elif glob.has_magic(spec):
+            matches = sorted(glob.glob(spec, recursive=True))
+        else:
+            matches = [spec]
+        filepaths.extend(m for m in matches if os.path.isfile(m))
+    return list(dict.fromkeys(filepaths))
+
+
+def analyze_file_or_error(path):
+    """
+    analyze_fileと同じ（プロセスプールのワーカーから呼ぶ）。読み込み・解析できなければ例外を送出せずエラーの説明を返す
+    Returns: (内容のsha256, 解析結果, mtime(ns), サイズ) または str
+    """
+    try:
+        return analyze_file(path)
+    except analysis_engine.PARTIAL_ERRORS + (OSError, ValueError) as e:
+        return f"{type(e).__name__}: {e}"
+
+
+def iter_path_sets(filepaths, jobs=1, chunksize=None, index=None, errors=None):
+    """
+    ファイルごとの制御構文パスの集合を、ファイル順に (path, set) で順次返す
+    jobs: 解析に使うプロセス数（1なら呼び出し元プロセスで解析）
+    chunksize: 1回にワーカーへ渡すファイル数（Noneなら自動）
+    index: AnalysisIndex（変更のないファイルは解析せず、解析したファイルは登録する）
+    errors: リスト（読み込み・解析できずに飛ばしたファイルを (path, エラーの説明) で追加する）
+    """
+    for path, result in iter_results(filepaths, jobs=jobs, chunksize=chunksize, index=index, errors=errors):
+        yield path, set(result["paths"])
+
+
+def iter_path_tries(filepaths, jobs=1, chunksize=None, index=None, errors=None):
+    """ファイルごとのパスのトライ（出現回数・出現行付き）を、ファイル順に (path, PathTrie) で順次返す"""
+    for path, result in iter_results(filepaths, jobs=jobs, chunksize=chunksize, index=index, errors=errors):
+        yield path, PathTrie.from_tree(result["tree"])
+
+
+def iter_results(filepaths, jobs=1, chunksize=None, index=None, errors=None):
+    """
+    ファイルごとの解析結果 {'tree', 'paths'} を、ファイル順に (path, result) で順次返す（引数はiter_path_sets参照）
+    読み込み・解析できないファイルは返さずに飛ばす
+    """
+    # 変更のないファイルはインデックスから取り出し、残りだけを解析する
+    cached = {}
+    pending = []
+    for path in filepaths:
+        result = index.lookup(path) if index is not None else None
+        if result is not None:
+            cached[path] = result
+        else:
+            pending.append(path)
+    if jobs <= 1 or len(pending) <= 1:
+        analyzed = map(analyze_file_or_error, pending)
+        executor = None
+    else:
+        if chunksize is None:
+            chunksize = max(1, len(pending) // (jobs * 4))
+        # ワーカーでも呼び出し元と同じ解析バックエンドを使う（spawnで起動する環境ではグローバルな設定が引き継がれない）
+        executor = ProcessPoolExecutor(max_workers=jobs, initializer=analysis_engine.set_backend,
+                                       initargs=(analysis_engine.get_backend(),))
+        # mapは投入順に結果を返すので、先頭から順に届いた分だけ畳み込める
+        analyzed = executor.map(analyze_file_or_error, pending, chunksize=chunksize)
+    try:
+        for path in filepaths:
+            if path in cached:
+                yield path, cached[path]
+                continue
+            analyzed_file = next(analyzed)
+            if isinstance(analyzed_file, str):
+                if errors is not None:
+                    errors.append((path, analyzed_file))
+                continue
+            digest, result, mtime, size = analyzed_file
+            if index is not None:
+                index.store(path, digest, result, mtime, size)
+            yield path, result
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def fold_gaps(path_sets):
+    """
+    (path, set) の列を学習順に畳み込み、ファイルごとのギャップ情報を順次返す
+    Returns: dict {'index', 'path', 'elements', 'new_elements', 'gap'} のイテレータ
+    """
+    learned = set()
+    for idx, (path, elements) in enumerate(path_sets):
+        new_elements = elements - learned
+        yield {
+            'index': idx+1,
+            'path': path,
+            'elements': elements,
+            'new_elements': new_elements,
+            'gap': len(new_elements),
+        }
+        learned |= elements
+
+
+def detect_gaps(specs=None, jobs=1, chunksize=None, index=None, errors=None):
+    """コーパス全体のギャップ情報をファイル順に順次返す（resolve_corpus → iter_path_sets → fold_gaps）"""
+    filepaths = resolve_corpus(specs)
+    return fold_gaps(iter_path_sets(filepaths, jobs=jobs, chunksize=chunksize, index=index, errors=errors))
+
+
+def locate_gaps(specs=None, jobs=1, chunksize=None, index=None, corpus_trie=None, errors=None):
+    """
+    detect_gapsの情報に、新規要素がそのファイルで最初に現れる行を加えて順次返す（再解析せずトライから求める）
+    Returns: dict {'index', 'path', 'elements', 'new_elements', 'gap', 'locations'} のイテレータ
+      locations: [(新規要素, 行)]（優先順位順）
+    corpus_trie: PathTrie（指定すれば各ファイルのトライをファイル名付きでまとめる）
+    """
+    filepaths = resolve_corpus(specs)
+    tries = {}
+
+    def path_sets():
+        for path, trie in iter_path_tries(filepaths, jobs=jobs, chunksize=chunksize, index=index, errors=errors):
+            tries[path] = trie
+            yield path, trie.paths()
+
+    for info in fold_gaps(path_sets()):
+        trie = tries.pop(info['path'])
+        info['locations'] = [(p, trie.first_line(p)) for p in sorted(info['new_elements'], key=path_priority_key)]
+        if corpus_trie is not None:
+            corpus_trie.merge(trie, source=info['path'])
+        yield info
+
+
+def detect_gaps_bitset(specs=None, jobs=1, chunksize=None, index=None, errors=None):
+    """detect_gapsと同じ情報を順次返す（ギャップの計算はパスIDのビット集合の累積OR・popcountで行う）"""
+    return fold_gaps_bitset(iter_path_sets(resolve_corpus(specs), jobs=jobs, chunksize=chunksize, index=index, errors=errors))
+
+
+def fold_gaps_bitset(path_sets):
+    """
+    fold_gapsと同じ情報を順次返す（パス集合をPathInternerでビット集合にし、learnedとの差・popcountをintのビット演算で求める）
+    Returns: dict {'index', 'path', 'elements', 'new_elements', 'gap'} のイテレータ
+    """
+    from utils.path_bitset import PathInterner
+    interner = PathInterner()
+    learned = 0
+    for idx, (path, elements) in enumerate(path_sets):
+        mask = interner.mask(elements)
+        new_mask = mask & ~learned
+        yield {
+            'index': idx+1,
+            'path': path,
+            'elements': elements,
+            'new_elements': set(interner.paths(new_mask)),
+            'gap': new_mask.bit_count(),
+        }
+        learned |= mask
@@ -0,0 +1,140 @@
+"""
+degapのジョブ計画・並列実行モジュール
+- ギャップ解析の結果から、生成すべき中間プログラム（ジョブ）を事前にすべて計画する
+- 各ジョブの入力（学習要素・allowed_elements）は解析時点で確定するため、生成は並列に実行できる
+- サンプルkのジョブは「kより前の学習済み集合」と「kのパス集合」だけで決まるので、
+  IncrementalPlannerはこの2つが変わっていないサンプルの計画を再計算せずに使い回す（--watch用）
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import analysis_engine
+from utils.control_elements import CONTROL_ELEMENTS, path_priority_key
+
+
+def analyze_file_paths(path):
+    """ファイルを解析し、制御構文パスの集合を返す"""
+    return set(analysis_engine.analyze_file(path)['paths'])
+
+
+def plan_sample_jobs(path, elements, learned):
+    """
+    サンプル1つ分のギャップ情報とジョブ（job_indexなし）を計画する
+    elements: サンプルのパス集合 / learned: それより前のサンプルで学習済みのパス集合
+    Returns: (gap_info, jobs)
+    """
+    new_elements = elements - learned
+    gap_info = {
+        'path': path,
+        'gap': len(new_elements),
+        'new_elements': list(new_elements)
+    }
+    jobs = []
+    # ギャップ（新規要素数）が2以上なら、1つずつになるように中間プログラムを計画
+    if len(new_elements) >= 2:
+        current_learned = set(learned)
+        prioritized_elements = sorted(new_elements, key=path_priority_key)
+        base = os.path.splitext(os.path.basename(path))[0]
+        # 最後の新規要素はサンプル自身が担うので生成しない
+        for i, elem in enumerate(prioritized_elements[:-1]):
+            learning_elements = [elem]
+            # 順序を固定する（プロンプト・キャッシュキーが実行ごとに変わらないように）
+            allowed_elements = sorted(current_learned, key=lambda p: (path_priority_key(p), p))
+            forbidden_elements = [e for e in CONTROL_ELEMENTS if e not in learning_elements and e not in allowed_elements]
+            jobs.append({
+                'insert_before': path,
+                'gap': len(new_elements),
+                'base': base,
+                'prev_index': i+1,
+                'learning_element': elem,
+                'learning_elements': learning_elements,
+                'allowed_elements': allowed_elements,
+                'forbidden_elements': forbidden_elements,
+            })
+            current_learned.add(elem)
+    return gap_info, jobs
+
+
+class IncrementalPlanner:
+    def __init__(self, analyze=analyze_file_paths):
+        """
+        Args:
+            analyze: ファイルのパス集合を返す関数
+        """
+        self.analyze = analyze
+        self._elements = {}  # ファイル → パス集合
+        self._plans = {}  # ファイル → ((学習済み集合, パス集合), gap_info, jobs)
+        self.replanned = []  # 直前のplanで計画し直したファイル
+
+    def invalidate(self, paths):
+        """変更されたファイル（次のplanで解析し直す）"""
+        for path in paths:
+            self._elements.pop(path, None)
+
+    def plan(self, filepaths):
+        """
+        学習順のファイルリストからdegapのジョブを計画する
+        学習済み集合・パス集合が前回と同じサンプルは前回の計画を使う
+        Returns: (gap_results, jobs)  plan_degap_jobs参照
+        """
+        learned = set()
+        gap_results = []
+        jobs = []
+        self.replanned = []
+        for idx, path in enumerate(filepaths):
+            elements = self._elements.get(path)
+            if elements is None:
+                elements = self._elements[path] = self.analyze(path)
+            key = (frozenset(learned), frozenset(elements))
+            cached = self._plans.get(path)
+            if cached is None or cached[0] != key:
+                cached = self._plans[path] = (key, *plan_sample_jobs(path, elements, learned))
+                self.replanned.append(path)
+            _, gap_info, sample_jobs = cached
+            gap_results.append({'index': idx+1, **gap_info})
+            for job in sample_jobs:
+                jobs.append({'job_index': len(jobs), **job})
+            learned |= elements
+        for path in set(self._plans) - set(filepaths):
+            del self._plans[path]
+            self._elements.pop(path, None)
+        return gap_results, jobs
+
+
+def plan_degap_jobs(filepaths, analyze=analyze_file_paths):
+    """
+    学習順のファイルリストからdegapのジョブを計画する
+    Returns: (gap_results, jobs)
+      gap_results: 各サンプルのギャップ情報（dictのリスト）
+      jobs: 中間プログラム生成ジョブ（dictのリスト、元の出力順）
+    """
+    return IncrementalPlanner(analyze).plan(filepaths)
+
+
+def snapshot(filepaths):
+    """ファイルごとの (mtime, サイズ)（変更の検出用。消えたファイルは含めない）"""
+    result = {}
+    for path in filepaths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        result[path] = (st.st_mtime_ns, st.st_size)
+    return result
+
+
+def changed_files(before, after):
+    """2つのsnapshotの間で追加・変更・削除されたファイル"""
+    return sorted(p for p in set(before) | set(after) if before.get(p) != after.get(p))
+
+
+def run_jobs(jobs, worker, max_workers=1):
+    """
+    ジョブをワーカー数max_workersのプールで実行し、結果をジョブ順のリストで返す
+    max_workers <= 1 の場合は呼び出し元スレッドで順番に実行する
+    """
+    if max_workers <= 1 or len(jobs) <= 1:
+        return [worker(job) for job in jobs]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(worker, job) for job in jobs]
+        return [future.result() for future in futures]
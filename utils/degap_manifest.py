@@ -0,0 +1,154 @@
+"""
+degapのチェックポイント（マニフェスト）モジュール
+- 計画したジョブごとに、入力（学習要素・allowed_elements・forbidden_elements・モデル）・状態・出力をresult/manifest.jsonに記録する
+  （中間プログラムはサンプルの本文には依存しないので、挿入先サンプルのハッシュは入力に含めず参考として記録する）
+- ジョブが終わるたびに一時ファイル経由で書き換えるので、途中で中断しても完了したジョブの記録は残る
+- --resume・--watchでは、入力が変わっておらず出力が残っていて条件を満たすジョブを生成し直さない
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from utils.file_utils import atomic_write_json
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 2
+
+
+def file_sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def job_inputs(job, models, runtime_check=False):
+    """
+    ジョブの出力を決める入力（これが変わったジョブは生成し直す）
+    runtime_check: 実行検査をしたか（実行検査なしで保存した出力を、実行検査ありの再開で再利用しないように）
+    """
+    inputs = {
+        "insert_before": job["insert_before"],
+        "learning_elements": list(job["learning_elements"]),
+        "allowed_elements": list(job["allowed_elements"]),
+        "forbidden_elements": list(job["forbidden_elements"]),
+        "models": list(models),
+    }
+    if runtime_check:
+        # 実行検査なしの記録のキーは変えない（既存のマニフェストをそのまま再開できるように）
+        inputs["runtime_check"] = True
+    return inputs
+
+
+def inputs_key(inputs):
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def output_name(job):
+    """ジョブの出力ファイル名（例: 05_prev2.py）"""
+    return f"{job['base']}_prev{job['prev_index']}.py"
+
+
+class DegapManifest:
+    def __init__(self, result_dir="result"):
+        """
+        Args:
+            result_dir (str): 中間プログラムの保存先（マニフェストもここに置く）
+        """
+        self.result_dir = result_dir
+        self.path = os.path.join(result_dir, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self.jobs = self._load()  # 出力ファイル名 → エントリ
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        # 形式の違う（バージョンが異なる）マニフェストは使わず、最初から記録し直す
+        if not isinstance(data, dict) or data.get("version") != MANIFEST_VERSION:
+            return {}
+        return data.get("jobs", {})
+
+    def _save(self):
+        os.makedirs(self.result_dir, exist_ok=True)
+        atomic_write_json(self.path, {"version": MANIFEST_VERSION, "updated": time.time(), "jobs": self.jobs})
+
+    def satisfied(self, job, inputs, validate=None):
+        """
+        ジョブが完了済みで、入力が同じで、出力ファイルが記録どおり残っていればそのエントリを返す（なければNone）
+        validate: 出力のコードを受け取り合格ならTrueを返す関数（指定すれば出力を再判定する）
+        """
+        entry = self.jobs.get(output_name(job))
+        if entry is None or entry.get("status") != "ok" or entry.get("inputs_key") != inputs_key(inputs):
+            return None
+        code = self._read_output(output_name(job), entry)
+        if code is None:
+            return None
+        if validate is not None and not validate(code):
+            return None
+        return entry
+
+    def _read_output(self, name, entry):
+        """出力ファイルの内容（なくなっている・記録と内容が違う場合はNone）"""
+        try:
+            with open(os.path.join(self.result_dir, name), "r", encoding="utf-8") as f:
+                code = f.read()
+        except OSError:
+            return None
+        if hashlib.sha256(code.encode("utf-8")).hexdigest() != entry.get("output_hash"):
+            return None
+        return code
+
+    def passed_outputs(self):
+        """合格と記録されていて、出力ファイルが記録どおり残っているジョブの [(出力ファイルのパス, コード, エントリ)]"""
+        with self._lock:
+            entries = sorted(self.jobs.items())
+        result = []
+        for name, entry in entries:
+            if entry.get("status") != "ok":
+                continue
+            code = self._read_output(name, entry)
+            if code is not None:
+                result.append((os.path.join(self.result_dir, name), code, entry))
+        return result
+
+    def plan(self, planned):
+        """
+        今回計画したジョブ [(job, inputs)] を記録する（完了済みで入力が同じエントリは残し、それ以外はpendingにする）
+        計画にない出力のエントリは削除する
+        """
+        with self._lock:
+            jobs = {}
+            for job, inputs in planned:
+                name = output_name(job)
+                key = inputs_key(inputs)
+                entry = self.jobs.get(name)
+                if entry is None or entry.get("inputs_key") != key or entry.get("status") != "ok":
+                    entry = {"status": "pending", "inputs": inputs, "inputs_key": key}
+                jobs[name] = entry
+            self.jobs = jobs
+            self._save()
+
+    def record(self, job, inputs, status, code=None, paths=None, source=None, model=None, sample_hash=None):
+        """ジョブの結果を記録して書き出す（status: "ok" / "failed"）"""
+        with self._lock:
+            self.jobs[output_name(job)] = {
+                "status": status,
+                "inputs": inputs,
+                "inputs_key": inputs_key(inputs),
+                "sample_hash": sample_hash,
+                "output": output_name(job),
+                "output_hash": hashlib.sha256(code.encode("utf-8")).hexdigest() if code else None,
+                "paths": sorted(paths) if paths else [],
+                "source": source,
+                "model": model,
+                "finished": time.time(),
+            }
+            self._save()
+
+    def outputs(self):
+        """記録されている出力ファイル名の集合"""
+        with self._lock:
+            return set(self.jobs)
@@ -0,0 +1,445 @@
+"""
+ローカルHTTPサービス（複数の利用者・CIが1台のOllamaを共有するための常駐サーバ）
+- 解析（/api/analyze）・ギャップ検出（/api/detect）・コード生成（/api/generate）をHTTPのJSON APIとして提供する
+- 生成は上限付きの待ち行列に入れ、クライアント（X-Client-Id）ごとの行列から順番に取り出す（1人が大量に投入しても他の人が待たされない）
+- 同じ条件（学習要素・allowed・forbidden・モデル・合否の判定に関わる指定）の生成が実行中・待機中なら、
+  新しく投入せず同じ結果を待つ（single-flight）
+- CLIは--server URL（または環境変数DEGAP_SERVER）を指定すると、このサービスのクライアントとして動く
+
+起動例: python main.py --serve --port 8765 --workers 2 --queue-size 64
+"""
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_SIZE = 64
+# 待ち行列が一杯のときにクライアントが再試行するまでの秒数
+RETRY_AFTER = 2
+
+
+class QueueFull(Exception):
+    """生成の待ち行列が上限に達している"""
+
+
+class ServiceError(Exception):
+    """サービスの呼び出しに失敗した（接続できない・エラー応答など）"""
+
+
+# 生成リクエストの省略時の値（キーと生成で同じ値を使う）
+DEFAULT_MAX_RETRY = 8
+
+
+def request_key(request, models):
+    """
+    同じ結果を共有できる生成リクエストのキー
+    要素条件とモデルに加え、候補の採否・生成のしかたを変える指定（実行検査・chat・生成回数・再試行方針・昇格の回数）を含める
+    （実行検査なしの生成結果を、実行検査を求めたリクエストに返さないように）
+    """
+    data = {
+        "learning_elements": list(request["learning_elements"]),
+        "allowed_elements": sorted(request.get("allowed_elements", [])),
+        "forbidden_elements": sorted(request.get("forbidden_elements") or []),
+        "models": list(models),
+        "runtime_check": bool(request.get("runtime_check")),
+        "chat": bool(request.get("chat")),
+        "max_retry": request.get("max_retry", DEFAULT_MAX_RETRY),
+        "adaptive_retry": bool(request.get("adaptive_retry", True)),
+        "escalate_after": request.get("escalate_after"),
+    }
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class FairQueue:
+    """クライアントごとの行列から1件ずつ順番に（ラウンドロビンで）取り出す、上限付きの待ち行列"""
+
+    def __init__(self, maxsize=DEFAULT_QUEUE_SIZE):
+        self.maxsize = maxsize
+        self._queues = {}  # クライアント → deque
+        self._order = deque()  # 待ちのあるクライアント（次に取り出す順）
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        with self._cond:
+            return self._size
+
+    def put(self, client, item):
+        """itemを追加する（上限に達していればQueueFull）"""
+        with self._cond:
+            if self._size >= self.maxsize:
+                raise QueueFull(f"queue is full ({self.maxsize})")
+            if client not in self._queues:
+                self._queues[client] = deque()
+                self._order.append(client)
+            self._queues[client].append(item)
+            self._size += 1
+            self._cond.notify()
+
+    def get(self):
+        """次のitemを取り出す（空なら待つ。closeされたらNone）"""
+        with self._cond:
+            while not self._size and not self._closed:
+                self._cond.wait()
+            if not self._size:
+                return None
+            client = self._order.popleft()
+            queue = self._queues[client]
+            item = queue.popleft()
+            if queue:
+                self._order.append(client)
+            else:
+                del self._queues[client]
+            self._size -= 1
+            return item
+
+    def pending(self):
+        """クライアントごとの待ち件数"""
+        with self._cond:
+            return {client: len(queue) for client, queue in self._queues.items()}
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class _Flight:
+    """実行中・待機中の生成1件（同じキーのリクエストはこの結果を待つ）"""
+
+    def __init__(self, key, request):
+        self.key = key
+        self.request = request
+        self.done = threading.Event()
+        self.result = None
+        self.waiters = 1
+
+
+class DegapService:
+    def __init__(self, client, cache=None, sandbox=None, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE, log=print,
+                 retry_policy=None):
+        """
+        Args:
+            client: AIクライアント（全リクエストで共有する。例: OllamaClient）
+            cache: GenerationCache（利用者をまたいで合格したコードを再利用する。Noneなら使わない）
+            sandbox: SandboxPool（runtime_checkを指定したリクエストの実行検査に使う。Noneなら最初のruntime_checkのリクエストで起動する）
+            workers: 同時に実行する生成の数
+            queue_size: 待ち行列の上限（超えたリクエストは503で断る）
+            retry_policy: RetryPolicy（adaptive_retryを指定したリクエストの生成回数・温度を決める。利用者をまたいで記録を共有する）
+        """
+        self.client = client
+        self.retry_policy = retry_policy
+        self.cache = cache
+        self.sandbox = sandbox
+        self._own_sandbox = False  # このサービスで起動したサンドボックスか（closeで止める）
+        self.workers = max(1, workers)
+        self.log = log
+        self.queue = FairQueue(queue_size)
+        self._lock = threading.Lock()
+        self._inflight = {}  # キー → _Flight
+        self._cascades = {}  # モデルの組 → ModelCascade
+        self.counts = {"requests": 0, "coalesced": 0, "generated": 0, "rejected": 0, "errors": 0}
+        self.clients = {}  # クライアント → {"requests", "coalesced"}
+        self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(max(1, workers))]
+        for worker in self._workers:
+            worker.start()
+
+    def _cascade(self, models, escalate_after):
+        from utils.model_cascade import ModelCascade
+        with self._lock:
+            cascade = self._cascades.get((models, escalate_after))
+            if cascade is None:
+                cascade = self._cascades[(models, escalate_after)] = ModelCascade(list(models), escalate_after=escalate_after)
+            return cascade
+
+    def generate(self, request, client_id="anonymous"):
+        """
+        生成リクエストを処理し、結果を返す（同じキーのリクエストが実行中・待機中ならその結果を待つ）
+        request: {'learning_elements', 'allowed_elements', 'forbidden_elements', 'models', 'escalate_after', 'max_retry',
+                  'speculative', 'validate_stream', 'chat', 'runtime_check', 'adaptive_retry'}
+        Returns: dict {'code', 'ok', 'info', 'attempts', 'model', 'log', 'coalesced'}
+        """
+        from utils.model_cascade import DEFAULT_DEGAP_MODELS
+        models = tuple(request.get("models") or DEFAULT_DEGAP_MODELS)
+        key = request_key(request, models)
+        with self._lock:
+            stats = self.clients.setdefault(client_id, {"requests": 0, "coalesced": 0})
+            stats["requests"] += 1
+            self.counts["requests"] += 1
+            flight = self._inflight.get(key)
+            coalesced = flight is not None
+            if coalesced:
+                flight.waiters += 1
+                stats["coalesced"] += 1
+                self.counts["coalesced"] += 1
+            else:
+                flight = _Flight(key, {**request, "models": models})
+                try:
+                    self.queue.put(client_id, flight)
+                except QueueFull:
+                    self.counts["rejected"] += 1
+                    raise
+                self._inflight[key] = flight
+        flight.done.wait()
+        return {**flight.result, "coalesced": coalesced}
+
+    def _work(self):
+        while True:
+            flight = self.queue.get()
+            if flight is None:
+                return
+            try:
+                result = self._run(flight.request)
+            except Exception as e:  # 1件の失敗で他のリクエストを止めない
+                with self._lock:
+                    self.counts["errors"] += 1
+                result = {"code": None, "ok": False, "info": {}, "attempts": 0, "model": None,
+                          "log": [f"[SERVICE] 生成中にエラーが発生しました: {type(e).__name__}: {e}"]}
+            with self._lock:
+                del self._inflight[flight.key]
+                self.counts["generated"] += 1
+            flight.result = result
+            flight.done.set()
+            if flight.waiters > 1:
+                self.log(f"[SERVICE] {flight.request['learning_elements']} の生成結果を {flight.waiters} 件のリクエストで共有しました。")
+
+    def _run(self, request):
+        lines = []
+        from utils.model_cascade import DEFAULT_ESCALATE_AFTER
+        cascade = self._cascade(request["models"], request.get("escalate_after") or DEFAULT_ESCALATE_AFTER)
+        code, ok, info, attempts, model = cascade.generate(
+            self.client, request["learning_elements"], request.get("allowed_elements", []), request.get("forbidden_elements"),
+            max_retry=request.get("max_retry", DEFAULT_MAX_RETRY), speculative=request.get("speculative", 1), log=lambda msg: lines.append(str(msg)),
+            cache=self.cache, validate_stream=request.get("validate_stream", False), chat=request.get("chat", False),
+            sandbox=self._runtime_sandbox() if request.get("runtime_check") else None,
+            retry_policy=self.retry_policy if request.get("adaptive_retry", True) else None)
+        cascade.save()
+        if self.retry_policy is not None:
+            self.retry_policy.save()
+        return {"code": code, "ok": ok, "info": info, "attempts": attempts, "model": model, "log": lines}
+
+    def stats(self):
+        with self._lock:
+            stats = {**self.counts, "queued": len(self.queue), "inflight": len(self._inflight),
+                     "pending_by_client": self.queue.pending(), "clients": {c: dict(s) for c, s in self.clients.items()}}
+        if hasattr(self.client, "stats"):
+            # 複数のOllamaホストに分散している場合のホストごとの状態
+            stats["hosts"] = self.client.stats()
+        return stats
+
+    def _runtime_sandbox(self):
+        """実行検査用のサンドボックス（--runtime-checkなしで起動した場合は、最初に必要になったときに起動する）"""
+        with self._lock:
+            if self.sandbox is None:
+                from utils.sandbox import SandboxPool
+                self.sandbox = SandboxPool(size=self.workers)
+                self._own_sandbox = True
+            return self.sandbox
+
+    def close(self):
+        self.queue.close()
+        for worker in self._workers:
+            worker.join(timeout=1)
+        if self._own_sandbox:
+            self.sandbox.close()
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    service = None  # DegapService（serveでサブクラスに設定する）
+    index = None  # AnalysisIndex（ギャップ検出で共有する）
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, data, headers=None):
+        body = json.dumps(data, ensure_ascii=False, default=list).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/api/stats":
+            self._send_json(200, self.service.stats())
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        from utils import analysis_engine
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": "invalid json"})
+            return
+        client_id = self.headers.get("X-Client-Id") or self.client_address[0]
+        try:
+            if self.path == "/api/analyze":
+                self._send_json(200, analyze(request["code"]))
+            elif self.path == "/api/detect":
+                errors = []
+                gaps = detect(request["paths"], jobs=request.get("jobs", 1), index=self.index, errors=errors)
+                self._send_json(200, {"gaps": gaps, "errors": errors})
+            elif self.path == "/api/generate":
+                self._send_json(200, self.service.generate(request, client_id=client_id))
+            else:
+                self._send_json(404, {"error": "not found"})
+        except QueueFull as e:
+            self._send_json(503, {"error": str(e)}, headers={"Retry-After": str(RETRY_AFTER)})
+        except (KeyError, TypeError) as e:
+            self._send_json(400, {"error": f"invalid request: {e}"})
+        except analysis_engine.PARTIAL_ERRORS + (OSError, ValueError) as e:
+            # 解析できないコード・ファイル（未完の括弧・文字コードなど）
+            self._send_json(422, {"error": f"{type(e).__name__}: {e}"})
+
+
+def analyze(code):
+    """コードの制御構造ツリー・パス"""
+    from utils import analysis_engine
+    result = analysis_engine.analyze(code)
+    return {"tree": result["tree"], "paths": result["paths"]}
+
+
+def detect(paths, jobs=1, index=None, errors=None):
+    """ファイル列（学習順）のギャップ情報のリスト（errors: 読み込み・解析できずに飛ばしたファイルを (path, 説明) で追加する）"""
+    from utils import corpus
+    results = corpus.fold_gaps_bitset(corpus.iter_path_sets(paths, jobs=jobs, index=index, errors=errors))
+    gaps = [{**info, "new_elements": sorted(info["new_elements"]), "elements": sorted(info["elements"])} for info in results]
+    if index is not None:
+        index.save()
+    return gaps
+
+
+class ServiceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE,
+          cache_dir=None, stream=False, runtime_check=False, log=print, fast=False):
+    """サービスを起動し、Ctrl-Cで終了するまで待ち受ける（fast: 思考なし・JSONスキーマの高速モードで生成する）"""
+    from utils import ai_api, ai_generator
+    from utils.analysis_index import AnalysisIndex
+    from utils.retry_policy import RetryPolicy
+    cache = None
+    if cache_dir is not None:
+        from utils.generation_cache import GenerationCache
+        cache = GenerationCache(cache_dir)
+    sandbox = None
+    if runtime_check:
+        from utils.sandbox import SandboxPool
+        sandbox = SandboxPool(size=workers)
+    client = ai_api.get_ai_client("ollama", pool_maxsize=workers * 4, stream=stream, stop_when=ai_generator.has_complete_code_block,
+                                  fast=fast)
+    service = DegapService(client, cache=cache, sandbox=sandbox, workers=workers, queue_size=queue_size, log=log,
+                           retry_policy=RetryPolicy())
+    handler = type("Handler", (ServiceHandler,), {"service": service, "index": AnalysisIndex()})
+    server = ServiceServer((host, port), handler)
+    log(f"[SERVICE] http://{host}:{server.server_address[1]} で待ち受けます（生成の同時実行数: {workers}, 待ち行列の上限: {queue_size}）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log("\n[SERVICE] 終了します。")
+    finally:
+        server.server_close()
+        service.close()
+        client.close()
+        if sandbox is not None:
+            sandbox.close()
+        if cache is not None:
+            cache.evict()
+        log(f"[SERVICE] {service.stats()}")
+
+
+class ServiceClient:
+    def __init__(self, base_url, client_id=None, timeout=None, retries=30):
+        """
+        Args:
+            base_url (str): サービスのURL（例: http://127.0.0.1:8765）
+            client_id (str): 公平性の単位になるクライアント名（省略時は ホスト名-プロセスID）
+            timeout (float): 1リクエストのタイムアウト（秒。生成は待ち行列を含むのでNoneなら無制限）
+            retries (int): 待ち行列が一杯（503）のときに再試行する回数
+        """
+        import requests
+        self.base_url = base_url.rstrip("/")
+        self.client_id = client_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.timeout = timeout
+        self.retries = retries
+        self.session = requests.Session()
+
+    def _post(self, endpoint, payload):
+        import requests
+        for _ in range(self.retries + 1):
+            try:
+                response = self.session.post(f"{self.base_url}{endpoint}", json=payload, timeout=self.timeout,
+                                             headers={"X-Client-Id": self.client_id})
+            except requests.RequestException as e:
+                raise ServiceError(f"サービス（{self.base_url}）に接続できません: {e}") from e
+            if response.status_code == 503:
+                time.sleep(float(response.headers.get("Retry-After", RETRY_AFTER)))
+                continue
+            if response.status_code != 200:
+                raise ServiceError(f"{endpoint}: {response.status_code} {response.text}")
+            return response.json()
+        raise ServiceError(f"{endpoint}: 待ち行列が一杯のため受け付けられませんでした")
+
+    def analyze(self, code):
+        return self._post("/api/analyze", {"code": code})
+
+    def detect(self, paths, jobs=1, errors=None):
+        """
+        ファイル列のギャップ情報（サービスと同じファイルシステム上のパスを絶対パスで送る）
+        errors: リスト（サービスが読み込み・解析できずに飛ばしたファイルを (path, 説明) で追加する）
+        """
+        original = {os.path.abspath(p): p for p in paths}
+        response = self._post("/api/detect", {"paths": list(original), "jobs": jobs})
+        for info in response["gaps"]:
+            info["path"] = original.get(info["path"], info["path"])
+        if errors is not None:
+            errors.extend((original.get(path, path), error) for path, error in response.get("errors", []))
+        return response["gaps"]
+
+    def generate(self, learning_elements, allowed_elements, forbidden_elements, models=None, escalate_after=None, max_retry=8,
+                 speculative=1, validate_stream=False, chat=False, runtime_check=False, adaptive_retry=True, log=print):
+        """
+        サービスで生成する（ModelCascade.generateと同じ戻り値）
+        Returns: (code, ok, info, attempts, model)
+        """
+        result = self._post("/api/generate", {
+            "learning_elements": list(learning_elements),
+            "allowed_elements": list(allowed_elements),
+            "forbidden_elements": list(forbidden_elements) if forbidden_elements is not None else None,
+            "models": list(models) if models else None,
+            "escalate_after": escalate_after,
+            "max_retry": max_retry,
+            "speculative": speculative,
+            "validate_stream": validate_stream,
+            "chat": chat,
+            "runtime_check": runtime_check,
+            "adaptive_retry": adaptive_retry,
+        })
+        for line in result.get("log", []):
+            log(line)
+        if result.get("coalesced"):
+            log("[SERVICE] 同じ条件の生成が実行中だったため、その結果を共有しました。")
+        return result["code"], result["ok"], result["info"], result["attempts"], result["model"]
+
+    def stats(self):
+        import requests
+        try:
+            return self.session.get(f"{self.base_url}/api/stats", timeout=self.timeout).json()
+        except (requests.RequestException, ValueError) as e:
+            raise ServiceError(f"サービス（{self.base_url}）の状態を取得できません: {e}") from e
+
+    def close(self):
+        self.session.close()
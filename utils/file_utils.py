@@ -0,0 +1,19 @@
+"""
+ファイル入出力の補助関数
+"""
+import json
+import os
+import threading
+
+
+def atomic_write_text(path, text):
+    """一時ファイルに書いてから置き換える（途中で中断しても壊れたファイルを残さない）"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def atomic_write_json(path, data):
+    """dataをJSONとしてatomic_write_textで書き込む"""
+    atomic_write_text(path, json.dumps(data, ensure_ascii=False))
@@ -1,19 +1,20 @@
-from utils import parser_tokenize
+from utils import analysis_engine
 
 
-def detect_multiple_new_elements(filepaths):
+def detect_multiple_new_elements(filepaths, index=None):
     """
     学習順に並んだプログラムファイルリストを受け取り、
     2つ以上新規学習要素（パス）が現れる箇所を返す
+    index: AnalysisIndex（指定すれば変更のないファイルは再解析しない）
     Returns: List of (index, filepath, [new_elements])
     """
     learned = set()
     flagged = []
     for idx, path in enumerate(filepaths):
-        with open(path, 'r', encoding='utf-8') as f:
-            code = f.read()
-        tree = parser_tokenize.parse_control_structure_tree(code)
-        elements = set(parser_tokenize.tree_to_paths(tree))
+        if index is not None:
+            elements = index.paths(path)
+        else:
+            elements = set(analysis_engine.analyze_file(path)['paths'])
         new_elements = elements - learned
         if len(new_elements) >= 2:
             flagged.append((idx, path, list(new_elements)))
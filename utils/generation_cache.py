@@ -0,0 +1,174 @@
+"""
+AI生成結果のディスクキャッシュ（内容アドレス方式）
+- キー: モデル名・プロンプト全文・生成オプションのハッシュ
+- 値: AIの出力、抽出したコード、check_code_elementsの判定結果
+- 判定に合格した候補はジョブ単位でも索引し、再実行時はAIを呼ばずに再利用する
+- エントリ数・合計サイズ・最終アクセスからの経過時間で古いものから削除する
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from utils.file_utils import atomic_write_json
+
+DEFAULT_CACHE_DIR = os.path.join(".degap_cache", "generations")
+
+
+class GenerationCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_entries=5000, max_bytes=200 * 1024 * 1024,
+                 max_age=30 * 24 * 3600, evict_interval=50):
+        """
+        Args:
+            cache_dir (str): キャッシュの保存先ディレクトリ
+            max_entries (int): 保持するエントリ数の上限
+            max_bytes (int): 保持する合計サイズ（バイト）の上限
+            max_age (float): 最終アクセスからこの秒数を過ぎたエントリは削除する
+            evict_interval (int): この回数putするごとに削除処理を行う
+        """
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.evict_interval = evict_interval
+        self._lock = threading.Lock()
+        self._puts_since_evict = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(model, prompt, options=None):
+        """モデル名・プロンプト・生成オプションからキャッシュキー（sha256）を作る"""
+        material = json.dumps({"model": model or "", "prompt": prompt, "options": options or {}},
+                              sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _read(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self.max_age is not None and time.time() - os.path.getmtime(path) > self.max_age:
+            return None
+        # 最終アクセス時刻としてmtimeを更新する（LRU削除に使う）
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def _write(self, key, entry):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write_json(path, entry)
+
+    def get(self, key):
+        """
+        再利用できる生成結果を返す（なければNone）
+        判定で不合格になったエントリは再利用せず、ミスとして扱う
+        """
+        entry = self._read(key)
+        usable = entry is not None and entry.get("kind") == "generation" \
+            and (entry.get("validation") is None or entry["validation"].get("ok"))
+        with self._lock:
+            if usable:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return entry if usable else None
+
+    def put(self, key, model, prompt, options, response, code):
+        """AIの出力と抽出コードを保存する"""
+        self._write(key, {
+            "kind": "generation",
+            "key": key,
+            "model": model,
+            "prompt": prompt,
+            "options": options or {},
+            "response": response,
+            "code": code,
+            "validation": None,
+            "created": time.time(),
+        })
+        with self._lock:
+            self.stores += 1
+            self._puts_since_evict += 1
+            run_evict = self._puts_since_evict >= self.evict_interval
+            if run_evict:
+                self._puts_since_evict = 0
+        if run_evict:
+            self.evict()
+
+    def record_validation(self, key, ok, info):
+        """check_code_elementsの判定結果をエントリに記録する"""
+        entry = self._read(key)
+        if entry is None:
+            return
+        entry["validation"] = {"ok": bool(ok), "info": info or {}}
+        self._write(key, entry)
+
+    def get_job(self, job_key):
+        """ジョブ（同じモデル・同じ要素条件）で以前に合格した生成結果を返す（なければNone）"""
+        entry = self._read(job_key)
+        if entry is None or entry.get("kind") != "job":
+            return None
+        return self.get(entry["good_key"])
+
+    def record_job(self, job_key, good_key):
+        """ジョブに対して合格した生成結果のキーを記録する"""
+        self._write(job_key, {"kind": "job", "good_key": good_key, "created": time.time()})
+
+    def evict(self):
+        """期限切れのエントリを削除し、上限を超えていれば最終アクセスの古い順に削除する"""
+        files = []
+        now = time.time()
+        for dirpath, _, filenames in os.walk(self.cache_dir):
+            for name in filenames:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+        files.sort()
+        removed = 0
+        total_bytes = sum(size for _, size, _ in files)
+        count = len(files)
+        for mtime, size, path in files:
+            expired = self.max_age is not None and now - mtime > self.max_age
+            over = count > self.max_entries or total_bytes > self.max_bytes
+            if not expired and not over:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            removed += 1
+            count -= 1
+            total_bytes -= size
+        with self._lock:
+            self.evictions += removed
+        return removed
+
+    def stats(self):
+        """ヒット・ミスなどの統計をdictで返す"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,146 @@
+"""
+モデルのカスケード（段階的な切り替え）モジュール
+- ジョブごとに小さい（速い）モデルから生成を始め、N回不合格になったら次の大きいモデルに切り替える
+- どのモデルで合格したかをパスの深さ（for/if/else なら3）ごとに記録し、
+  小さいモデルでほとんど合格しない深さのジョブは、次回から合格できるモデルで始める
+"""
+import json
+import os
+import threading
+from functools import partial
+
+from utils import ai_generator
+from utils.file_utils import atomic_write_json
+
+DEFAULT_TIERS_PATH = os.path.join(".degap_cache", "model_tiers.json")
+# degapで使うモデル（速い順）
+DEFAULT_DEGAP_MODELS = ["qwen3:14b", "qwen3:32b"]
+# 不合格がこの回数になったら次のモデルに切り替える
+DEFAULT_ESCALATE_AFTER = 2
+# 記録がこの件数以上あり、合格率がこの値未満のモデルはその深さでは使わない
+MIN_SAMPLES = 3
+SUCCESS_THRESHOLD = 0.5
+
+
+def path_depth(path):
+    """パスのネストの深さ（例: for/if/else → 3）"""
+    return path.count('/') + 1
+
+
+def parse_models(value, default):
+    """カンマ区切りのモデル名（例: qwen3:8b,qwen3:32b）をリストにする"""
+    if not value:
+        return list(default)
+    return [m.strip() for m in value.split(",") if m.strip()]
+
+
+class ModelCascade:
+    def __init__(self, models=None, escalate_after=DEFAULT_ESCALATE_AFTER, stats_path=DEFAULT_TIERS_PATH,
+                 min_samples=MIN_SAMPLES, threshold=SUCCESS_THRESHOLD):
+        """
+        Args:
+            models (list): 使うモデル名（速い順）
+            escalate_after (int): 1つのモデルで許す不合格回数（最後のモデルは残りの回数すべて）
+            stats_path (str): 深さ・モデルごとの記録の保存先（JSON）。Noneならメモリ上のみ
+            min_samples (int), threshold (float): 開始するモデルの選択に使う記録件数・合格率の下限
+        """
+        self.models = list(models or DEFAULT_DEGAP_MODELS)
+        self.escalate_after = max(1, escalate_after)
+        self.stats_path = stats_path
+        self.min_samples = min_samples
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._dirty = False
+        # 深さ（文字列） → モデル名 → {"jobs": そのモデルで試したジョブ数, "solved": 合格したジョブ数}
+        self._stats = self._load()
+
+    def _load(self):
+        if self.stats_path is None:
+            return {}
+        try:
+            with open(self.stats_path, "r", encoding="utf-8") as f:
+                return json.load(f).get("depths", {})
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        """変更があれば記録を書き出す"""
+        with self._lock:
+            if self.stats_path is None or not self._dirty:
+                return
+            os.makedirs(os.path.dirname(self.stats_path) or ".", exist_ok=True)
+            atomic_write_json(self.stats_path, {"depths": self._stats})
+            self._dirty = False
+
+    def record(self, depth, model, solved):
+        """深さdepthのジョブをmodelで試した結果を記録する"""
+        with self._lock:
+            entry = self._stats.setdefault(str(depth), {}).setdefault(model, {"jobs": 0, "solved": 0})
+            entry["jobs"] += 1
+            entry["solved"] += int(bool(solved))
+            self._dirty = True
+
+    def start_tier(self, learning_elements):
+        """
+        学習要素の深さから、生成を始めるモデルの添字を返す
+        記録が十分にあり合格率が低いモデルは飛ばす（記録がなければ最初のモデルから）
+        """
+        depth = str(max((path_depth(p) for p in learning_elements), default=1))
+        with self._lock:
+            by_model = self._stats.get(depth, {})
+            for i, model in enumerate(self.models[:-1]):
+                entry = by_model.get(model)
+                if entry and entry["jobs"] >= self.min_samples and entry["solved"] / entry["jobs"] < self.threshold:
+                    continue
+                return i
+        return len(self.models) - 1
+
+    def generate(self, client, learning_elements, allowed_elements, forbidden_elements, max_retry=8, log=print,
+                 cache=None, telemetry=None, chat=False, **kwargs):
+        """
+        モデルを順に切り替えながら条件を満たすコードを生成する（generate_valid_codeのカスケード版）
+        client: AIクライアント（generateがmodel引数で使うモデルを変えられるもの。例: OllamaClient）
+        chat: Trueならclient.chatで会話形式で生成する（モデルを切り替えたら会話は最初からやり直す）
+        **kwargs: generate_valid_codeに渡す追加パラメータ（speculative, validate_streamなど）
+        Returns: (code, ok, info, attempts, model)  modelは最後に使ったモデル
+        """
+        # どのモデルでも、以前に合格したコードがあればそれを使う
+        if cache is not None:
+            for model in self.models:
+                hit = ai_generator.lookup_job_cache(cache, model, learning_elements, allowed_elements, forbidden_elements, log=log,
+                                                    sandbox=kwargs.get("sandbox"))
+                if hit is not None:
+                    code, info = hit
+                    return code, True, info, 0, model
+        depth = max((path_depth(p) for p in learning_elements), default=1)
+        start = self.start_tier(learning_elements)
+        attempts = 0
+        code, ok, info, model = None, False, {}, self.models[start]
+        ai_func = client.chat if chat else client.generate
+        for tier in range(start, len(self.models)):
+            model = self.models[tier]
+            last = tier == len(self.models) - 1
+            budget = max_retry - attempts if last else min(self.escalate_after, max_retry - attempts)
+            if budget <= 0:
+                break
+            if tier > start:
+                log(f"[CASCADE] {self.models[tier-1]} で合格しなかったため {model} に切り替えます。")
+            else:
+                log(f"[CASCADE] {model} で生成します（深さ {depth}）。")
+            code, ok, info, used = ai_generator.generate_valid_code(
+                learning_elements, allowed_elements, forbidden_elements, ai_func=partial(ai_func, model=model),
+                max_retry=budget, log=log, cache=cache, model=model, chat=chat,
+                telemetry=telemetry.bind(model=model) if telemetry is not None else None, **kwargs)
+            attempts += used
+            self.record(depth, model, ok)
+            if ok:
+                break
+        return code, ok, info, attempts, model
+
+    def stats(self):
+        """深さ・モデルごとの記録（合格率付き）を返す"""
+        with self._lock:
+            return {
+                depth: {model: {**e, "rate": e["solved"] / e["jobs"] if e["jobs"] else None} for model, e in by_model.items()}
+                for depth, by_model in sorted(self._stats.items(), key=lambda kv: int(kv[0]))
+            }
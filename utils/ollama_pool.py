@@ -0,0 +1,183 @@
+"""
+複数のOllamaホストに負荷を分散するクライアント
+- ホストごとにOllamaClient（keep-alive接続プール）を持ち、リクエストごとに最も空いている正常なホストを選ぶ
+  - 待ち時間の見積もり: (実行中のリクエスト数 + 1) × 直近の応答時間（指数移動平均）
+  - 要求されたモデルを読み込み済みのホスト（/api/ps・そのモデルで応答したホスト）を優先する
+- 接続エラー・タイムアウト・受信途中の切断・502/503/504のホストはローテーションから外して別のホストで再試行し、
+  バックグラウンドのヘルスチェック（/api/ps）に応答したら戻す
+- ホストは環境変数OLLAMA_HOSTS（カンマ区切り）またはCLIの--hostsで指定する（2つ以上ならai_api.get_ai_clientがこのクライアントを返す）
+"""
+import threading
+import time
+
+import requests
+
+from utils.ai_api import BaseAIClient, OllamaClient, ollama_url
+
+# ヘルスチェック・読み込み済みモデルの確認の間隔（秒）
+DEFAULT_PROBE_INTERVAL = 2.0
+# ヘルスチェックのタイムアウト（秒）
+PROBE_TIMEOUT = 2.0
+# 応答時間の記録がないホストの見積もり（秒）
+DEFAULT_LATENCY = 1.0
+# 応答時間の指数移動平均の重み
+LATENCY_ALPHA = 0.3
+# モデルを読み込んでいないホストに加える待ち時間（秒。モデルの読み込みにかかる時間の目安）
+MODEL_LOAD_PENALTY = 10.0
+# 接続エラー・タイムアウト・受信途中の切断と同様にホストの障害として別のホストで再試行するHTTPステータス
+FAILOVER_STATUS = {502, 503, 504}
+
+
+def parse_hosts(value):
+    """カンマ区切りのホスト（例: gpu1,gpu2:11434）をURLのリストにする（ポートを省いたホストは11434。ai_api.ollama_url参照）"""
+    return [ollama_url(host) for host in (value or "").split(",") if host.strip()]
+
+
+class _Host:
+    def __init__(self, url, client):
+        self.url = url
+        self.client = client
+        self.healthy = True
+        self.inflight = 0
+        self.latency = None  # 直近の応答時間（秒、指数移動平均）
+        self.loaded = set()  # 読み込み済みのモデル
+        self.requests = 0
+        self.failures = 0
+
+    def estimated_wait(self, model, load_penalty):
+        wait = (self.inflight + 1) * (self.latency if self.latency is not None else DEFAULT_LATENCY)
+        return wait if model in self.loaded else wait + load_penalty
+
+
+class OllamaPoolClient(BaseAIClient):
+    def __init__(self, hosts, model="llama3", probe_interval=DEFAULT_PROBE_INTERVAL, load_penalty=MODEL_LOAD_PENALTY,
+                 **kwargs):
+        """
+        Args:
+            hosts (list): OllamaのベースURLのリスト
+            model (str): 使用するモデル名（generate・chatのmodel引数で変えられる）
+            probe_interval (float): ヘルスチェック・読み込み済みモデルの確認の間隔（秒）
+            load_penalty (float): モデルを読み込んでいないホストの待ち時間の見積もりに加える秒数
+            **kwargs: ホストごとのOllamaClientに渡す引数（connect_timeout, read_timeout, pool_maxsize, stream, stop_when, fast）
+        """
+        if not hosts:
+            raise ValueError("hosts is empty")
+        self.model = model
+        self.probe_interval = probe_interval
+        self.load_penalty = load_penalty
+        self.hosts = [_Host(url, OllamaClient(base_url=url, model=model, **kwargs)) for url in hosts]
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._session = requests.Session()
+        self._prober = threading.Thread(target=self._probe_loop, daemon=True)
+        self._prober.start()
+
+    @property
+    def fast_unsupported(self):
+        """高速モードに対応していなかったモデル（いずれかのホストで）"""
+        return set().union(*(host.client.fast_unsupported for host in self.hosts))
+
+    def generate(self, prompt, **kwargs):
+        """OllamaClient.generateと同じ（最も空いている正常なホストで生成する）"""
+        return self._dispatch("generate", prompt, kwargs)
+
+    def chat(self, messages, **kwargs):
+        """OllamaClient.chatと同じ（最も空いている正常なホストで生成する）"""
+        return self._dispatch("chat", messages, kwargs)
+
+    def _acquire(self, model, tried):
+        """リクエストを送るホストを選び、実行中の数を増やす（試していないホストがなければNone）"""
+        with self._lock:
+            candidates = [h for h in self.hosts if h not in tried and h.healthy]
+            if not candidates:
+                # すべて外れている場合は、ヘルスチェックを待たずに残りのホストも試す
+                candidates = [h for h in self.hosts if h not in tried]
+            if not candidates:
+                return None
+            host = min(candidates, key=lambda h: h.estimated_wait(model, self.load_penalty))
+            host.inflight += 1
+            host.requests += 1
+            return host
+
+    def _release(self, host, model=None, sec=None, failed=False):
+        with self._lock:
+            host.inflight -= 1
+            if failed:
+                host.failures += 1
+                host.healthy = False
+                return
+            if model is not None:
+                host.loaded.add(model)
+            if sec is not None:
+                host.latency = sec if host.latency is None else (1 - LATENCY_ALPHA) * host.latency + LATENCY_ALPHA * sec
+
+    def _dispatch(self, method, arg, kwargs):
+        model = kwargs.get("model", self.model)
+        metrics = kwargs.get("metrics")
+        tried = []
+        error = None
+        while True:
+            host = self._acquire(model, tried)
+            if host is None:
+                raise error
+            if tried and hasattr(kwargs.get("stop_when"), "reset"):
+                # 受信途中で切れたホストの内容を覚えている判定器（stream_validator.IncrementalPathValidator）は最初からにする
+                kwargs["stop_when"].reset()
+            tried.append(host)
+            start = time.perf_counter()
+            try:
+                result = getattr(host.client, method)(arg, **kwargs)
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                    requests.HTTPError) as e:
+                if isinstance(e, requests.HTTPError) and getattr(e.response, "status_code", None) not in FAILOVER_STATUS:
+                    self._release(host)
+                    raise
+                # ローテーションから外し、別のホストで最初から生成し直す
+                self._release(host, failed=True)
+                error = e
+                continue
+            except BaseException:
+                # 中断・HTTPエラーなどはホストの障害ではないのでそのまま送出する
+                self._release(host)
+                raise
+            self._release(host, model=model, sec=time.perf_counter() - start)
+            if metrics is not None:
+                metrics["host"] = host.url
+            return result
+
+    def _probe(self, host):
+        """ホストの読み込み済みモデルを確認する（応答がなければFalse）"""
+        try:
+            response = self._session.get(f"{host.url}/api/ps", timeout=PROBE_TIMEOUT)
+            response.raise_for_status()
+            loaded = {m.get("name") or m.get("model") for m in response.json().get("models", [])}
+        except (requests.RequestException, ValueError):
+            return False
+        with self._lock:
+            host.healthy = True
+            host.loaded = loaded
+        return True
+
+    def _probe_loop(self):
+        while not self._closed.is_set():
+            for host in self.hosts:
+                if self._closed.is_set():
+                    return
+                if not self._probe(host):
+                    with self._lock:
+                        host.healthy = False
+            self._closed.wait(self.probe_interval)
+
+    def stats(self):
+        """ホストごとの状態（リクエスト数・失敗数・実行中の数・応答時間・読み込み済みモデル）"""
+        with self._lock:
+            return {h.url: {"healthy": h.healthy, "requests": h.requests, "failures": h.failures, "inflight": h.inflight,
+                            "latency": h.latency, "loaded": sorted(h.loaded)} for h in self.hosts}
+
+    def close(self):
+        """ヘルスチェックを止め、保持している接続を閉じる"""
+        self._closed.set()
+        self._prober.join(timeout=PROBE_TIMEOUT + 1)
+        self._session.close()
+        for host in self.hosts:
+            host.client.close()
@@ -0,0 +1,141 @@
+"""
+カリキュラム（サンプルの並び順）の最適化モジュール
+ギャップがgのファイルの前にはg-1個の中間プログラム（AI生成）が必要になるので、
+既存サンプルの並び順を変えて必要な生成数 sum(max(0, g-1)) を最小にする
+- ファイル数が少なければ部分集合DPで厳密な最小値を求める
+  （学習済み要素はそれまでに並べたファイル集合の和集合で決まるので、状態は集合だけでよい）
+- 多い場合は貪欲法とビームサーチで探索する
+- pinsで一部のファイルの位置を固定できる
+- 候補の並び順の評価（ギャップ数）はCorpusBitsetsの累積OR・popcountで行う
+"""
+from utils.path_bitset import CorpusBitsets
+
+# これ以下のファイル数なら部分集合DPで厳密に解く
+EXACT_LIMIT = 16
+
+
+def required_generations(bitsets, order):
+    """並び順orderで必要な中間プログラム数と、各ファイルのギャップ数のリストを返す（bitsets: CorpusBitsets）"""
+    gaps = bitsets.gaps(order)
+    return sum(max(0, gap - 1) for gap in gaps), gaps
+
+
+def _candidates(remaining, position, pins, pinned_files):
+    """positionに置けるファイル（固定されたファイルがあればそれのみ）"""
+    pinned = pins.get(position)
+    if pinned is not None:
+        return [pinned] if pinned in remaining else []
+    return [i for i in remaining if i not in pinned_files]
+
+
+def _step_cost(mask, learned):
+    return max(0, (mask & ~learned).bit_count() - 1)
+
+
+def greedy_order(masks, pins=None):
+    """各位置で追加コスト（ギャップ-1）が最小のファイルを選ぶ（同点ならギャップが小さく元の順が早いもの）"""
+    pins = pins or {}
+    pinned_files = set(pins.values())
+    remaining = set(range(len(masks)))
+    learned = 0
+    order = []
+    for position in range(len(masks)):
+        choices = _candidates(remaining, position, pins, pinned_files)
+        best = min(choices, key=lambda i: (_step_cost(masks[i], learned), (masks[i] & ~learned).bit_count(), i))
+        order.append(best)
+        remaining.discard(best)
+        learned |= masks[best]
+    return order
+
+
+def beam_search_order(masks, pins=None, beam_width=64):
+    """ビームサーチで並び順を探索する（状態: 並べたファイル集合・学習済み要素・コスト）"""
+    pins = pins or {}
+    pinned_files = set(pins.values())
+    n = len(masks)
+    # (コスト, 並び順, 学習済み要素, 並べたファイルのビット集合)
+    beam = [(0, [], 0, 0)]
+    for position in range(n):
+        expanded = {}
+        for cost, order, learned, used in beam:
+            remaining = [i for i in range(n) if not used >> i & 1]
+            for i in _candidates(remaining, position, pins, pinned_files):
+                new_used = used | (1 << i)
+                new_cost = cost + _step_cost(masks[i], learned)
+                # 同じファイル集合に到達した状態は学習済み要素も同じなので、コストが小さいものだけ残す
+                if new_used not in expanded or new_cost < expanded[new_used][0]:
+                    expanded[new_used] = (new_cost, order + [i], learned | masks[i], new_used)
+        beam = sorted(expanded.values(), key=lambda s: (s[0], s[1]))[:beam_width]
+    return beam[0][1]
+
+
+def exact_order(masks, pins=None):
+    """部分集合DPで必要な生成数が最小の並び順を求める（O(2^n * n)）"""
+    pins = pins or {}
+    pinned_files = set(pins.values())
+    n = len(masks)
+    full = (1 << n) - 1
+    # 部分集合ごとの学習済み要素（和集合）
+    unions = [0] * (1 << n)
+    for used in range(1, 1 << n):
+        low = used & -used
+        unions[used] = unions[used ^ low] | masks[low.bit_length() - 1]
+    inf = float("inf")
+    best = [inf] * (1 << n)
+    choice = [-1] * (1 << n)
+    best[0] = 0
+    for used in range(1 << n):
+        if best[used] == inf:
+            continue
+        position = used.bit_count()
+        remaining = [i for i in range(n) if not used >> i & 1]
+        for i in _candidates(remaining, position, pins, pinned_files):
+            new_used = used | (1 << i)
+            cost = best[used] + _step_cost(masks[i], unions[used])
+            if cost < best[new_used]:
+                best[new_used] = cost
+                choice[new_used] = i
+    if best[full] == inf:
+        raise ValueError("固定位置の指定を満たす並び順がありません")
+    order = []
+    used = full
+    while used:
+        i = choice[used]
+        order.append(i)
+        used ^= 1 << i
+    return order[::-1]
+
+
+def optimize_order(path_sets, pins=None, beam_width=64, exact_limit=EXACT_LIMIT):
+    """
+    必要な中間プログラム数が最小になる並び順を探す
+    path_sets: ファイルごとのパス集合（元の順）
+    pins: {位置(0始まり): ファイルの添字} 固定する位置
+    Returns: dict {'order', 'generations', 'gaps', 'original_generations', 'original_gaps', 'method'}
+    """
+    pins = dict(pins or {})
+    n = len(path_sets)
+    for position, i in pins.items():
+        if not (0 <= position < n and 0 <= i < n):
+            raise ValueError(f"固定位置の指定が範囲外です: {position}:{i}")
+    if len(set(pins.values())) != len(pins):
+        raise ValueError("同じファイルが複数の位置に固定されています")
+    bitsets = CorpusBitsets(path_sets)
+    masks = bitsets.masks
+    original = list(range(n))
+    if n <= exact_limit:
+        order, method = exact_order(masks, pins), "exact"
+    else:
+        # 貪欲法とビームサーチのうち良い方を採用する
+        candidates = [(greedy_order(masks, pins), "greedy"), (beam_search_order(masks, pins, beam_width), "beam")]
+        order, method = min(candidates, key=lambda c: required_generations(bitsets, c[0])[0])
+    generations, gaps = required_generations(bitsets, order)
+    original_generations, original_gaps = required_generations(bitsets, original)
+    return {
+        'order': order,
+        'generations': generations,
+        'gaps': gaps,
+        'original_generations': original_generations,
+        'original_gaps': original_gaps,
+        'method': method,
+    }
@@ -1,29 +1,69 @@
-import ast
+from utils import analysis_engine
 
-def add_parent_info(node, parent=None):
-    for child in ast.iter_child_nodes(node):
-        child.parent = node
-        add_parent_info(child, node)
+# 統合解析エンジンの制御構文のうち、ASTのノード（If, For）に対応するもの
+# （elifはASTではIfノードとして表れる。elseは独立したノードを持たない）
+AST_NODE_TYPES = {'if': 'If', 'elif': 'If', 'for': 'For'}
 
 def get_nesting_depth(node):
-    depth = 0
-    parent = getattr(node, 'parent', None)
-    while parent is not None:
-        if isinstance(parent, (ast.If, ast.For)):
-            depth += 1
-        parent = getattr(parent, 'parent', None)
-    return depth
+    """
+    統合解析エンジンのノードについて、外側にあるIf/Forの数を返す
+    parse_control_structuresで求めた深さがあればそれを返す（elif・elseの中はASTと同じく前のIf/Forの内側として数える）
+    """
+    if 'ast_depth' in node:
+        return node['ast_depth']
+    return sum(1 for part in node['path'].split('/')[:-1] if part in AST_NODE_TYPES)
+
+def _clause_header(lines, line):
+    """elif・else（line行目）の直前にある同じインデントの節の見出しの行番号（見つからなければNone）"""
+    text = lines[line - 1]
+    indent = len(text) - len(text.lstrip())
+    for row in range(line - 1, 0, -1):
+        previous = lines[row - 1]
+        stripped = previous.lstrip()
+        if not stripped or stripped.startswith('#'):
+            continue
+        if len(previous) - len(stripped) == indent:
+            return row
+        if len(previous) - len(stripped) < indent:
+            return None
+    return None
+
+def _annotate_depths(children, depth, lines):
+    """ツリーを前順にたどり、ASTと同じ数え方のネスト深さをノードのast_depthに入れて返す"""
+    result = []
+    orelse = {}  # if/elif/forの行 → そのorelse（elif・else側）の深さ
+    for node in children:
+        line_text = lines[node['line'] - 1].lstrip() if node['line'] <= len(lines) else ''
+        if node['type'] == 'for' and line_text.startswith('async'):
+            # async forはASTではAsyncFor（If/Forとして数えない）
+            inner = depth
+        elif node['type'] in ('if', 'for'):
+            node['ast_depth'] = depth
+            inner = depth + 1
+            orelse.setdefault(node['line'], inner)
+        elif node['type'] in ('elif', 'else'):
+            # 直前の節がif/elif/forならそのorelseの中（while・try・async forのelseは外側と同じ深さ）
+            inner = orelse.get(_clause_header(lines, node['line']), depth)
+            if node['type'] == 'elif':
+                node['ast_depth'] = inner
+                inner += 1
+                orelse.setdefault(node['line'], inner)
+        else:
+            inner = depth
+        if 'ast_depth' in node:
+            result.append(node)
+        result.extend(_annotate_depths(node['children'], inner, lines))
+    return result
 
 def parse_control_structures(code):
-    """ASTを使って制御構文とネスト深さを抽出"""
-    tree = ast.parse(code)
-    add_parent_info(tree)
-    control_structures = []
-    for node in ast.walk(tree):
-        if isinstance(node, (ast.If, ast.For)):
-            structure = {
-                'type': type(node).__name__,
-                'depth': get_nesting_depth(node)
-            }
-            control_structures.append(structure)
-    return control_structures
+    """
+    制御構文（If, For）とネスト深さを抽出（統合解析エンジンの結果のビュー。バックエンドはparser_tokenizeと同じ）
+    ast.parseによる以前の実装との違い:
+    - tokenizeバックエンドでは内包表記・条件式のif/forも数える（scanバックエンドでは以前と同じく数えない）
+    - 並びはソース上の出現順（以前はast.walkの幅優先順）
+    - 構文の検査はしない（括弧・文字列が閉じていないなど字句の誤りだけ例外になる）
+    """
+    tree = analysis_engine.analyze(code)['tree']
+    lines = code.splitlines()
+    return [{'type': AST_NODE_TYPES[node['type']], 'depth': node['ast_depth']}
+            for node in _annotate_depths(tree, 0, lines)]
@@ -1,71 +1,48 @@
+from utils import control_elements
+from utils import analysis_engine
 
-import tokenize
-import io
-import sys
-import importlib.util
-
-# main.pyのCONTROL_ELEMENTSを参照
+# CONTROL_ELEMENTSはレジストリ（utils/control_elements.py）を参照
+# （以前はmain.pyを毎回exec_moduleしていたが、読み込み済みの集合を共有する）
 def get_control_elements():
-    spec = importlib.util.find_spec('main')
-    if spec is not None:
-        main_mod = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(main_mod)
-        return set(main_mod.CONTROL_ELEMENTS)
-    # fallback
-    return {'if', 'elif', 'else', 'for'}
+    return control_elements.get_control_elements()
 
 
+# 以下の関数は統合解析エンジン（utils/analysis_engine.py）の結果のビュー
 def parse_control_structure_tree(code):
     """tokenizeを使ってif, elif, else, forのネスト構造をツリーとして抽出"""
-    import collections
-    tokens = tokenize.tokenize(io.BytesIO(code.encode('utf-8')).readline)
-    root = []  # 最上位のノードリスト
-    stack = [(root, -1)]  # (現在のノードリスト, インデントレベル)
-    control_keywords = get_control_elements()
-    for token in tokens:
-        if token.type == tokenize.INDENT:
-            # 新しいブロックに入る
-            stack.append((stack[-1][0][-1]['children'], token.start[1]))
-        elif token.type == tokenize.DEDENT:
-            # ブロックを抜ける
-            if len(stack) > 1:
-                stack.pop()
-        elif token.type == tokenize.NAME and token.string in control_keywords:
-            node = {'type': token.string, 'children': []}
-            stack[-1][0].append(node)
-    return root
+    return analysis_engine.analyze(code)['tree']
+
+def parse_partial_control_structure_tree(code):
+    """
+    途中までのコード（ストリーミング受信中など）から、確定している部分のツリーを返す
+    末尾が閉じていない括弧・文字列などで解析できなくなった時点までのノードを返す
+    """
+    return analysis_engine.analyze(code, partial=True)['tree']
 
 def tree_to_paths(tree, prefix=None):
-    """ツリー構造からパス形式（for/if/elseなど）リストを生成"""
-    if prefix is None:
-        prefix = []
+    """
+    ツリー構造からパス形式（for/if/elseなど）リストを生成（前順）
+    親のパスの文字列に要素を1つ足して子のパスを作る（ノードごとに前置部分のリストを作り直さない）
+    """
+    base = '/'.join(prefix) if prefix else None
     paths = []
-    for node in tree:
-        current_path = prefix + [node['type']]
-        paths.append('/'.join(current_path))
-        if node['children']:
-            paths.extend(tree_to_paths(node['children'], current_path))
+    stack = [(base, node) for node in reversed(tree)]
+    while stack:
+        parent, node = stack.pop()
+        path = node['type'] if parent is None else f"{parent}/{node['type']}"
+        paths.append(path)
+        stack.extend((path, child) for child in reversed(node['children']))
     return paths
 
+def parse_control_path_trie(code):
+    """パスのトライ（utils/path_trie.py。パスごとの出現回数・出現行）を返す"""
+    return analysis_engine.analyze(code)['trie']
+
+def parse_control_paths(code):
+    """パス形式（for/if/elseなど）リストを返す（tree_to_paths(parse_control_structure_tree(code))と同じ結果を1回の走査で求める）"""
+    return analysis_engine.analyze(code)['paths']
+
 # 既存の関数も維持（深さ情報のみ欲しい場合用）
 def parse_control_structures(code):
     """tokenizeを使ってif, elif, else, forの制御構文とネスト深さを抽出"""
-    control_structures = []
-    current_depth = 0
-    indent_levels = []
-    tokens = tokenize.tokenize(io.BytesIO(code.encode('utf-8')).readline)
-    control_keywords = get_control_elements()
-    for token in tokens:
-        if token.type == tokenize.INDENT:
-            current_depth += 1
-            indent_levels.append(token.start[1])
-        elif token.type == tokenize.DEDENT:
-            current_depth = max(0, current_depth - 1)
-            if indent_levels:
-                indent_levels.pop()
-        elif token.type == tokenize.NAME and token.string in control_keywords:
-            control_structures.append({
-                'type': token.string,
-                'depth': current_depth
-            })
-    return control_structures
+    return [{'type': node['type'], 'depth': node['depth']} for node in analysis_engine.analyze(code)['nodes']]
@@ -0,0 +1,148 @@
+"""
+制御構文パスの整数ID化とビット集合によるギャップ計算
+- PathInterner: パス文字列（for/if/elseなど）を整数IDに対応づける
+- パス集合はIDのビット集合（Pythonのint）で表し、集合演算をビット演算で行う
+- CorpusBitsets: コーパス全体を「ファイル × パスID」のビット行列（NumPyがあればpackbitsした配列）で持ち、
+  累積OR（learned）とpopcount（ギャップ数）をまとめて計算する。並び順を変えた場合の試算にも使う
+NumPyがない環境ではPythonのintによるビット演算で同じ結果を返す
+"""
+import threading
+
+# NumPyは任意（なければintのビット演算で計算する）。CorpusBitsetsを作るまで読み込まない
+np = None
+_numpy_loaded = False
+# 0〜255の各値の立っているビット数（packbitsした配列のpopcount用）
+_POPCOUNT_TABLE = None
+
+
+def _load_numpy():
+    """NumPyを読み込む（なければNone）"""
+    global np, _numpy_loaded, _POPCOUNT_TABLE
+    if not _numpy_loaded:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        if numpy is not None:
+            _POPCOUNT_TABLE = numpy.array([bin(i).count("1") for i in range(256)], dtype=numpy.uint16)
+        np = numpy
+        _numpy_loaded = True
+    return np
+
+
+class PathInterner:
+    def __init__(self, paths=()):
+        """
+        Args:
+            paths (iterable): 最初に登録しておくパス
+        """
+        self._ids = {}
+        self._paths = []
+        self._lock = threading.Lock()
+        for path in paths:
+            self.intern(path)
+
+    def __len__(self):
+        return len(self._paths)
+
+    def intern(self, path):
+        """パスのIDを返す（未登録なら新しいIDを割り当てる）"""
+        path_id = self._ids.get(path)
+        if path_id is None:
+            with self._lock:
+                path_id = self._ids.get(path)
+                if path_id is None:
+                    path_id = len(self._paths)
+                    self._paths.append(path)
+                    self._ids[path] = path_id
+        return path_id
+
+    def path(self, path_id):
+        """IDに対応するパスを返す"""
+        return self._paths[path_id]
+
+    def mask(self, paths):
+        """パスの集合をビット集合（int）に変換する"""
+        mask = 0
+        for path in paths:
+            mask |= 1 << self.intern(path)
+        return mask
+
+    def paths(self, mask):
+        """ビット集合（int）をパスのリスト（ID順）に変換する"""
+        result = []
+        path_id = 0
+        while mask:
+            if mask & 1:
+                result.append(self._paths[path_id])
+            mask >>= 1
+            path_id += 1
+        return result
+
+
+class CorpusBitsets:
+    def __init__(self, path_sets, interner=None):
+        """
+        Args:
+            path_sets (list): 学習順に並んだファイルごとのパス集合
+            interner (PathInterner): 使うインターン表（Noneなら新規に作成）
+        """
+        self.interner = interner or PathInterner()
+        self.masks = [self.interner.mask(paths) for paths in path_sets]
+        self.matrix = self._build_matrix() if _load_numpy() is not None else None
+
+    def __len__(self):
+        return len(self.masks)
+
+    def _build_matrix(self):
+        """ファイル × パスIDの0/1行列をpackbitsした配列（uint8、行ごとに ceil(パス数/8) バイト）"""
+        n_paths = max(len(self.interner), 1)
+        n_bytes = (n_paths + 7) // 8
+        rows = np.zeros((len(self.masks), n_bytes), dtype=np.uint8)
+        for i, mask in enumerate(self.masks):
+            # intのビット列をリトルエンディアンのバイト列にし、packbits(bitorder='little')と同じ並びにする
+            rows[i] = np.frombuffer(mask.to_bytes(n_bytes, "little"), dtype=np.uint8)
+        return rows
+
+    def _row_mask(self, row):
+        return int.from_bytes(row.tobytes(), "little")
+
+    def gap_masks(self, order=None):
+        """
+        並び順orderで学習したときの、各ファイルの新規要素（ビット集合）のリストを返す
+        order: ファイルの添字の並び（Noneなら元の順）
+        """
+        order = list(range(len(self.masks))) if order is None else list(order)
+        if not order:
+            return []
+        if self.matrix is None:
+            learned = 0
+            result = []
+            for i in order:
+                result.append(self.masks[i] & ~learned)
+                learned |= self.masks[i]
+            return result
+        rows = self.matrix[order]
+        learned = np.bitwise_or.accumulate(rows, axis=0)
+        before = np.zeros_like(rows)
+        before[1:] = learned[:-1]
+        new = rows & ~before
+        return [self._row_mask(row) for row in new]
+
+    def gaps(self, order=None):
+        """並び順orderで学習したときの、各ファイルのギャップ数（新規要素数）のリストを返す"""
+        order = list(range(len(self.masks))) if order is None else list(order)
+        if not order:
+            return []
+        if self.matrix is None:
+            return [mask.bit_count() for mask in self.gap_masks(order)]
+        rows = self.matrix[order]
+        learned = np.bitwise_or.accumulate(rows, axis=0)
+        before = np.zeros_like(rows)
+        before[1:] = learned[:-1]
+        new = rows & ~before
+        return _POPCOUNT_TABLE[new].sum(axis=1).tolist()
+
+    def new_elements(self, order=None):
+        """並び順orderで学習したときの、各ファイルの新規要素（パスのリスト）のリストを返す"""
+        return [self.interner.paths(mask) for mask in self.gap_masks(order)]
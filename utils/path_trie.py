@@ -0,0 +1,124 @@
+"""
+制御構文パスのトライ
+- パス（例: for/if/else）を要素ごとのノードで表し、共通の前置部分（for, for/if）を共有する
+- ノードごとに出現回数と出現行を持つので、パスの集合・含むかどうか・どこに現れるかを再解析せずに求められる
+- 統合解析エンジン（analysis_engine / control_scanner）が解析と同時に作る（結果の'trie'）
+- 複数ファイルのトライをまとめられる（mergeでファイル名と最初の出現行を記録する）
+"""
+
+
+class PathTrieNode:
+    __slots__ = ("children", "count", "lines", "sources")
+
+    def __init__(self):
+        self.children = {}  # 要素（if, forなど） → PathTrieNode
+        self.count = 0  # このパスの出現回数
+        self.lines = []  # このパスが現れる行（出現順）
+        self.sources = {}  # merge(source=...)でまとめたファイル → そのファイルで最初に現れる行
+
+    def child(self, part):
+        """要素partの子ノード（なければ作る）"""
+        node = self.children.get(part)
+        if node is None:
+            node = self.children[part] = PathTrieNode()
+        return node
+
+
+class PathTrie:
+    def __init__(self):
+        self.root = PathTrieNode()
+
+    @classmethod
+    def from_tree(cls, tree):
+        """解析結果のツリー（インデックスから復元したものを含む）からトライを作る"""
+        trie = cls()
+        stack = [(trie.root, node) for node in reversed(tree)]
+        while stack:
+            parent, node = stack.pop()
+            current = parent.child(node['type'])
+            current.count += 1
+            if 'line' in node:
+                current.lines.append(node['line'])
+            stack.extend((current, child) for child in reversed(node['children']))
+        return trie
+
+    def add(self, path, line=None, count=1):
+        """パスを1件（count件）追加する"""
+        node = self.root
+        for part in path.split('/'):
+            node = node.child(part)
+        node.count += count
+        if line is not None:
+            node.lines.append(line)
+        return node
+
+    def find(self, path):
+        """パスのノード（なければNone）"""
+        node = self.root
+        for part in path.split('/'):
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node if node.count else None
+
+    def __contains__(self, path):
+        return self.find(path) is not None
+
+    def __len__(self):
+        return sum(1 for _ in self.items())
+
+    def __eq__(self, other):
+        return isinstance(other, PathTrie) and self.to_dict() == other.to_dict()
+
+    def count(self, path):
+        """パスの出現回数"""
+        node = self.find(path)
+        return node.count if node else 0
+
+    def lines(self, path):
+        """パスが現れる行のリスト"""
+        node = self.find(path)
+        return list(node.lines) if node else []
+
+    def first_line(self, path):
+        """パスが最初に現れる行（行の記録がなければNone）"""
+        node = self.find(path)
+        return node.lines[0] if node and node.lines else None
+
+    def items(self):
+        """(パス, ノード) を前順に返す（前置部分の文字列はノードごとに1度だけ作る）"""
+        stack = [(part, child) for part, child in reversed(self.root.children.items())]
+        while stack:
+            path, node = stack.pop()
+            if node.count:
+                yield path, node
+            stack.extend((f"{path}/{part}", child) for part, child in reversed(node.children.items()))
+
+    def paths(self):
+        """パスの集合"""
+        return {path for path, _ in self.items()}
+
+    def merge(self, other, source=None):
+        """
+        別のトライの出現回数・出現行を足し込む
+        source: otherのファイル名（指定すれば行はまとめず、ファイルごとの最初の出現行をsourcesに記録する）
+        """
+        stack = [(self.root, other.root)]
+        while stack:
+            mine, theirs = stack.pop()
+            for part, child in theirs.children.items():
+                target = mine.child(part)
+                target.count += child.count
+                if source is None:
+                    target.lines.extend(child.lines)
+                    for src, line in child.sources.items():
+                        target.sources.setdefault(src, line)
+                elif child.count and source not in target.sources:
+                    target.sources[source] = child.lines[0] if child.lines else None
+                stack.append((target, child))
+        return self
+
+    def to_dict(self):
+        """パス → {'count', 'lines', 'sources'} の辞書"""
+        return {path: {"count": node.count, "lines": list(node.lines), "sources": dict(node.sources)}
+                for path, node in self.items()}
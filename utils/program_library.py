@@ -0,0 +1,130 @@
+"""
+判定済みプログラムのライブラリ
+- プログラムを制御構文パスの集合で索引し、部分集合・上位集合の条件で検索する
+- degapのジョブ（required ⊆ paths ⊆ required ∪ allowed）に合うプログラムがあれば、AIを呼ばずにそれを使う
+- 合格した生成結果・サンプル・以前のresult/*_prevN.pyを登録していく
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from utils import analysis_engine
+from utils.file_utils import atomic_write_json
+from utils.path_bitset import PathInterner
+
+DEFAULT_LIBRARY_PATH = os.path.join(".degap_cache", "program_library.json")
+
+
+class ProgramLibrary:
+    def __init__(self, library_path=DEFAULT_LIBRARY_PATH):
+        """
+        Args:
+            library_path (str): ライブラリの保存先（JSON）。Noneならメモリ上のみ
+        """
+        self.library_path = library_path
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._interner = PathInterner()
+        self._entries = {}  # プログラムのハッシュ → エントリ
+        self._masks = {}  # プログラムのハッシュ → パス集合のビット集合
+        self.hits = 0
+        self.misses = 0
+        for entry in self._load():
+            self._index(entry)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _load(self):
+        if self.library_path is None:
+            return []
+        try:
+            with open(self.library_path, "r", encoding="utf-8") as f:
+                return json.load(f).get("programs", [])
+        except (OSError, ValueError):
+            return []
+
+    def save(self):
+        """変更があればライブラリを書き出す"""
+        with self._lock:
+            if self.library_path is None or not self._dirty:
+                return
+            os.makedirs(os.path.dirname(self.library_path) or ".", exist_ok=True)
+            atomic_write_json(self.library_path, {"programs": list(self._entries.values())})
+            self._dirty = False
+
+    def _index(self, entry):
+        self._entries[entry["hash"]] = entry
+        self._masks[entry["hash"]] = self._interner.mask(entry["paths"])
+
+    def add(self, code, source, paths=None):
+        """
+        プログラムを登録する（同じ内容のプログラムは1つだけ保持する）
+        paths: 制御構文パス（Noneなら解析して求める）
+        Returns: 登録したエントリ（解析できないコードならNone）
+        """
+        if not code or not code.strip():
+            return None
+        if paths is None:
+            try:
+                paths = analysis_engine.analyze(code)["paths"]
+            except analysis_engine.PARTIAL_ERRORS:
+                return None
+        digest = hashlib.sha256(code.encode("utf-8")).hexdigest()
+        with self._lock:
+            if digest in self._entries:
+                return self._entries[digest]
+            entry = {"hash": digest, "code": code, "paths": sorted(set(paths)), "source": source, "created": time.time()}
+            self._index(entry)
+            self._dirty = True
+            return entry
+
+    def add_file(self, path, source=None, paths=None):
+        """ファイルの内容を登録する（sourceを省略した場合はファイルのパス）"""
+        with open(path, "r", encoding="utf-8") as f:
+            code = f.read()
+        return self.add(code, source or path, paths=paths)
+
+    def find(self, required_elements, allowed_elements, exclude_sources=()):
+        """
+        required ⊆ paths ⊆ required ∪ allowed を満たすプログラムを返す（なければNone）
+        複数あれば余分なパスが少なく、コードが短いものを選ぶ
+        exclude_sources: 候補から除くsource（例: 挿入先のサンプル自身）
+        """
+        required = self._interner.mask(required_elements)
+        permitted = required | self._interner.mask(allowed_elements)
+        best = None
+        with self._lock:
+            for digest, mask in self._masks.items():
+                if required & ~mask or mask & ~permitted:
+                    continue
+                entry = self._entries[digest]
+                if entry["source"] in exclude_sources:
+                    continue
+                rank = ((mask & ~required).bit_count(), len(entry["code"]))
+                if best is None or rank < best[0]:
+                    best = (rank, entry)
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return best[1]
+
+    def subsets_of(self, paths):
+        """パス集合がpathsの部分集合であるプログラムのリスト"""
+        target = self._interner.mask(paths)
+        with self._lock:
+            return [self._entries[d] for d, mask in self._masks.items() if not mask & ~target]
+
+    def supersets_of(self, paths):
+        """パス集合がpathsを含むプログラムのリスト"""
+        target = self._interner.mask(paths)
+        with self._lock:
+            return [self._entries[d] for d, mask in self._masks.items() if not target & ~mask]
+
+    def stats(self):
+        """登録数・ヒット数・ミス数を返す"""
+        with self._lock:
+            return {"programs": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,195 @@
+"""
+適応的な再試行方針モジュール
+- 生成の合否を (学習要素パス, 深さ, モデル, allowed_elementsの件数の区分) ごとに記録し、次回以降の生成に使う
+  - 生成回数の上限: 1回あたりの合格率から、COVERAGEの確率で合格できる回数を求める（max_retryを超えない）
+  - 温度: 温度ごとの合格率の高い順に試す（どの温度も記録が少ないうちはモデルの既定の温度のまま。投機的生成の候補だけ既定の順でずらす）
+  - seed: 記録のキーから決まる値から始めて試行ごとに変える
+    同じ条件のジョブは実行ごとに同じseedになるので、実行し直したときに試行ごとのキャッシュ（GenerationCache）が使える
+    （そのかわりキャッシュなしでは同じ出力を繰り返し、キャッシュから再利用した試行も記録に数える）
+- 記録が十分にあり一度も合格していない条件は見込みなしとして、PROBE_ATTEMPTS回だけ試して打ち切る
+- 同じパスの記録が少なければ、深さ・モデル・件数の区分が同じ条件の記録をまとめたもので判断する
+"""
+import hashlib
+import json
+import math
+import os
+import threading
+
+from utils.file_utils import atomic_write_json
+
+DEFAULT_RETRY_STATS_PATH = os.path.join(".degap_cache", "retry_stats.json")
+# この件数以上のジョブの記録があれば、記録から生成回数・温度を決める
+MIN_JOBS = 3
+# 温度ごとの試行がこの回数以上あれば、その温度の合格率を使う
+MIN_TEMPERATURE_TRIES = 3
+# 生成回数の上限は、この確率で合格できる回数にする
+COVERAGE = 0.9
+# 上限を下げる場合もこの回数は試す
+MIN_BUDGET = 2
+# この回数以上生成して一度も合格していない条件は見込みなしとする
+HOPELESS_ATTEMPTS = 12
+# 見込みなしの条件で試す回数
+PROBE_ATTEMPTS = 1
+# 記録がない温度を試す順（ai_generator.SPECULATIVE_TEMPERATURESと同じ）
+DEFAULT_TEMPERATURES = [0.2, 0.5, 0.8, 1.0, 0.35, 0.65, 0.9]
+
+
+def allowed_bucket(count):
+    """allowed_elementsの件数の区分（0, 1, 2-3, 4-7, ...）"""
+    if count <= 1:
+        return str(count)
+    low = 1 << (count.bit_length() - 1)
+    return f"{low}-{2 * low - 1}"
+
+
+def job_seed(key):
+    """記録のキーから決まるseedの起点（1以上2**31未満）"""
+    return int(hashlib.sha256(key.encode("utf-8")).hexdigest()[:8], 16) % (2 ** 31 - 1) + 1
+
+
+def config_keys(learning_elements, allowed_elements, model):
+    """記録のキー（パスごと・パスをまとめたもの）"""
+    from utils.model_cascade import path_depth
+    depth = max((path_depth(p) for p in learning_elements), default=1)
+    rest = f"{depth}|{model}|{allowed_bucket(len(allowed_elements))}"
+    return f"{','.join(sorted(learning_elements))}|{rest}", f"*|{rest}"
+
+
+class RetryPolicy:
+    def __init__(self, stats_path=DEFAULT_RETRY_STATS_PATH, min_jobs=MIN_JOBS, coverage=COVERAGE,
+                 hopeless_attempts=HOPELESS_ATTEMPTS):
+        """
+        Args:
+            stats_path (str): 記録の保存先（JSON）。Noneならメモリ上のみ
+            min_jobs (int): 記録から判断するのに必要なジョブ数
+            coverage (float): 生成回数の上限を決める合格確率
+            hopeless_attempts (int): 一度も合格せずにこの回数生成した条件は見込みなしとする
+        """
+        self.stats_path = stats_path
+        self.min_jobs = min_jobs
+        self.coverage = coverage
+        self.hopeless_attempts = hopeless_attempts
+        self._lock = threading.Lock()
+        self._dirty = False
+        # キー → {"jobs", "solved", "attempts", "solved_at": {合格した試行回数: 件数}, "temperatures": {温度: [試行数, 合格数]}}
+        self._stats = self._load()
+
+    def _load(self):
+        if self.stats_path is None:
+            return {}
+        try:
+            with open(self.stats_path, "r", encoding="utf-8") as f:
+                return json.load(f).get("configs", {})
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        """変更があれば記録を書き出す"""
+        with self._lock:
+            if self.stats_path is None or not self._dirty:
+                return
+            os.makedirs(os.path.dirname(self.stats_path) or ".", exist_ok=True)
+            atomic_write_json(self.stats_path, {"configs": self._stats})
+            self._dirty = False
+
+    def _entry(self, key):
+        return self._stats.setdefault(key, {"jobs": 0, "solved": 0, "attempts": 0, "solved_at": {}, "temperatures": {}})
+
+    def _evidence(self, keys):
+        """判断に使う記録（パスごとの記録が少なければまとめたもの。どちらも少なければNone）"""
+        for key in keys:
+            entry = self._stats.get(key)
+            if entry and entry["jobs"] >= self.min_jobs:
+                return key, entry
+        return None, None
+
+    def plan(self, learning_elements, allowed_elements, model, max_retry):
+        """
+        生成回数の上限・温度の順を決める
+        Returns: dict {'keys', 'budget', 'temperatures', 'seed', 'hopeless', 'rate', 'evidence', 'reason'}
+          temperatures: 試す温度の順（記録がなければNone） / seed: このジョブのseedの起点（記録のキーから決まる）
+          rate: 1回あたりの合格率の推定（記録がなければNone） / evidence: 判断に使った記録のキー
+        """
+        keys = config_keys(learning_elements, allowed_elements, model)
+        with self._lock:
+            key, entry = self._evidence(keys)
+            entry = json.loads(json.dumps(entry)) if entry else None
+        plan = {"keys": keys, "budget": max_retry, "temperatures": None, "seed": job_seed(keys[0]),
+                "hopeless": False, "rate": None, "evidence": key, "reason": "記録なし"}
+        if entry is None:
+            return plan
+        # 1回あたりの合格率（一様事前分布の事後平均）
+        rate = (entry["solved"] + 1) / (entry["attempts"] + 2)
+        plan["rate"] = rate
+        plan["temperatures"] = self._rank_temperatures(entry["temperatures"])
+        if entry["solved"] == 0 and entry["attempts"] >= self.hopeless_attempts:
+            plan.update(budget=min(max_retry, PROBE_ATTEMPTS), hopeless=True,
+                        reason=f"{entry['jobs']}ジョブ・{entry['attempts']}回の生成で合格なし")
+            return plan
+        needed = math.ceil(math.log(1 - self.coverage) / math.log(1 - rate)) if rate < 1 else 1
+        # 過去に合格した試行回数の大部分は収まるようにする
+        solved_at = sorted(int(n) for n, count in entry["solved_at"].items() for _ in range(count))
+        if solved_at:
+            needed = max(needed, solved_at[min(len(solved_at) - 1, int(len(solved_at) * self.coverage))])
+        plan["budget"] = max(1, min(max_retry, max(MIN_BUDGET, needed)))
+        plan["reason"] = f"合格率 {rate:.0%}（{entry['jobs']}ジョブ・{entry['attempts']}回）"
+        return plan
+
+    @staticmethod
+    def _rank_temperatures(temperatures):
+        """温度を合格率の高い順に並べる（試行が少ない温度は既定の順で後ろに置く。どの温度も試行が少なければNone）"""
+        def score(t):
+            tries, passes = temperatures.get(str(t), (0, 0))
+            return (passes + 1) / (tries + 2) if tries >= MIN_TEMPERATURE_TRIES else None
+        known = sorted((t for t in DEFAULT_TEMPERATURES if score(t) is not None), key=score, reverse=True)
+        if not known:
+            return None
+        return known + [t for t in DEFAULT_TEMPERATURES if score(t) is None]
+
+    @staticmethod
+    def options(plan, start, k=1):
+        """
+        試行start（0始まり）から候補k個分の生成オプション（温度・seed）
+        温度の記録がなければ、1件ずつの生成はモデルの既定のまま（オプションなし）、投機的生成の候補は既定の温度の順でずらす
+        """
+        temperatures = plan["temperatures"]
+        if temperatures is None:
+            if k == 1:
+                return [{}]
+            return [{"options": {"seed": plan["seed"] + start + i,
+                                 "temperature": DEFAULT_TEMPERATURES[i % len(DEFAULT_TEMPERATURES)]}} for i in range(k)]
+        return [{"options": {"seed": plan["seed"] + start + i, "temperature": temperatures[(start + i) % len(temperatures)]}}
+                for i in range(k)]
+
+    def record_attempt(self, plan, options, ok):
+        """候補1つの合否を、その温度の記録に加える"""
+        temperature = str(((options or {}).get("options") or {}).get("temperature"))
+        with self._lock:
+            for key in plan["keys"]:
+                entry = self._entry(key)["temperatures"].setdefault(temperature, [0, 0])
+                entry[0] += 1
+                entry[1] += int(bool(ok))
+            self._dirty = True
+
+    def record_job(self, plan, ok, attempts):
+        """ジョブ1件（このモデルでの生成）の結果を記録する"""
+        if not attempts:
+            return
+        with self._lock:
+            for key in plan["keys"]:
+                entry = self._entry(key)
+                entry["jobs"] += 1
+                entry["attempts"] += attempts
+                if ok:
+                    entry["solved"] += 1
+                    entry["solved_at"][str(attempts)] = entry["solved_at"].get(str(attempts), 0) + 1
+            self._dirty = True
+
+    def stats(self):
+        """パスごとの記録（合格率・平均生成回数付き）を返す"""
+        with self._lock:
+            return {
+                key: {"jobs": e["jobs"], "solved": e["solved"], "attempts": e["attempts"],
+                      "rate": e["solved"] / e["attempts"] if e["attempts"] else None}
+                for key, e in sorted(self._stats.items()) if not key.startswith("*|")
+            }
@@ -0,0 +1,262 @@
+"""
+生成コードの実行検査用サンドボックス（常駐ワーカーのプール）
+- あらかじめ起動しておいたPythonプロセス（ワーカー）に候補のコードを渡して実行し、標準出力・例外を受け取る
+- ワーカーは候補ごとにforkした子プロセスで実行する（インタプリタの起動を候補ごとに行わないので数ミリ秒で済む）
+- 子プロセスにはメモリ・CPU時間の上限をかけ、時間内に終わらなければ強制終了する
+- 候補は使い捨ての一時ディレクトリをカレントディレクトリにして実行する（相対パスでリポジトリのファイルを書き換えないように）
+- forkできない環境ではワーカー自身が実行し、時間切れの場合はワーカーを起動し直す
+"""
+import json
+import os
+import queue
+import select
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# input()で読まれる標準入力（数値・文字列のどちらとしても読める値）
+DEFAULT_STDIN = "3\n" * 100
+DEFAULT_TIMEOUT = 2.0
+DEFAULT_MEMORY_MB = 256
+MAX_OUTPUT = 4000
+
+
+class SandboxPool:
+    def __init__(self, size=2, timeout=DEFAULT_TIMEOUT, memory_mb=DEFAULT_MEMORY_MB, stdin=DEFAULT_STDIN, max_output=MAX_OUTPUT):
+        """
+        Args:
+            size (int): 常駐させるワーカー数（同時に実行できる候補数）
+            timeout (float): 1候補の実行時間の上限（秒）
+            memory_mb (int): 1候補のメモリ（アドレス空間）の上限（MB）
+            stdin (str): 候補のinput()に渡す標準入力
+            max_output (int): 保持する標準出力の文字数の上限
+        """
+        self.timeout = timeout
+        self.options = {"timeout": timeout, "memory_mb": memory_mb, "stdin": stdin, "max_output": max_output}
+        self._idle = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.failures = 0
+        self.restarts = 0
+        workers = [self._start_worker(wait=False) for _ in range(max(1, size))]
+        # 全ワーカーを同時に起動してから、起動完了（ready）を待つ
+        for worker in workers:
+            self._wait_ready(worker)
+            self._idle.put(worker)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _start_worker(self, wait=True):
+        worker = subprocess.Popen([sys.executable, "-u", os.path.abspath(__file__)],
+                                  stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                  text=True, encoding="utf-8")
+        with self._lock:
+            self._workers.append(worker)
+        if wait:
+            self._wait_ready(worker)
+        return worker
+
+    def _wait_ready(self, worker):
+        if _readline(worker.stdout, 30) is None:
+            raise RuntimeError("サンドボックスのワーカーが起動しませんでした")
+
+    def _restart(self, worker):
+        worker.kill()
+        worker.wait()
+        with self._lock:
+            self._workers.remove(worker)
+            self.restarts += 1
+        return self._start_worker()
+
+    def run(self, code):
+        """
+        コードを実行する
+        Returns: dict {'ok', 'stdout', 'error', 'sec'}  ok: 例外・時間切れ・強制終了なしに終了したか
+        """
+        worker = self._idle.get()
+        start = time.perf_counter()
+        try:
+            worker.stdin.write(json.dumps({"code": code, **self.options}) + "\n")
+            worker.stdin.flush()
+            line = _readline(worker.stdout, self.timeout + 5)
+            if line:
+                result = json.loads(line)
+            else:
+                # ワーカー自身が応答しない（forkできない環境での時間切れなど）
+                result = {"ok": False, "stdout": "", "error": f"Timeout: {self.timeout}秒以内に終了しませんでした"}
+                worker = self._restart(worker)
+        except (OSError, ValueError) as e:
+            result = {"ok": False, "stdout": "", "error": f"SandboxError: {e}"}
+            worker = self._restart(worker)
+        finally:
+            self._idle.put(worker)
+        result["sec"] = time.perf_counter() - start
+        with self._lock:
+            self.runs += 1
+            self.failures += int(not result["ok"])
+        return result
+
+    def close(self):
+        """ワーカーを終了する"""
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            try:
+                worker.stdin.close()
+            except OSError:
+                pass
+            try:
+                worker.wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                worker.kill()
+                worker.wait()
+
+    def stats(self):
+        """実行数・失敗数・ワーカーの再起動数を返す"""
+        with self._lock:
+            return {"runs": self.runs, "failures": self.failures, "restarts": self.restarts}
+
+
+def _readline(stream, timeout):
+    """streamから1行読む（timeout秒以内に読めなければNone）"""
+    if os.name != "nt":
+        ready, _, _ = select.select([stream], [], [], timeout)
+        if not ready:
+            return None
+        return stream.readline() or None
+    # Windowsではパイプにselectを使えないので別スレッドで読む
+    box = []
+    reader = threading.Thread(target=lambda: box.append(stream.readline()), daemon=True)
+    reader.start()
+    reader.join(timeout)
+    return box[0] if box and box[0] else None
+
+
+# ---- ここからワーカープロセス側 ----
+
+def _execute(request, workdir=None):
+    """
+    コードを実行し、結果（dict）を返す（ワーカー・forkした子プロセスの中で呼ばれる）
+    workdir: 実行中のカレントディレクトリ（Noneなら一時ディレクトリを作り、実行後に削除する）
+    """
+    import contextlib
+    import io
+    stdout = io.StringIO()
+    sys.stdin = io.StringIO(request["stdin"])
+    result = {"ok": True, "stdout": "", "error": None}
+    cwd = os.getcwd()
+    temporary = workdir is None
+    if temporary:
+        workdir = tempfile.mkdtemp(prefix="degap_sandbox_")
+    try:
+        os.chdir(workdir)
+        with contextlib.redirect_stdout(stdout):
+            exec(compile(request["code"], "<candidate>", "exec"), {"__name__": "__main__"})
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            result.update(ok=False, error=f"SystemExit: {e.code}")
+    except BaseException as e:
+        result.update(ok=False, error=f"{type(e).__name__}: {e}")
+    finally:
+        os.chdir(cwd)
+        if temporary:
+            shutil.rmtree(workdir, ignore_errors=True)
+    result["stdout"] = stdout.getvalue()[:request["max_output"]]
+    return result
+
+
+def _run_forked(request):
+    """子プロセスをforkして実行する（メモリ・CPU時間の上限付き、時間切れなら強制終了）"""
+    # 一時ディレクトリは親で作って消す（時間切れで子プロセスを強制終了した場合も残さない）
+    workdir = tempfile.mkdtemp(prefix="degap_sandbox_")
+    try:
+        return _fork_and_wait(request, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _fork_and_wait(request, workdir):
+    """workdirをカレントディレクトリにして子プロセスで実行し、結果を待つ"""
+    import signal
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            import resource
+            memory = request["memory_mb"] * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+            cpu = int(request["timeout"]) + 1
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu))
+        except (ImportError, ValueError, OSError):
+            pass
+        # 候補が標準出力・標準エラーに直接書いてもワーカーとの通信を壊さないようにする
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        try:
+            data = json.dumps(_execute(request, workdir)).encode("utf-8")
+        except BaseException as e:
+            data = json.dumps({"ok": False, "stdout": "", "error": f"{type(e).__name__}: {e}"}).encode("utf-8")
+        with os.fdopen(write_fd, "wb") as f:
+            f.write(data)
+        os._exit(0)
+    os.close(write_fd)
+    chunks = []
+    deadline = time.monotonic() + request["timeout"]
+    timed_out = False
+    with os.fdopen(read_fd, "rb") as f:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                timed_out = True
+                break
+            ready, _, _ = select.select([f], [], [], remaining)
+            if not ready:
+                continue
+            chunk = os.read(f.fileno(), 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    if timed_out:
+        os.kill(pid, signal.SIGKILL)
+    _, status = os.waitpid(pid, 0)
+    if timed_out:
+        return {"ok": False, "stdout": "", "error": f"Timeout: {request['timeout']}秒以内に終了しませんでした"}
+    try:
+        return json.loads(b"".join(chunks))
+    except ValueError:
+        sig = os.WTERMSIG(status) if os.WIFSIGNALED(status) else None
+        return {"ok": False, "stdout": "", "error": f"Killed: signal {sig}" if sig else "Crashed"}
+
+
+def _worker_main():
+    """1行1件のJSONで候補を受け取り、実行結果を1行のJSONで返す"""
+    # 実行時に使うモジュールを先に読み込んでおき、起動完了を知らせる
+    import contextlib  # noqa: F401
+    import io  # noqa: F401
+    import signal  # noqa: F401
+    try:
+        import resource  # noqa: F401
+    except ImportError:
+        pass
+    stdin, stdout = sys.stdin, sys.stdout
+    stdout.write("ready\n")
+    stdout.flush()
+    for line in stdin:
+        request = json.loads(line)
+        result = _run_forked(request) if hasattr(os, "fork") else _execute(request)
+        stdout.write(json.dumps(result) + "\n")
+        stdout.flush()
+
+
+if __name__ == "__main__":
+    _worker_main()
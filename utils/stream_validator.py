@@ -0,0 +1,107 @@
+"""
+ストリーミング受信中のAI出力を逐次判定するモジュール
+- 受信済みテキストからコードブロックの完結した行だけを取り出し、制御構文パスを確定した順に求める
+- 必須要素・使用可能要素のどちらでもないパスが現れた時点で例外を送出し、受信（生成）を打ち切らせる
+"""
+import re
+
+from utils import analysis_engine, control_elements
+from utils.ai_generator import THINK_PATTERN, has_complete_code_block, partial_structured_code
+
+# コードブロックの開始（```python / ```）
+FENCE_OPEN_PATTERN = re.compile(r"```(?:python)?[^\n]*\n")
+_control_line_patterns = {}
+
+
+def control_line_pattern():
+    """行頭の制御キーワード（この行が届いたときだけ再解析する）のパターン（レジストリの語彙ごとにキャッシュ）"""
+    keywords = control_elements.get_control_elements()
+    pattern = _control_line_patterns.get(keywords)
+    if pattern is None:
+        words = "|".join(re.escape(k) for k in sorted(keywords, key=len, reverse=True))
+        pattern = _control_line_patterns[keywords] = re.compile(rf"^\s*(?:{words})\b", re.MULTILINE)
+    return pattern
+
+
+class ForbiddenElementInStream(Exception):
+    """ストリーミング中に禁止要素（必須・使用可能のどちらでもないパス）を検出したことを表す例外"""
+
+    def __init__(self, forbidden, paths, partial_code):
+        super().__init__(f"forbidden elements in stream: {', '.join(forbidden)}")
+        self.forbidden = forbidden
+        self.paths = paths
+        self.partial_code = partial_code
+
+    def to_info(self):
+        """check_code_elementsと同じ形式の判定情報（必須要素の不足は未確定なので空）"""
+        return {"missing": [], "forbidden": list(self.forbidden), "all_paths": list(self.paths)}
+
+
+def extract_partial_code(response):
+    """
+    受信途中のAI出力から、コードブロック内の完結した行（最後の改行まで）を返す
+    コードブロックがまだ始まっていない（<think>の途中も含む）場合はNone
+    高速モードの応答（{"code": "..."}）ではcodeの文字列の受信済みの部分を使う
+    """
+    code, complete = partial_structured_code(response)
+    if code is not None:
+        return code if complete else code[:code.rfind("\n") + 1]
+    lower = response.lower()
+    if lower.count('<think>') > lower.count('</think>'):
+        return None
+    response = THINK_PATTERN.sub('', response)
+    match = FENCE_OPEN_PATTERN.search(response)
+    if match is None:
+        return None
+    body = response[match.end():]
+    end = body.find("```")
+    if end >= 0:
+        return body[:end]
+    return body[:body.rfind("\n") + 1]
+
+
+class IncrementalPathValidator:
+    def __init__(self, required_elements, allowed_elements):
+        """
+        Args:
+            required_elements (list): 必ず含めるべきパス
+            allowed_elements (list): 含めてもよいパス
+        """
+        self.permitted = set(required_elements) | set(allowed_elements)
+        self.reset()
+
+    def reset(self):
+        """受信した内容を忘れる（別のホストで最初から受信し直す場合など）"""
+        self.paths = []
+        self._seen = set()
+        self._checked_len = 0
+
+    def feed(self, response):
+        """
+        受信済みテキスト全体を受け取り、新たに確定したパスのリストを返す
+        禁止パスが現れたらForbiddenElementInStreamを送出する
+        """
+        code = extract_partial_code(response)
+        if code is None or len(code) <= self._checked_len:
+            return []
+        new_text = code[self._checked_len:]
+        self._checked_len = len(code)
+        # 新しい行に制御キーワードがなければパスは増えないので再解析しない
+        if not control_line_pattern().search(new_text):
+            return []
+        paths = analysis_engine.analyze(code, partial=True)['paths']
+        new_paths = [p for p in dict.fromkeys(paths) if p not in self._seen]
+        self._seen.update(new_paths)
+        self.paths.extend(new_paths)
+        forbidden = [p for p in new_paths if p not in self.permitted]
+        if forbidden:
+            raise ForbiddenElementInStream(forbidden, self.paths, code)
+        return new_paths
+
+    def stop_when(self, response):
+        """OllamaClientのstop_whenとして使う（逐次判定し、コードブロックが閉じたら受信を打ち切る）"""
+        self.feed(response)
+        return has_complete_code_block(response)
+
+    # インスタンスをそのままstop_whenに渡せるようにする（OllamaPoolClientは再試行の前にresetを呼ぶ）
+    __call__ = stop_when
@@ -0,0 +1,278 @@
+"""
+degapの計測（テレメトリ）モジュール
+- 処理段階（解析・プロンプト作成・AIリクエスト・コード抽出・判定・実行検査）ごとの所要時間を集計する
+- AIの応答に含まれる時間計測フィールド（Ollama: load_duration, prompt_eval_*, eval_*）を集計する
+- ジョブ・候補（attempt）ごとの記録をJSONL（1行1イベント）に書き出し、実行後に要約を表示する
+- 生成方法（高速モード: 思考なし・JSONスキーマ / 通常: 自由記述）ごとの1リクエストあたりの生成トークン数・時間を集計し、
+  高速モードの削減量を通常の生成（同じ実行、なければ過去の実行の記録）と比べて表示する
+"""
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# 要約に表示する処理段階（この順で表示する）
+STAGES = ["parse", "prompt_build", "request", "extract", "check", "runtime"]
+
+# Ollamaの応答の時間計測フィールド（*_durationはナノ秒）
+MODEL_COUNT_FIELDS = ["prompt_eval_count", "eval_count"]
+MODEL_DURATION_FIELDS = ["total_duration", "load_duration", "prompt_eval_duration", "eval_duration"]
+
+# 生成方法ごとの集計（過去の実行分）の保存先
+DEFAULT_MODES_PATH = os.path.join(".degap_cache", "generation_modes.json")
+
+
+def model_metrics(data):
+    """AIの応答（完了時のメッセージ）から時間計測フィールドだけを取り出す"""
+    return {k: data[k] for k in MODEL_COUNT_FIELDS + MODEL_DURATION_FIELDS if k in data}
+
+
+class Telemetry:
+    def __init__(self, trace_path=None):
+        """
+        Args:
+            trace_path (str): JSONLの記録の出力先（Noneなら集計のみ）
+        """
+        self.trace_path = trace_path
+        self._lock = threading.Lock()
+        self._file = open(trace_path, "w", encoding="utf-8") if trace_path else None
+        self._start = time.perf_counter()
+        self.stage_seconds = defaultdict(float)
+        self.stage_counts = defaultdict(int)
+        self.model_totals = defaultdict(int)
+        self.model_requests = 0
+        self.incomplete_requests = 0
+        self.think_chars = 0
+        self.response_chars = 0
+        # モデル → 生成方法（"fast" / "text"） → {"requests", "eval_tokens", "sec"}
+        self.mode_totals = defaultdict(lambda: defaultdict(lambda: {"requests": 0, "eval_tokens": 0, "sec": 0.0}))
+        self.jobs = []
+
+    def bind(self, **fields):
+        """記録にfieldsを付けるビュー（ジョブ・候補ごとに使う）"""
+        return BoundTelemetry(self, fields)
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(stage, time.perf_counter() - start)
+
+    def add_stage(self, stage, seconds):
+        with self._lock:
+            self.stage_seconds[stage] += seconds
+            self.stage_counts[stage] += 1
+
+    def timed(self, stage, func):
+        """funcの呼び出しをstageとして計測する関数を返す"""
+        def wrapper(*args, **kwargs):
+            with self.span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def add_model_metrics(self, metrics, response=""):
+        """1リクエスト分のAIの時間計測フィールドと、応答中の<think>の文字数を集計する"""
+        from utils.ai_generator import THINK_PATTERN
+        think = sum(len(m) for m in THINK_PATTERN.findall(response))
+        with self._lock:
+            self.model_requests += 1
+            self.think_chars += think
+            self.response_chars += len(response)
+            # ストリーミングを途中で打ち切った場合は完了時のメッセージ（時間計測フィールド）がない
+            if "eval_count" not in metrics:
+                self.incomplete_requests += 1
+                return
+            for k, v in metrics.items():
+                if k in MODEL_COUNT_FIELDS or k in MODEL_DURATION_FIELDS:
+                    self.model_totals[k] += v
+            mode = self.mode_totals[str(metrics.get("model"))]["fast" if metrics.get("structured") else "text"]
+            mode["requests"] += 1
+            mode["eval_tokens"] += metrics["eval_count"]
+            mode["sec"] += metrics.get("total_duration", 0) / 1e9
+
+    def record(self, event, **fields):
+        """イベントを1行のJSONとして書き出す（event="job"はジョブの要約にも使う）"""
+        entry = {"event": event, "time": round(time.perf_counter() - self._start, 6), **fields}
+        with self._lock:
+            if event == "job":
+                self.jobs.append(entry)
+            if self._file is not None:
+                self._file.write(json.dumps(entry, ensure_ascii=False, default=list) + "\n")
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def summary(self):
+        """
+        実行全体の要約を返す
+        Returns: dict {'wall_sec', 'stages', 'model', 'modes', 'jobs'}
+          modes: モデル → 生成方法（"fast" / "text"） → {'requests', 'eval_tokens', 'sec'}
+        """
+        with self._lock:
+            wall = time.perf_counter() - self._start
+            stages = {s: {"sec": self.stage_seconds[s], "count": self.stage_counts[s]}
+                      for s in STAGES + sorted(set(self.stage_seconds) - set(STAGES)) if self.stage_counts[s]}
+            totals = dict(self.model_totals)
+            eval_sec = totals.get("eval_duration", 0) / 1e9
+            prompt_sec = totals.get("prompt_eval_duration", 0) / 1e9
+            model = {
+                "requests": self.model_requests,
+                "incomplete_requests": self.incomplete_requests,
+                "load_sec": totals.get("load_duration", 0) / 1e9,
+                "prompt_eval_sec": prompt_sec,
+                "eval_sec": eval_sec,
+                "prompt_tokens": totals.get("prompt_eval_count", 0),
+                "eval_tokens": totals.get("eval_count", 0),
+                "eval_tokens_per_sec": totals.get("eval_count", 0) / eval_sec if eval_sec else None,
+                "prompt_tokens_per_sec": totals.get("prompt_eval_count", 0) / prompt_sec if prompt_sec else None,
+                # 応答のうち<think>...</think>が占める割合（生成トークン中の思考トークンの目安）
+                "think_ratio": self.think_chars / self.response_chars if self.response_chars else None,
+            }
+            modes = {m: {mode: dict(v) for mode, v in by_mode.items()} for m, by_mode in self.mode_totals.items()}
+            by_element = defaultdict(list)
+            sources = defaultdict(int)
+            for job in self.jobs:
+                by_element[job.get("learning_element")].append(job.get("attempts", 0))
+                sources[job.get("source")] += 1
+        jobs = {
+            "count": sum(sources.values()),
+            "sources": dict(sources),
+            "attempts_by_element": {
+                elem: {"jobs": len(a), "attempts": sum(a), "max": max(a)} for elem, a in sorted(by_element.items())
+            },
+        }
+        return {"wall_sec": wall, "stages": stages, "model": model, "modes": modes, "jobs": jobs}
+
+    def format_summary(self, history=None):
+        """
+        要約を表示用の文字列にする
+        history: 過去の実行の生成方法ごとの集計（load_mode_history。高速モードの削減量の比較に使う）
+        """
+        s = self.summary()
+        lines = [f"実行時間: {s['wall_sec']:.2f}s"]
+        for stage, v in s["stages"].items():
+            lines.append(f"  {stage:<13} {v['sec']:8.3f}s ({v['count']}回)")
+        m = s["model"]
+        tps = f"{m['eval_tokens_per_sec']:.1f}" if m["eval_tokens_per_sec"] else "-"
+        think = f"{m['think_ratio']:.0%}" if m["think_ratio"] is not None else "-"
+        lines.append(f"AI: リクエスト {m['requests']}回（打ち切り {m['incomplete_requests']}回） "
+                     f"モデル読み込み {m['load_sec']:.2f}s / プロンプト評価 {m['prompt_eval_sec']:.2f}s ({m['prompt_tokens']} tokens) / "
+                     f"生成 {m['eval_sec']:.2f}s ({m['eval_tokens']} tokens, {tps} tokens/s, 思考の割合 {think})")
+        j = s["jobs"]
+        lines.append(f"ジョブ: {j['count']}件 {j['sources']}")
+        for elem, v in j["attempts_by_element"].items():
+            lines.append(f"  {elem}: {v['jobs']}件 生成回数 {v['attempts']}（最大 {v['max']}）")
+        lines += format_mode_savings(s["modes"], history)
+        return "\n".join(lines)
+
+
+def per_request(totals):
+    """集計（requests, eval_tokens, sec）を1リクエストあたりにする（リクエストがなければNone）"""
+    if not totals or not totals.get("requests"):
+        return None
+    return {"eval_tokens": totals["eval_tokens"] / totals["requests"], "sec": totals["sec"] / totals["requests"]}
+
+
+def mode_savings(modes, history=None):
+    """
+    高速モードを使ったモデルごとに、通常の生成と比べた1リクエストあたりの削減率を返す
+    通常の生成は同じ実行の記録を優先し、なければhistory（過去の実行）の記録を使う
+    Returns: dict モデル → {'fast', 'text', 'baseline' ("run" / "history" / None), 'token_saving', 'time_saving'}
+    """
+    result = {}
+    for model, by_mode in modes.items():
+        fast = per_request(by_mode.get("fast"))
+        if fast is None:
+            continue
+        text, baseline = per_request(by_mode.get("text")), "run"
+        if text is None:
+            text, baseline = per_request(((history or {}).get(model) or {}).get("text")), "history"
+        if text is None:
+            result[model] = {"fast": fast, "text": None, "baseline": None, "token_saving": None, "time_saving": None}
+            continue
+        result[model] = {
+            "fast": fast, "text": text, "baseline": baseline,
+            "token_saving": 1 - fast["eval_tokens"] / text["eval_tokens"] if text["eval_tokens"] else None,
+            "time_saving": 1 - fast["sec"] / text["sec"] if text["sec"] else None,
+        }
+    return result
+
+
+def format_mode_savings(modes, history=None):
+    """mode_savingsを表示用の行のリストにする"""
+    lines = []
+    for model, saving in mode_savings(modes, history).items():
+        fast = saving["fast"]
+        line = f"高速モード（{model}）: 1リクエストあたり 生成 {fast['eval_tokens']:.0f} tokens / {fast['sec']:.2f}s"
+        text = saving["text"]
+        if text is None:
+            line += "（通常の生成の記録がないため比較できません）"
+        else:
+            where = "この実行" if saving["baseline"] == "run" else "過去の実行"
+            tokens = f"{saving['token_saving']:.0%}" if saving["token_saving"] is not None else "-"
+            sec = f"{saving['time_saving']:.0%}" if saving["time_saving"] is not None else "-"
+            line += f"（通常の生成［{where}］ {text['eval_tokens']:.0f} tokens / {text['sec']:.2f}s、削減: トークン {tokens} / 時間 {sec}）"
+        lines.append(line)
+    return lines
+
+
+def load_mode_history(path=DEFAULT_MODES_PATH):
+    """過去の実行の生成方法ごとの集計（なければ空）"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("models", {})
+    except (OSError, ValueError):
+        return {}
+
+
+def save_mode_history(modes, path=DEFAULT_MODES_PATH):
+    """この実行の生成方法ごとの集計を過去の集計に足して保存する"""
+    from utils.file_utils import atomic_write_json
+    if not modes:
+        return
+    history = load_mode_history(path)
+    for model, by_mode in modes.items():
+        for mode, totals in by_mode.items():
+            entry = history.setdefault(str(model), {}).setdefault(mode, {"requests": 0, "eval_tokens": 0, "sec": 0.0})
+            for k in entry:
+                entry[k] += totals[k]
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    atomic_write_json(path, {"models": history})
+
+
+class BoundTelemetry:
+    """Telemetryに記録用のフィールドを付けたビュー（処理段階の時間はこのビューごとにも集計する）"""
+
+    def __init__(self, telemetry, fields):
+        self.telemetry = telemetry
+        self.fields = fields
+        self.stages = defaultdict(float)
+        self.model_metrics = {}
+
+    def bind(self, **fields):
+        return BoundTelemetry(self.telemetry, {**self.fields, **fields})
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.stages[stage] += seconds
+            self.telemetry.add_stage(stage, seconds)
+
+    def add_model_metrics(self, metrics, response=""):
+        self.model_metrics = dict(metrics)
+        self.telemetry.add_model_metrics(metrics, response)
+
+    def record(self, event, **fields):
+        self.telemetry.record(event, **self.fields, **fields)